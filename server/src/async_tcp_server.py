@@ -0,0 +1,273 @@
+"""Async TCP Server."""
+
+import asyncio
+import concurrent.futures
+import log
+import threading
+
+from document_registry import DocumentRegistryError
+from json_package import JSONPackage
+from json_package import JSONPackageError
+from request_handler import JSON_TOKEN
+from request_handler import RequestHandler
+from request_handler import get_subscription
+from tcp_server import MAX_BATCH_SIZE
+from tcp_server import PUSH_INTERVAL
+
+
+# Number of threads to handle the requests.
+NUM_WORKERS = 4
+
+
+class AsyncTCPServer(threading.Thread):
+    """A thread to be the tcp server, serves all the connections in one loop.
+
+    Unlike TCPServer, it does not create a thread for each connection, the
+    sockets are served by an asyncio event loop, and only the requests are
+    handled by a fixed number of worker threads, so the loop keeps serving the
+    other connections while a document is busy.
+
+    Attributes:
+        _port: Port number.
+        _document_registry: An instance of DocumentRegistry.
+        _num_workers: Number of threads to handle the requests.
+        _server: The asyncio server, None if it is not built.
+        _loop: The event loop, None if it is not running.
+        _stop_event: An asyncio.Event to stop the loop.
+        _executor: The executor to handle the requests.
+        _connection_tasks: Set of the tasks serving the connections.
+        _stop_flag: Flag for stopping.
+    """
+    def __init__(self, port, document_registry, num_workers=NUM_WORKERS):
+        """Constructor.
+
+        Args:
+            port: Port number.
+            document_registry: An instance of DocumentRegistry.
+            num_workers: Number of threads to handle the requests.
+        """
+        super(AsyncTCPServer, self).__init__()
+        self._port = port
+        self._document_registry = document_registry
+        self._num_workers = num_workers
+        self._server = None
+        self._loop = None
+        self._stop_event = None
+        self._executor = None
+        self._connection_tasks = set()
+        self._stop_flag = False
+
+    @property
+    def port(self):
+        """Gets the port of this server.  None for unconnected case."""
+        return self._port if self._server else None
+
+    def run(self):
+        """Runs the thread."""
+        asyncio.run(self._serve())
+
+    def stop(self):
+        """Stops the thread.
+
+        Like TCPServer.stop(), it returns after the requests being handled are
+        done, so no one commits after that.
+        """
+        self._stop_flag = True
+        if self._loop:
+            try:
+                self._loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass  # The loop is already closed.
+        if self.is_alive() and threading.current_thread() is not self:
+            # The loop shuts down the executor after closing the connections.
+            self.join()
+
+    async def _serve(self):
+        """Serves until stopping."""
+        self._stop_event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        if self._stop_flag:
+            return
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            self._num_workers)
+        await self._build()
+        if self._server:
+            await self._stop_event.wait()
+            self._server.close()
+            for task in list(self._connection_tasks):
+                task.cancel()
+            await asyncio.gather(*self._connection_tasks,
+                                 return_exceptions=True)
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+
+    async def _build(self):
+        """Creates the server."""
+        timeout = 1
+        while not self._stop_flag and not self._server:
+            try:
+                self._server = await asyncio.start_server(
+                    self._handle_connection, '', self._port, backlog=1024)
+            except OSError as e:
+                log.error(str(e) + '\n')
+                log.info('Try it %d second(s) later.\n' % timeout)
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                timeout *= 2
+        if self._server:
+            log.info('Successfully built the tcp server.\n')
+
+    async def _handle_connection(self, reader, writer):
+        """Serves a connection until the client closes it.
+
+        Args:
+            reader: The asyncio.StreamReader of the connection.
+            writer: The asyncio.StreamWriter of the connection.
+        """
+        log.info('Client %r connect to server.\n' %
+                 str(writer.get_extra_info('peername')))
+        task = asyncio.current_task()
+        self._connection_tasks.add(task)
+        request_handler = RequestHandler(self._document_registry)
+        # The requests arrived while handling the previous ones are handled
+        # together as batches of at most MAX_BATCH_SIZE.
+        bodies = asyncio.Queue()
+        receiving = asyncio.ensure_future(self._recv_requests(reader, bodies))
+        try:
+            closed = False
+            while not closed:
+                batch = [await bodies.get()]
+                while not bodies.empty() and len(batch) < MAX_BATCH_SIZE:
+                    batch.append(bodies.get_nowait())
+                closed = None in batch
+                batch = [body for body in batch if body is not None]
+                response, subscription = await self._loop.run_in_executor(
+                    self._executor, _handle_requests, request_handler, batch)
+                writer.writelines(response)
+                await writer.drain()
+                if subscription:
+                    await self._push_updates(writer, receiving, *subscription)
+                    break
+        except (ConnectionError, OSError) as e:
+            log.error(str(e))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            receiving.cancel()
+            self._connection_tasks.discard(task)
+            writer.close()
+
+    async def _recv_requests(self, reader, bodies):
+        """Receives the requests until the connection closed.
+
+        Args:
+            reader: The asyncio.StreamReader of the connection.
+            bodies: An asyncio.Queue to put 2-tuples for the flags from
+                    JSONPackage.parse_header() and the bytes of the body of
+                    the requests, None is put at last.
+        """
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(JSONPackage.HEADER_LENGTH)
+                    length, flags = JSONPackage.parse_header(header)
+                    bodies.put_nowait((flags,
+                                       await reader.readexactly(length)))
+                except JSONPackageError as e:
+                    log.error(str(e))
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                log.error('Connection die.')
+        except (ConnectionError, OSError) as e:
+            log.error(str(e))
+        finally:
+            bodies.put_nowait(None)
+
+    async def _push_updates(self, writer, receiving, identity, name):
+        """Pushes the update notifications until the connection closed.
+
+        The changes are coalesced, at most one notification is sent in each
+        PUSH_INTERVAL, and the changes made by the user itself are skipped.
+
+        Args:
+            writer: The asyncio.StreamWriter of the connection.
+            receiving: The task receiving the requests, it is done after the
+                    connection closed.
+            identity: Identity of the subscribing user.
+            name: Name of the document.
+        """
+        changed, loop = asyncio.Event(), self._loop
+        def listener(iden):
+            if iden != identity:
+                try:
+                    loop.call_soon_threadsafe(changed.set)
+                except RuntimeError:
+                    pass  # The loop is already closed.
+        try:
+            await loop.run_in_executor(self._executor,
+                                       self._document_registry.subscribe,
+                                       name, listener)
+        except DocumentRegistryError as e:
+            log.error(str(e) + '\n')
+            return
+        waiter = None
+        try:
+            version = 0
+            while True:
+                waiter = asyncio.ensure_future(changed.wait())
+                await asyncio.wait([receiving, waiter],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if receiving.done():
+                    break
+                changed.clear()
+                version += 1
+                writer.writelines(
+                    JSONPackage({JSON_TOKEN.UPDATE: version}).pack())
+                await writer.drain()
+                await asyncio.sleep(PUSH_INTERVAL)
+        finally:
+            if waiter:
+                waiter.cancel()
+            # It waits for the lock of the document, which a worker can hold
+            # for a long commit, so it runs in a worker too.  The shield keeps
+            # it queued in the executor even if this task is cancelled again.
+            await asyncio.shield(loop.run_in_executor(
+                self._executor, self._document_registry.unsubscribe, name,
+                listener))
+
+
+def _handle_requests(request_handler, bodies):
+    """Handles a batch of requests in a worker thread.
+
+    Args:
+        request_handler: The instance of RequestHandler of the connection.
+        bodies: List of 2-tuples for the flags from
+                JSONPackage.parse_header() and the bytes of the requests'
+                bodies.
+
+    Return:
+        A 2-tuple for the list of buffers of the response packages and the
+        subscription from request_handler.get_subscription().
+    """
+    requests, binaries = [], []
+    for flags, body in bodies:
+        try:
+            package = JSONPackage()
+            package.unpack(body, flags)
+            requests.append(package.content)
+            binaries.append(package.binary)
+        except JSONPackageError as e:
+            log.error(str(e))
+    responses = request_handler.handle_batch(requests)
+    packed = []
+    for binary, response in zip(binaries, responses):
+        try:
+            # Responses in the same encoding as the request.
+            packed.extend(JSONPackage(
+                response, binary=binary,
+                compress=request_handler.compress).pack())
+        except JSONPackageError as e:
+            log.error(str(e))
+    return packed, get_subscription(requests, responses)
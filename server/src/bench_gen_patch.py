@@ -0,0 +1,151 @@
+#! /usr/bin/env python3
+
+"""Benchmark of generating the line patches of the sync responses.
+
+It measures request_handler.gen_patch() and the original one built on
+difflib.Differ on the Python sources of the standard library, for a line
+edited, 20 lines edited, a 200-line paste and the initial sync from an empty
+buffer.
+
+    python3 bench_gen_patch.py
+"""
+
+import difflib
+import glob
+import os
+import random
+import time
+
+import request_handler
+import rope
+
+
+# Numbers of the lines of the texts.
+SIZES = (10000, 30000, 100000)
+
+
+def _squash_patch(patch_info):
+    """The original _squash_patch() of gen_patch().
+
+    Args:
+        patch_info: Information of patches.
+
+    Return:
+        A list of replacing information.
+    """
+    ret, index = [], 0
+    while index < len(patch_info):
+        lines = patch_info[index][2]
+        index2 = index + 1
+        while index2 < len(patch_info) and \
+              patch_info[index2 - 1][1] >= patch_info[index2][0]:
+            lines += patch_info[index2][2]
+            index2 += 1
+        ret.append((patch_info[index][0], patch_info[index2 - 1][1], lines))
+        index = index2
+    return ret
+
+
+def _gen_patch_by_differ(orig_lines, new_lines):
+    """The original gen_patch(), which compares the lines by difflib.Differ.
+
+    Args:
+        orig_lines: Original lines of the text.
+        new_lines: New lines of the text.
+
+    Return:
+        A list of replacing information.
+    """
+    diff_result = list(difflib.Differ().compare(orig_lines, new_lines))
+    orig_index, ret = 0, []
+    for line in diff_result:
+        if line.startswith('  '):
+            orig_index += 1
+        elif line.startswith('+ '):
+            ret.append((orig_index, orig_index, [line[2 : ]]))
+        elif line.startswith('- '):
+            ret.append((orig_index, orig_index + 1, []))
+            orig_index += 1
+    return _squash_patch(ret)
+
+
+def _source_lines(num_lines):
+    """Reads the lines of the Python sources of the standard library.
+
+    Args:
+        num_lines: Number of the lines.
+
+    Return:
+        List of the lines.
+    """
+    ret = []
+    for filename in sorted(glob.glob(os.path.join(
+            os.path.dirname(os.__file__), '*.py'))):
+        with open(filename, errors='replace') as f:
+            ret += f.read().split('\n')
+        if len(ret) >= num_lines:
+            break
+    return ret[ : num_lines]
+
+
+def _edit_lines(rand, lines, num_edits):
+    """Appends a comment to some random lines.
+
+    Args:
+        rand: An instance of random.Random.
+        lines: The original lines.
+        num_edits: Number of the lines to edit.
+
+    Return:
+        The new lines.
+    """
+    ret = list(lines)
+    for _ in range(num_edits):
+        row = rand.randrange(len(ret))
+        ret[row] += '  # edited'
+    return ret
+
+
+def _measure(gen_patch_func, orig_lines, new_lines):
+    """Measures the time of generating a patch.
+
+    Args:
+        gen_patch_func: The function to generate the patch.
+        orig_lines: Original lines of the text.
+        new_lines: New lines of the text.
+
+    Return:
+        Milliseconds of generating the patch.
+    """
+    begin = time.perf_counter()
+    patch = gen_patch_func(orig_lines, new_lines)
+    ret = (time.perf_counter() - begin) * 1000
+    assert rope.LineView(orig_lines).apply_patch(patch).lines == new_lines
+    return ret
+
+
+def main():
+    """Prints the time of both functions for each case."""
+    rand = random.Random(0)
+    all_lines = _source_lines(max(SIZES) + 200)
+    print('%7s  %-16s  %12s  %12s' % ('lines', 'case', 'difflib',
+                                       'gen_patch'))
+    for size in SIZES:
+        lines = all_lines[ : size]
+        middle = size // 2
+        cases = [
+            ('1 line edited', lines, _edit_lines(rand, lines, 1)),
+            ('20 lines edited', lines, _edit_lines(rand, lines, 20)),
+            ('200-line paste', lines,
+             lines[ : middle] + all_lines[-200 : ] + lines[middle : ]),
+            ('init', [''], lines),
+        ]
+        for name, orig_lines, new_lines in cases:
+            print('%7d  %-16s  %9.2f ms  %9.2f ms' % (
+                size, name,
+                _measure(_gen_patch_by_differ, orig_lines, new_lines),
+                _measure(request_handler.gen_patch, orig_lines, new_lines)))
+
+
+if __name__ == '__main__':
+    main()
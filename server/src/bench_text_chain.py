@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+
+"""Benchmark of looking up and committing in TextChain with many users.
+
+Each user keeps a commit of a 10 KB text and commits one-character edits in
+turn, the number of users grows from 10 to 2000.  The time of getting a
+user's text and of a commit is printed for each number of users.
+
+The source directory of another tree can be given to measure it instead, ex:
+the tree before the commits were indexed by id:
+
+    git archive <commit>^ server/src | tar -x -C /tmp/before
+    python3 bench_text_chain.py /tmp/before/server/src
+"""
+
+import os
+import sys
+import time
+
+
+# Numbers of the users.
+NUMS_USERS = (10, 100, 500, 2000)
+
+# Number of the measured commits and lookups for each number of users.
+NUM_ROUNDS = 300
+
+# Number of the rows of the text, two bytes each.
+NUM_ROWS = 5000
+
+
+def _get_text(chain, commit_id):
+    """Gets the text of a commit.
+
+    Args:
+        chain: An instance of TextChain.
+        commit_id: Id of the commit.
+
+    Return:
+        The text, a string or an instance of rope.Rope.
+    """
+    if hasattr(chain, 'get_rope'):
+        return chain.get_rope(commit_id)
+    return chain.get_text(commit_id)
+
+
+def _commit_rows(chain, commit_id, begin_row, end_row, lines):
+    """Commits a text whose rows [begin_row, end_row) are replaced.
+
+    Args:
+        chain: An instance of TextChain.
+        commit_id: Id of the original commit.
+        begin_row: The first row to replace.
+        end_row: The row after the last row to replace.
+        lines: The new rows.
+
+    Return:
+        Id of the new commit.
+    """
+    text = _get_text(chain, commit_id)
+    if hasattr(chain, 'append_commit'):
+        commit = chain.prepare_commit_patch(text,
+                                            [(begin_row, end_row, lines)])
+        return chain.append_commit(commit_id, commit, [])[0]
+    rows = text.split('\n')
+    rows[begin_row : end_row] = lines
+    return chain.commit(commit_id, '\n'.join(rows), [])[0]
+
+
+def _measure(text_chain, num_users):
+    """Measures the lookups and commits of a number of users.
+
+    Args:
+        text_chain: The text_chain module.
+        num_users: Number of the users.
+
+    Return:
+        2-tuple for the microseconds of a lookup and the milliseconds of a
+        commit.
+    """
+    chain = text_chain.TextChain(os.devnull)
+    ids = [chain.new() for _ in range(num_users)]
+    ids[0] = _commit_rows(chain, ids[0], 0, 1, ['x'] * NUM_ROWS + [''])
+    for user in range(num_users):
+        # Moves every user onto the text.
+        ids[user] = _commit_rows(chain, ids[user], NUM_ROWS, NUM_ROWS + 1,
+                                 [''])
+    begin = time.perf_counter()
+    for i in range(NUM_ROUNDS):
+        user = i % num_users
+        ids[user] = _commit_rows(chain, ids[user], NUM_ROWS, NUM_ROWS + 1,
+                                 [str(i % 10)])
+    commit_time = (time.perf_counter() - begin) / NUM_ROUNDS * 1000
+    begin = time.perf_counter()
+    for i in range(NUM_ROUNDS):
+        _get_text(chain, ids[i % num_users])
+    lookup_time = (time.perf_counter() - begin) / NUM_ROUNDS * 1000000
+    return lookup_time, commit_time
+
+
+def main():
+    """Prints the time for each number of users."""
+    if len(sys.argv) > 1:
+        sys.path.insert(0, sys.argv[1])
+    import text_chain  # pylint: disable=C0415
+    print('%6s  %12s  %12s' % ('users', 'get text', 'commit'))
+    for num_users in NUMS_USERS:
+        lookup_time, commit_time = _measure(text_chain, num_users)
+        print('%6d  %9.1f us  %9.2f ms' % (num_users, lookup_time,
+                                           commit_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+
+"""Benchmark of the diff engines of the text commits.
+
+It measures text_diff.diff_texts() and the SequenceMatcher engine it replaced
+on LaTeX-like texts with a one-keystroke edit in the middle, which is what
+most commits look like.  The SequenceMatcher engine is only measured on the
+small texts, it takes seconds on the large ones.
+
+    python3 bench_text_diff.py
+"""
+
+import random
+import time
+
+import text_diff
+
+
+# Sizes of the texts in bytes.
+SIZES = (25000, 100000, 400000, 800000)
+
+# Largest text size to measure the SequenceMatcher engine.
+MAX_SEQUENCE_MATCHER_SIZE = 100000
+
+# Words of the LaTeX-like texts.
+WORDS = ('\\section{Intro}', '\\emph{x}', '$a+b$', 'lorem', 'ipsum', 'dolor',
+         'sit', 'amet')
+
+
+def _latex_text(rand, size):
+    """Creates a LaTeX-like text.
+
+    Args:
+        rand: An instance of random.Random.
+        size: Minimum length of the text.
+
+    Return:
+        The text.
+    """
+    lines, length = [], 0
+    while length < size:
+        line = ' '.join(rand.choice(WORDS)
+                        for _ in range(rand.randint(3, 12)))
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines)
+
+
+def _measure(diff_func, old_text, new_text):
+    """Measures the time of a diff engine.
+
+    Args:
+        diff_func: The diff engine.
+        old_text: The original text.
+        new_text: The new text.
+
+    Return:
+        Milliseconds of a diff.
+    """
+    times = max(1, int(0.2 / _time_once(diff_func, old_text, new_text)))
+    begin = time.perf_counter()
+    for _ in range(times):
+        diff_func(old_text, new_text)
+    return (time.perf_counter() - begin) / times * 1000
+
+
+def _time_once(diff_func, old_text, new_text):
+    """Measures the time of a diff once.
+
+    Args:
+        diff_func: The diff engine.
+        old_text: The original text.
+        new_text: The new text.
+
+    Return:
+        Seconds of the diff, at least one microsecond.
+    """
+    begin = time.perf_counter()
+    diff_func(old_text, new_text)
+    return max(time.perf_counter() - begin, 1e-6)
+
+
+def main():
+    """Prints the time of both engines on each text size."""
+    rand = random.Random(0)
+    print('%8s  %16s  %16s' % ('size', 'diff_texts', 'SequenceMatcher'))
+    for size in SIZES:
+        old_text = _latex_text(rand, size)
+        middle = len(old_text) // 2
+        new_text = old_text[ : middle] + 'x' + old_text[middle : ]
+        myers = _measure(text_diff.diff_texts, old_text, new_text)
+        if size <= MAX_SEQUENCE_MATCHER_SIZE:
+            seq_matcher = '%13.2f ms' % _measure(
+                text_diff.diff_texts_by_sequence_matcher, old_text, new_text)
+        else:
+            seq_matcher = '%16s' % '-'
+        print('%6d KB  %13.2f ms  %s' % (size // 1000, myers, seq_matcher))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+
+"""Benchmark of reading UsersTextManager while the users commit.
+
+Writer threads commit one-character edits on a 430 KB text while the reader
+threads each run an identity check, an authority check and an online-users
+query, like the request handler does before a sync.  The latency of the
+reads is printed.
+
+The source directory of another tree can be given to measure it instead, ex:
+the tree before the readers got the published snapshot:
+
+    git archive <commit>^ server/src | tar -x -C /tmp/before
+    python3 bench_users_text_manager.py /tmp/before/server/src
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+
+
+# Numbers of the threads.
+NUM_WRITERS = 4
+NUM_READERS = 28
+
+# Seconds to run.
+DURATION = 5
+
+# Seconds between two reads of a reader.
+READ_INTERVAL = 0.001
+
+# Rows of the text.
+TEXT_ROWS = ['lorem ipsum dolor sit amet ' * 4] * 4000
+
+
+def _get_row(manager, identity, row):
+    """Gets a row of a user's text.
+
+    Args:
+        manager: An instance of UsersTextManager.
+        identity: Identity of the user.
+        row: The row number.
+
+    Return:
+        The row.
+    """
+    if hasattr(manager, 'get_user_line_view'):
+        return manager.get_user_line_view(identity).lines[row]
+    return manager.get_user_text(identity).split('\n')[row]
+
+
+def _write(users_text_manager, manager, identity, stop):
+    """Commits one-character edits until stopping.
+
+    Args:
+        users_text_manager: The users_text_manager module.
+        manager: An instance of UsersTextManager.
+        identity: Identity of the user.
+        stop: A threading.Event to stop.
+    """
+    rand = random.Random(identity)
+    user_info = users_text_manager.UserInfo(mode=1, cursors={'.': 0})
+    while not stop.is_set():
+        row = rand.randrange(len(TEXT_ROWS))
+        line = _get_row(manager, identity, row)
+        col = rand.randint(0, len(line))
+        manager.patch_user_text(identity, user_info,
+                                [(row, row + 1,
+                                  [line[ : col] + 'x' + line[col : ]])])
+
+
+def _read(manager, identity, stop, latencies):
+    """Reads the users' information until stopping.
+
+    Args:
+        manager: An instance of UsersTextManager.
+        identity: Identity of the user.
+        stop: A threading.Event to stop.
+        latencies: List to append the seconds of each read.
+    """
+    while not stop.is_set():
+        begin = time.perf_counter()
+        users = manager.get_users_info()
+        if identity in users:
+            users[identity].authority  # pylint: disable=W0104
+        manager.get_users_info(without=[identity], must_online=True)
+        latencies.append(time.perf_counter() - begin)
+        time.sleep(READ_INTERVAL)
+
+
+def main():
+    """Prints the latency of the reads."""
+    if len(sys.argv) > 1:
+        sys.path.insert(0, sys.argv[1])
+    import users_text_manager  # pylint: disable=C0415
+    manager = users_text_manager.UsersTextManager(os.devnull)
+    identities = range(NUM_WRITERS + NUM_READERS)
+    for identity in identities:
+        manager.add_user(identity, 'user%d' % identity,
+                         users_text_manager.AUTHORITY.READWRITE)
+    user_info = users_text_manager.UserInfo(mode=1, cursors={'.': 0})
+    manager.patch_user_text(0, user_info, [(0, 1, TEXT_ROWS)])
+    for identity in identities:
+        # Moves every user onto the text.
+        manager.patch_user_text(identity, user_info, [])
+    stop, latencies = threading.Event(), []
+    threads = [threading.Thread(target=_write,
+                                args=(users_text_manager, manager, identity,
+                                      stop))
+               for identity in identities[ : NUM_WRITERS]]
+    threads += [threading.Thread(target=_read,
+                                 args=(manager, identity, stop, latencies))
+                for identity in identities[NUM_WRITERS : ]]
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    print('%d reads, p50 %.3f ms, p99 %.3f ms, max %.1f ms' % (
+        len(latencies), latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000,
+        latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
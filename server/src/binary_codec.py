@@ -0,0 +1,217 @@
+"""A compact binary encoding for the JSON objects of the packages.
+
+The layout is a subset of MessagePack with varint lengths:
+    0x00 - 0x7f: The integer itself.
+    0xc0: None.
+    0xc2, 0xc3: False, True.
+    0xd0 <varint>: An integer, zigzag encoded.
+    0xd8 <varint n> <varint size> <bytes>: A list of n strings without newline
+            characters, the bytes are the UTF-8 encoded lines joined by "\\n".
+    0xd9 <varint size> <bytes>: A UTF-8 encoded string.
+    0xdc <varint n> <items>: A list (tuples are encoded as lists).
+    0xde <varint n> <keys and values>: A dict.
+
+Most of the payload are the lines of the patches, so they are encoded by one
+join instead of one by one.
+"""
+
+
+# Version of the encoding, increases when the layout changes.
+VERSION = 1
+
+_ENCODING = 'utf-8'
+
+_MAX_FIXINT = 0x7f
+_NONE = 0xc0
+_FALSE = 0xc2
+_TRUE = 0xc3
+_INT = 0xd0
+_LINES = 0xd8
+_STR = 0xd9
+_LIST = 0xdc
+_DICT = 0xde
+
+
+class BinaryCodecError(Exception):
+    """Error raised by the binary codec."""
+    pass
+
+
+def dumps(obj):
+    """Encodes an object.
+
+    Args:
+        obj: The object, which consists of None, bool, int, str, list, tuple
+                and dict.
+
+    Return:
+        The bytes.
+    """
+    out = bytearray()
+    _dump(obj, out)
+    return bytes(out)
+
+
+def loads(data):
+    """Decodes an object.
+
+    Args:
+        data: The bytes or bytearray from dumps().
+
+    Return:
+        The object.
+    """
+    if not isinstance(data, bytearray):
+        data = bytearray(data)
+    try:
+        obj, pos = _load(data, 0)
+    except (IndexError, UnicodeError) as e:
+        raise BinaryCodecError('Cannot decode the bytes: %r' % e)
+    if pos != len(data):
+        raise BinaryCodecError('Extra bytes after the object.')
+    return obj
+
+
+def _dump(obj, out):
+    """Encodes an object to the end of a bytearray.
+
+    Args:
+        obj: The object.
+        out: The bytearray.
+    """
+    if obj is None:
+        out.append(_NONE)
+    elif obj is True or obj is False:
+        out.append(_TRUE if obj else _FALSE)
+    elif isinstance(obj, int):
+        if 0 <= obj <= _MAX_FIXINT:
+            out.append(obj)
+        else:
+            out.append(_INT)
+            _dump_varint(obj * 2 if obj >= 0 else -obj * 2 - 1, out)
+    elif isinstance(obj, str):
+        data = obj.encode(_ENCODING)
+        out.append(_STR)
+        _dump_varint(len(data), out)
+        out += data
+    elif isinstance(obj, (list, tuple)):
+        if obj and all(isinstance(item, str) for item in obj):
+            text = '\n'.join(obj)
+            if text.count('\n') == len(obj) - 1:
+                data = text.encode(_ENCODING)
+                out.append(_LINES)
+                _dump_varint(len(obj), out)
+                _dump_varint(len(data), out)
+                out += data
+                return
+        out.append(_LIST)
+        _dump_varint(len(obj), out)
+        for item in obj:
+            _dump(item, out)
+    elif isinstance(obj, dict):
+        out.append(_DICT)
+        _dump_varint(len(obj), out)
+        for key, value in obj.items():
+            _dump(key, out)
+            _dump(value, out)
+    else:
+        raise BinaryCodecError('Cannot encode the type %r.' % type(obj))
+
+
+def _dump_varint(num, out):
+    """Encodes a non-negative integer by 7 bits per byte.
+
+    Args:
+        num: The integer.
+        out: The bytearray.
+    """
+    while num > 0x7f:
+        out.append(num & 0x7f | 0x80)
+        num >>= 7
+    out.append(num)
+
+
+def _load(data, pos):
+    """Decodes an object from a position.
+
+    Args:
+        data: The bytearray.
+        pos: The position.
+
+    Return:
+        A 2-tuple for the object and the position after it.
+    """
+    tag, pos = data[pos], pos + 1
+    if tag <= _MAX_FIXINT:
+        return tag, pos
+    if tag == _NONE:
+        return None, pos
+    if tag in (_FALSE, _TRUE):
+        return tag == _TRUE, pos
+    if tag == _INT:
+        num, pos = _load_varint(data, pos)
+        return (num >> 1 if num & 1 == 0 else -(num >> 1) - 1), pos
+    if tag == _STR:
+        size, pos = _load_varint(data, pos)
+        return _load_str(data, pos, size), pos + size
+    if tag == _LINES:
+        num, pos = _load_varint(data, pos)
+        size, pos = _load_varint(data, pos)
+        lines = _load_str(data, pos, size).split('\n')
+        if len(lines) != num:
+            raise BinaryCodecError('Wrong number of lines.')
+        return lines, pos + size
+    if tag == _LIST:
+        num, pos = _load_varint(data, pos)
+        ret = []
+        for _ in range(num):
+            item, pos = _load(data, pos)
+            ret.append(item)
+        return ret, pos
+    if tag == _DICT:
+        num, pos = _load_varint(data, pos)
+        ret = {}
+        for _ in range(num):
+            key, pos = _load(data, pos)
+            if isinstance(key, (list, dict)):
+                raise BinaryCodecError('Unhashable key.')
+            ret[key], pos = _load(data, pos)
+        return ret, pos
+    raise BinaryCodecError('Unknown tag %r.' % tag)
+
+
+def _load_varint(data, pos):
+    """Decodes a non-negative integer encoded by _dump_varint().
+
+    Args:
+        data: The bytearray.
+        pos: The position.
+
+    Return:
+        A 2-tuple for the integer and the position after it.
+    """
+    num = data[pos]
+    if num <= 0x7f:
+        return num, pos + 1
+    num, shift = 0, 0
+    while data[pos] & 0x80:
+        num |= (data[pos] & 0x7f) << shift
+        shift += 7
+        pos += 1
+    return num | data[pos] << shift, pos + 1
+
+
+def _load_str(data, pos, size):
+    """Decodes a UTF-8 string.
+
+    Args:
+        data: The bytearray.
+        pos: Begin of the string.
+        size: Number of bytes of the string.
+
+    Return:
+        The string.
+    """
+    if pos + size > len(data):
+        raise BinaryCodecError('The string is truncated.')
+    return bytes(data[pos : pos + size]).decode(_ENCODING)
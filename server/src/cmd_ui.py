@@ -23,7 +23,7 @@ class CmdUI(cmd.Cmd):  # pylint: disable=R0904
     And it is also the main output interface of the whole program.
 
     Attributes:
-        _users_text_manager: An instance of UsersTextManager.
+        _document_registry: An instance of DocumentRegistry.
         _tcp_server: An instance of TcpServer.
         _shrvim_server: An instance of ShrVimServer.
         _exit_flag: Whether this UI should stop or not.
@@ -31,18 +31,18 @@ class CmdUI(cmd.Cmd):  # pylint: disable=R0904
         _init_cmds: Initialize commands.
     """
     def __init__(self,
-                 init_cmds, users_text_manager, tcp_server, shrvim_server):
+                 init_cmds, document_registry, tcp_server, shrvim_server):
         """Constructor.
 
         Args:
             init_cmds: Lists of commands to run after startup.
-            users_text_manager: An instance of UsersTextManager.
+            document_registry: An instance of DocumentRegistry.
             tcp_server: An instance of TCPServer.
             shrvim_server: An instance of ShrVimServer.
         """
         super(CmdUI, self).__init__()
         self.prompt = PROMPT
-        self._users_text_manager = users_text_manager
+        self._document_registry = document_registry
         self._tcp_server = tcp_server
         self._shrvim_server = shrvim_server
         self._stop_flag = False
@@ -53,12 +53,12 @@ class CmdUI(cmd.Cmd):  # pylint: disable=R0904
         """Adds a user, [usage] add <identity> <nickname> <authority>"""
         try:
             identity, nickname, authority_str = _split_text(text, 3)
-            if identity in self._users_text_manager.get_users_info():
+            if identity in self._document_registry.get_users_info():
                 self.write('The identity %r is already in used.\n' % identity)
                 return
             authority = authority_string_transformer.to_number(authority_str)
-            self._users_text_manager.add_user(identity, nickname, authority)
-            user_info = self._users_text_manager.get_users_info()[identity]
+            self._document_registry.add_user(identity, nickname, authority)
+            user_info = self._document_registry.get_users_info()[identity]
             self.write('Added %s => %s\n' % (identity, str(user_info)))
         except _SplitTextError:
             self.write('Format error!\n' +
@@ -70,10 +70,10 @@ class CmdUI(cmd.Cmd):  # pylint: disable=R0904
         """Deletes a user, [usage] delete <identity>"""
         try:
             identity = _split_text(text, 1)[0]
-            if identity not in self._users_text_manager.get_users_info():
+            if identity not in self._document_registry.get_users_info():
                 self.write('The identity %r is not in used.\n' % identity)
                 return
-            self._users_text_manager.delete_user(identity)
+            self._document_registry.delete_user(identity)
             self.write('Done\n')
         except _SplitTextError:
             self.write('Format error!\n' +
@@ -83,8 +83,8 @@ class CmdUI(cmd.Cmd):  # pylint: disable=R0904
         """Deletes all users, [usage] deleteall"""
         try:
             _split_text(text, 0)
-            for identity in self._users_text_manager.get_users_info():
-                self._users_text_manager.delete_user(identity)
+            for identity in self._document_registry.get_users_info():
+                self._document_registry.delete_user(identity)
             self.write('Done\n')
         except _SplitTextError:
             self.write('Format error!\n' +
@@ -94,11 +94,11 @@ class CmdUI(cmd.Cmd):  # pylint: disable=R0904
         """Resets a user, [usage] reset <identity>"""
         try:
             iden = _split_text(text, 1)[0]
-            if iden not in self._users_text_manager.get_users_info():
+            if iden not in self._document_registry.get_users_info():
                 self.write('The User with identity %r is not exist.\n' % iden)
                 return
-            self._users_text_manager.reset_user(iden)
-            user_info = self._users_text_manager.get_users_info()[iden]
+            self._document_registry.reset_user(iden)
+            user_info = self._document_registry.get_users_info()[iden]
             self.write('Reseted %s ==> %s\n' % (iden, str(user_info)))
         except _SplitTextError:
             self.write('Format error!\n' +
@@ -108,7 +108,7 @@ class CmdUI(cmd.Cmd):  # pylint: disable=R0904
         """Lists users, [usage] list"""
         try:
             _split_text(text, 0)
-            infos = self._users_text_manager.get_users_info().items()
+            infos = self._document_registry.get_users_info().items()
             for iden, user in sorted(infos, key=lambda x: x[0]):
                 self.write('%-10s => %s' % (iden, str(user)))
         except _SplitTextError:
@@ -119,7 +119,7 @@ class CmdUI(cmd.Cmd):  # pylint: disable=R0904
         """Lists online users, [usage] online"""
         try:
             _split_text(text, 0)
-            infos = self._users_text_manager.get_users_info(
+            infos = self._document_registry.get_users_info(
                 must_online=True).items()
             for iden, user in sorted(infos, key=lambda x: x[0]):
                 self.write('%-10s => %s' % (iden, str(user)))
@@ -149,7 +149,7 @@ class CmdUI(cmd.Cmd):  # pylint: disable=R0904
         try:
             filename = _split_text(text, 1)[0]
             with open(filename, 'w') as f:
-                users_info = self._users_text_manager.get_users_info().items()
+                users_info = self._document_registry.get_users_info().items()
                 for iden, user in sorted(users_info, key=lambda x: x[0]):
                     auth_str = authority_string_transformer.to_string(
                         user.authority)
@@ -0,0 +1,391 @@
+"""DocumentRegistry."""
+
+import contextlib
+import os
+import threading
+import time
+
+import text_journal
+
+from text_saver import TextSaver
+from users_text_manager import UsersTextManager
+
+
+# Seconds a document without any request stays loaded.
+IDLE_TIMEOUT = 600
+
+# Number of times per second to check the stop flag.
+FREQUENCY = 8
+
+# Seconds between checking the idle documents.
+CHECK_INTERVAL = 5
+
+# Suffixes of the files a document keeps beside its save file, which are the
+# journal and the journal being compacted.
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_SUFFIXES = (JOURNAL_SUFFIX, JOURNAL_SUFFIX + '.tmp')
+
+
+class DocumentRegistryError(Exception):
+    """Error raised by DocumentRegistry."""
+    pass
+
+class DocumentRegistry(threading.Thread):
+    """A thread hosts the documents and unloads the idle ones.
+
+    Each document has its own UsersTextManager, so the edits on different
+    documents never contend.  The users are shared by all the documents, so
+    adding/deleting a user applies to every loaded document, and a document
+    gets all the users when it is loaded.  A document is loaded at the first
+    request to it, the default document is always loaded.
+
+    Attributes:
+        _default_filename: Save file of the default document.
+        _documents_dir: Directory of the named documents, None for only the
+                default document.
+        _idle_timeout: Seconds a document without any request stays loaded.
+        _roster: A dict maps the user identity to 2-tuple (nick_name,
+                authority).
+        _documents: A dict maps the document name to the instance of
+                _Document, the default document's name is None.
+        _lock: A threading.Lock to protect the roster and the documents.
+        _stop_flag: Flag for stopping.
+        _stopped: Whether the documents are unloaded by stop(), no document
+                can be acquired after that.
+    """
+    def __init__(self, default_filename, documents_dir=None,
+                 idle_timeout=IDLE_TIMEOUT):
+        """Constructor.
+
+        Args:
+            default_filename: Save file of the default document.
+            documents_dir: Directory of the named documents, None for only
+                    the default document.
+            idle_timeout: Seconds a document without any request stays loaded.
+        """
+        super(DocumentRegistry, self).__init__()
+        self._default_filename = default_filename
+        self._documents_dir = documents_dir
+        self._idle_timeout = idle_timeout
+        self._roster = {}
+        self._documents = {None: _Document(default_filename)}
+        self._lock = threading.Lock()
+        self._stop_flag = False
+        self._stopped = False
+        self._documents[None].load({})
+
+    def run(self):
+        """Runs the thread."""
+        while not self._stop_flag:
+            for _ in range(CHECK_INTERVAL * FREQUENCY):
+                if self._stop_flag:
+                    break
+                time.sleep(float(1) / FREQUENCY)
+            else:
+                self._unload_idle_documents()
+
+    def stop(self):
+        """Stops the thread and unloads all the documents.
+
+        The requests after this are rejected instead of loading the documents
+        again.
+        """
+        self._stop_flag = True
+        with self._lock:
+            self._stopped = True
+            documents = list(self._documents.values())
+        for document in documents:
+            with document.lock:
+                document.unload()
+
+    @contextlib.contextmanager
+    def document(self, name=None):
+        """Gets the UsersTextManager of a document, loads it if needed.
+
+        The document will not be unloaded inside the "with" block.
+
+        Args:
+            name: Name of the document, None for the default document.
+
+        Return:
+            A context manager gives an instance of UsersTextManager.
+        """
+        document = self._acquire(name)
+        try:
+            yield document.manager
+        finally:
+            self._release(document)
+
+    def subscribe(self, name, listener):
+        """Listens to the changes of a document.
+
+        The document will not be unloaded until unsubscribe().
+
+        Args:
+            name: Name of the document, None for the default document.
+            listener: A function for UsersTextManager.add_listener().
+        """
+        document = self._acquire(name)
+        with document.lock:
+            document.manager.add_listener(listener)
+
+    def unsubscribe(self, name, listener):
+        """Stops listening to the changes of a document.
+
+        Args:
+            name: Name of the document, None for the default document.
+            listener: The function passed to subscribe().
+        """
+        with self._lock:
+            document = self._documents[name]
+        with document.lock:
+            if document.manager:
+                document.manager.remove_listener(listener)
+        self._release(document)
+
+    def add_user(self, identity, nick_name, authority):
+        """Adds a user to all the documents.
+
+        Args:
+            identity: Identity of this user.
+            nick_name: Nick name of this user.
+            authority: Authority of this user.
+        """
+        with self._lock:
+            self._roster[identity] = (nick_name, authority)
+        for document in self._loaded_documents():
+            with document.lock:
+                if document.manager and \
+                        document.manager.get_user_info(identity) is None:
+                    document.manager.add_user(identity, nick_name, authority)
+
+    def delete_user(self, identity):
+        """Deletes a user from all the documents.
+
+        Args:
+            identity: Identity of this user.
+        """
+        with self._lock:
+            del self._roster[identity]
+        for document in self._loaded_documents():
+            with document.lock:
+                if document.manager and \
+                        document.manager.get_user_info(identity) is not None:
+                    document.manager.delete_user(identity)
+
+    def reset_user(self, identity):
+        """Resets a user in all the documents.
+
+        Args:
+            identity: Identity of this user.
+        """
+        for document in self._loaded_documents():
+            with document.lock:
+                if document.manager and \
+                        document.manager.get_user_info(identity) is not None:
+                    document.manager.reset_user(identity)
+
+    def get_user_info(self, identity):
+        """Gets a user's information in the default document.
+
+        Args:
+            identity: Identity of the user.
+
+        Return:
+            An instance of UserInfo, None if there is no such user.
+        """
+        with self._lock:
+            if identity not in self._roster:
+                return None
+        manager = self._documents[None].manager
+        # The default document is unloaded after stop().
+        return manager.get_user_info(identity) if manager else None
+
+    def get_users_info(self, without=None, must_online=False):
+        """Gets the users informations.
+
+        A user online in any document takes the information from that
+        document, otherwise from the default document.
+
+        Args:
+            without: Blacklist.
+            must_online: A flag for whether just returns the one online or not.
+
+        Return:
+            A dict with key=authority, value=instance of UserInfo.
+        """
+        ret = {} if must_online else dict(
+            self._documents[None].manager.get_users_info(without=without))
+        for document in self._loaded_documents():
+            manager = document.manager
+            if manager:
+                ret.update(manager.get_users_info(without=without,
+                                                  must_online=True))
+        return ret
+
+    def _get_filename(self, name):
+        """Gets the save file of a document.
+
+        Args:
+            name: Name of the document, None for the default document.
+
+        Return:
+            The file name.
+        """
+        if name is None:
+            return self._default_filename
+        if self._documents_dir is None or not isinstance(name, str) or \
+                not name or os.path.basename(name) != name or \
+                name.startswith('.') or name.endswith(JOURNAL_SUFFIXES):
+            raise DocumentRegistryError('Unknown document.')
+        filename = os.path.join(self._documents_dir, name)
+        # The named documents are regular files only, and none of them can be
+        # another copy of the default document or its journal by a link.
+        default_files = [os.path.realpath(self._default_filename + suffix)
+                         for suffix in ('',) + JOURNAL_SUFFIXES]
+        if (os.path.exists(filename) and not os.path.isfile(filename)) or \
+                os.path.realpath(filename) in default_files:
+            raise DocumentRegistryError('Unknown document.')
+        return filename
+
+    def _acquire(self, name):
+        """Gets a document and loads it if needed.
+
+        The document will not be unloaded until _release().
+
+        Args:
+            name: Name of the document, None for the default document.
+
+        Return:
+            The instance of _Document.
+        """
+        filename = self._get_filename(name)
+        with self._lock:
+            if self._stopped:
+                raise DocumentRegistryError('The server is stopping.')
+            document = self._documents.get(name)
+            if document is None:
+                document = self._documents[name] = _Document(filename)
+            document.busy += 1
+        try:
+            with document.lock:
+                if document.manager is None:
+                    with self._lock:
+                        roster = dict(self._roster)
+                    document.load(roster)
+        except Exception:
+            self._release(document)
+            raise
+        return document
+
+    def _release(self, document):
+        """Releases a document got by _acquire().
+
+        Args:
+            document: The instance of _Document.
+        """
+        with self._lock:
+            document.busy -= 1
+            document.last_access = time.time()
+
+    def _loaded_documents(self):
+        """Gets the documents.
+
+        Return:
+            List of instance of _Document.
+        """
+        with self._lock:
+            return list(self._documents.values())
+
+    def _unload_idle_documents(self):
+        """Unloads the documents which have no request for a while."""
+        now = time.time()
+        with self._lock:
+            idle = [(name, document)
+                    for name, document in self._documents.items()
+                    if name is not None and not document.busy and
+                    now - document.last_access > self._idle_timeout]
+        for name, document in idle:
+            # A request may acquire the document after the scan above, so
+            # checks again while holding both the locks; the request only
+            # gets a fresh document after this one is saved and dropped.
+            with document.lock:
+                with self._lock:
+                    if document.busy or \
+                            self._documents.get(name) is not document:
+                        continue
+                    document.unload()
+                    del self._documents[name]
+
+
+class _Document(object):
+    """A document hosted by DocumentRegistry.
+
+    Attributes:
+        filename: Save file of the document.
+        manager: An instance of UsersTextManager, None if not loaded.
+        lock: A threading.Lock to protect loading and unloading.
+        busy: Number of the requests using this document.
+        last_access: Time of the last request.
+        _text_saver: An instance of TextSaver.
+        _text_journal: An instance of TextJournal, None if the save file is
+                not a regular file.
+    """
+    def __init__(self, filename):
+        """Constructor.
+
+        Args:
+            filename: Save file of the document.
+        """
+        self.filename = filename
+        self.manager = None
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.last_access = time.time()
+        self._text_saver = None
+        self._text_journal = None
+
+    def load(self, roster):
+        """Loads the document.
+
+        Args:
+            roster: A dict maps the user identity to 2-tuple (nick_name,
+                    authority).
+        """
+        if os.path.exists(self.filename) and not os.path.isfile(self.filename):
+            # Ex: /dev/null, just writes it as usual.
+            self._text_saver = TextSaver(self.filename)
+        else:
+            # The journal keeps every commit, so the snapshots can be rare.
+            self._text_journal = text_journal.TextJournal(
+                self.filename + JOURNAL_SUFFIX)
+            self._text_saver = TextSaver(
+                self.filename,
+                debounce=text_journal.SNAPSHOT_INTERVAL,
+                max_delay=text_journal.SNAPSHOT_INTERVAL,
+                journal=self._text_journal)
+        try:
+            manager = UsersTextManager(self.filename, self._text_saver,
+                                       self._text_journal)
+            for identity, (nick_name, authority) in roster.items():
+                manager.add_user(identity, nick_name, authority)
+        except Exception:
+            if self._text_journal:
+                self._text_journal.close()
+            self._text_saver = self._text_journal = None
+            raise
+        # The saver only queues the texts before it starts, so it starts after
+        # nothing can fail and never outlives a document failed to load.
+        self._text_saver.start()
+        self.manager = manager
+
+    def unload(self):
+        """Unloads the document after flushing the text."""
+        if self.manager is None:
+            return
+        self._text_saver.stop()
+        self._text_saver.join()
+        if self._text_journal:
+            self._text_journal.close()
+        self.manager = self._text_saver = self._text_journal = None
+
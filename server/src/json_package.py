@@ -1,6 +1,16 @@
 """JSONPackage"""
 
 import json
+import zlib
+
+import binary_codec
+
+
+# Bodies shorter than this are never compressed, ex: the cursor-only syncs.
+COMPRESS_THRESHOLD = 1024
+
+# Level of zlib to compress the bodies.
+COMPRESS_LEVEL = 6
 
 
 class JSONPackageError(Exception):
@@ -10,16 +20,35 @@ class JSONPackageError(Exception):
 class JSONPackage(object):
     """Send/receive json object by gived function.
 
+    The header of a plain json package is the length of the body in
+    HEADER_LENGTH digits.  The header of the other packages is _FLAGS_MARK,
+    one digit of the FLAG_* bits and the length of the body in the left
+    digits.
+
     Attributes:
         content: Content of the package body.
+        binary: Whether the body is encoded by binary_codec instead of json.
+        compress: Whether to compress the body by zlib if it is not shorter
+                than COMPRESS_THRESHOLD.
 
     Static attributes:
+        HEADER_LENGTH: Length of the header.
+        MAX_FLAGGED_LENGTH: Maximum length of the body of a package with flags,
+                both before and after zlib.
+        FLAG_BINARY: Flag for the body encoded by binary_codec, the version of
+                binary_codec must be 1.
+        FLAG_ZLIB: Flag for the body compressed by zlib.
+        _FLAGS_MARK: First byte of the header with flags.
         _ENCODING: Encoding of the package.
-        _HEADER_LENGTH: Length of the header.
     """
+    HEADER_LENGTH = 10
+    MAX_FLAGGED_LENGTH = 10 ** (HEADER_LENGTH - 2) - 1
+    FLAG_BINARY = 1
+    FLAG_ZLIB = 2
+    _FLAGS_MARK = '#'
     _ENCODING = 'utf-8'
-    _HEADER_LENGTH = 10
-    def __init__(self, content=None, recv_func=None):
+    def __init__(self, content=None, recv_func=None, binary=False,
+                 compress=False):
         """Constructor.
 
         If the receive_func is not None, it will grap the default content by
@@ -30,8 +59,12 @@ class JSONPackage(object):
         Args:
             content: The default content of this package.
             recv_func: A function for receive the default content.
+            binary: Whether to encode by binary_codec instead of json.
+            compress: Whether to compress a large body by zlib.
         """
         self.content = content
+        self.binary = binary
+        self.compress = compress
         if recv_func is not None:
             self.recv(recv_func)
 
@@ -41,14 +74,48 @@ class JSONPackage(object):
         Args:
             send_func: A function which will send the whole data gived.
                 Function format:
-                    send_func(bytes_data): None
+                    send_func(header_bytes, body_bytes): None
+        """
+        send_func(*self.pack())
+
+    def pack(self):
+        """Serializes the package.
+
+        The header and the body are not joined, so a large body is not copied
+        again before sending.
+
+        Return:
+            A 2-tuple for bytes of the header and the body.
         """
         try:
-            body = bytes(json.dumps(self.content), JSONPackage._ENCODING)
-            header_str = ('%%0%dd' % JSONPackage._HEADER_LENGTH) % len(body)
-            send_func(bytes(header_str, JSONPackage._ENCODING) + body)
+            flags = 0
+            if self.binary:
+                body = binary_codec.dumps(self.content)
+                flags |= JSONPackage.FLAG_BINARY
+            else:
+                body = bytes(json.dumps(self.content), JSONPackage._ENCODING)
+            if self.compress and COMPRESS_THRESHOLD <= len(body) <= \
+                    JSONPackage.MAX_FLAGGED_LENGTH:
+                compressed = zlib.compress(body, COMPRESS_LEVEL)
+                if len(compressed) < len(body):
+                    body = compressed
+                    flags |= JSONPackage.FLAG_ZLIB
+            if len(body) > (JSONPackage.MAX_FLAGGED_LENGTH if flags else
+                            10 ** JSONPackage.HEADER_LENGTH - 1):
+                # The length would not fit in the header.
+                raise JSONPackageError('The body is too long.')
+            if flags:
+                header_str = JSONPackage._FLAGS_MARK + \
+                        ('%%d%%0%dd' % (JSONPackage.HEADER_LENGTH - 2)) % \
+                        (flags, len(body))
+            else:
+                header_str = \
+                        ('%%0%dd' % JSONPackage.HEADER_LENGTH) % len(body)
+            return (bytes(header_str, JSONPackage._ENCODING), body)
         except TypeError as e:
             raise JSONPackageError('json: %r' % e)
+        except binary_codec.BinaryCodecError as e:
+            raise JSONPackageError('binary_codec: %r' % e)
         except UnicodeError as e:
             raise JSONPackageError('Cannot encode the string: %r.' % e)
 
@@ -61,14 +128,63 @@ class JSONPackage(object):
         Args:
             recv_func: A function to be called to get the serialize data.
         """
+        header = recv_func(JSONPackage.HEADER_LENGTH)
+        length, flags = JSONPackage.parse_header(header)
+        self.unpack(recv_func(length), flags)
+
+    @staticmethod
+    def parse_header(header):
+        """Gets the length and the flags of the body from the header.
+
+        Args:
+            header: Bytes of the header, with length HEADER_LENGTH.
+
+        Return:
+            A 2-tuple for number of bytes of the body and the FLAG_* bits.
+        """
         try:
-            header_str = str(recv_func(JSONPackage._HEADER_LENGTH),
-                             JSONPackage._ENCODING)
-            body_str = str(recv_func(int(header_str)), JSONPackage._ENCODING)
+            header_str = str(header, JSONPackage._ENCODING)
+            if not header_str.startswith(JSONPackage._FLAGS_MARK):
+                return (int(header_str), 0)
+            flags = int(header_str[1])
+            if flags & ~(JSONPackage.FLAG_BINARY | JSONPackage.FLAG_ZLIB):
+                raise JSONPackageError('Unsupported flags %r.' % flags)
+            return (int(header_str[2 : ]), flags)
         except UnicodeError as e:
             raise JSONPackageError('Cannot decode the bytes: %r.' % e)
         except ValueError as e:
             raise JSONPackageError('Cannot get the body length %r' % e)
+
+    def unpack(self, body, flags=0):
+        """Deserializes the body to the content.
+
+        Args:
+            body: Bytes of the body.
+            flags: The FLAG_* bits from the header.
+        """
+        if flags & JSONPackage.FLAG_ZLIB:
+            # Limits the output, a small body might expand to gigabytes.
+            decompressor = zlib.decompressobj()
+            try:
+                body = decompressor.decompress(
+                    body, JSONPackage.MAX_FLAGGED_LENGTH)
+            except zlib.error as e:
+                raise JSONPackageError('Cannot decompress the body: %r' % e)
+            if decompressor.unconsumed_tail:
+                raise JSONPackageError('The decompressed body is too long.')
+            if not decompressor.eof:
+                raise JSONPackageError('The compressed body is incomplete.')
+        self.binary = bool(flags & JSONPackage.FLAG_BINARY)
+        if self.binary:
+            try:
+                self.content = binary_codec.loads(body)
+            except binary_codec.BinaryCodecError as e:
+                raise JSONPackageError('binary_codec: %r' % e)
+            return
+        try:
+            body_str = str(body, JSONPackage._ENCODING)
+        except UnicodeError as e:
+            raise JSONPackageError('Cannot decode the bytes: %r.' % e)
         try:
             self.content = json.loads(body_str)
         except ValueError as e:
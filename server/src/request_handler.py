@@ -1,64 +1,102 @@
 """RequestHandler."""
 
-import bisect
-import difflib
+import binary_codec
 import log
+import rope
+import text_diff
 
+from document_registry import DocumentRegistryError
 from users_text_manager import AUTHORITY
+from users_text_manager import UNKNOWN
 from users_text_manager import UserInfo
 
 
+# Maximum number of the presences sent to a client and not acknowledged yet to
+# remember, the client gets all the other users if it acknowledges an older
+# one.
+MAX_UNACKED_PRESENCES = 16
+
+
 class JSON_TOKEN:  # pylint:disable=W0232
     """Enumeration the Ttken strings for json object."""
+    BASE = 'base'  # id of the commit which the diff is based on.
     BYE = 'bye'  # Resets the user and do nothong.
+    CODEC = 'codec'  # version of the binary codec the server accepted.
+    CODECS = 'codecs'  # versions of the binary codec the client supports.
+    COMPRESS = 'compress'  # the client/server can decompress by zlib.
     CURSORS = 'cursors'  # other users' cursor position
     DIFF = 'diff'  # Difference between this time and last time.
+    DOCUMENT = 'document'  # name of the document, default if not given.
     ERROR = 'error'  # error string
+    GONE = 'gone'  # keys of the other users gone since the acknowledged one.
     IDENTITY = 'identity'  # identity of myself
     INIT = 'init'  # initialize connect flag
+    KEY = 'key'  # key of another user in the presence.
     MODE = 'mode'  # vim mode.
     NICKNAME = 'nickname'  # nick name of the user.
     OTHERS = 'others'  # other users info.
+    PRESENCE = 'presence'  # id of the other users info the client applied.
+    REQUEST_ID = 'request_id'  # id of the request, echoed by the response.
+    SUBSCRIBE = 'subscribe'  # Turns the connection to receive the updates.
+    SUPERSEDED = 'superseded'  # The sync is replaced by a later one.
+    UPDATE = 'update'  # version of the pushed update notification.
 
 
-def apply_patch(orig_lines, patch_info):
-    """Applies a patch.
+def is_valid_patch(patch_info, num_lines):
+    """Checks whether a patch can be applied on a text or not.
 
     Args:
-        orig_lines: Original lines of the text.
         patch_info: A list of replacing information.
+        num_lines: Number of lines of the text to apply on.
 
     Return:
-        A list of text.
+        True if it is a list of 3-tuple (begin_row, end_row, lines) whose
+        ranges are sorted, not overlapped and inside the text.
     """
-    new_lines, done_len = [], 0
-    for beg, end, lines in patch_info:
-        new_lines += orig_lines[done_len : beg]
-        new_lines += lines
+    if not isinstance(patch_info, list):
+        return False
+    done_len = 0
+    for entry in patch_info:
+        if not isinstance(entry, (list, tuple)) or len(entry) != 3:
+            return False
+        beg, end, lines = entry
+        if not _is_row(beg) or not _is_row(end) or \
+           not done_len <= beg <= end <= num_lines or \
+           not isinstance(lines, (list, tuple)) or \
+           not all(isinstance(line, str) for line in lines):
+            return False
         done_len = end
-    return new_lines + orig_lines[done_len : ]
+    return True
 
 
-def _squash_patch(patch_info):
-    """Squash list of replacing information to a smaller mount of information.
+def _is_row(row):
+    """Checks whether a value from the client is a row number or not.
 
     Args:
-        patch_info: Information of patches.
+        row: The value.
 
     Return:
-        A list of replacing information.
+        True if it is an integer (but not a boolean).
+    """
+    return isinstance(row, int) and not isinstance(row, bool)
+
+
+def get_subscription(requests, responses):
+    """Finds the accepted subscribing request in a batch.
+
+    Args:
+        requests: List of the requests.
+        responses: List of the responses to the requests.
+
+    Return:
+        A 2-tuple (identity, document name) of the subscription, None if
+        there is no accepted subscribing request.
     """
-    ret, index = [], 0
-    while index < len(patch_info):
-        lines = patch_info[index][2]
-        index2 = index + 1
-        while index2 < len(patch_info) and \
-              patch_info[index2 - 1][1] >= patch_info[index2][0]:
-            lines += patch_info[index2][2]
-            index2 += 1
-        ret.append((patch_info[index][0], patch_info[index2 - 1][1], lines))
-        index = index2
-    return ret
+    for request, response in zip(requests, responses):
+        if JSON_TOKEN.SUBSCRIBE in request and JSON_TOKEN.ERROR not in response:
+            return (request[JSON_TOKEN.IDENTITY],
+                    request.get(JSON_TOKEN.DOCUMENT))
+    return None
 
 
 def gen_patch(orig_lines, new_lines):
@@ -71,17 +109,11 @@ def gen_patch(orig_lines, new_lines):
     Return:
         A list of replacing information.
     """
-    diff_result = list(difflib.Differ().compare(orig_lines, new_lines))
-    orig_index, ret = 0, []
-    for line in diff_result:
-        if line.startswith('  '):
-            orig_index += 1
-        elif line.startswith('+ '):
-            ret.append((orig_index, orig_index, [line[2 : ]]))
-        elif line.startswith('- '):
-            ret.append((orig_index, orig_index + 1, []))
-            orig_index += 1
-    return _squash_patch(ret)
+    if orig_lines is new_lines:
+        return []
+    return [(beg, end, new_lines[beg2 : end2])
+            for beg, end, beg2, end2 in text_diff.diff_lines(orig_lines,
+                                                             new_lines)]
 
 
 class _CursorTransformer(object):
@@ -92,79 +124,188 @@ class _CursorTransformer(object):
     first byte in the text).
 
     Attributes:
-        _sum_len: Sum of each row.
+        _line_view: The rope.LineView of the text.
     """
     def __init__(self):
         """Constructor."""
-        self._sum_len = [0]
+        self._line_view = rope.LineView([])
 
-    def update_lines(self, lines):
+    def update_line_view(self, line_view):
         """Update lines of text.
 
         Args:
-            lines: Lines of text.
+            line_view: An instance of rope.LineView.
         """
-        self._sum_len = [0]
-        for line in lines:
-            delta = len(line) + 1  # "+ 1" is for newline char
-            self._sum_len.append(self._sum_len[-1] + delta)
+        self._line_view = line_view
 
     def rcs_to_nums(self, rcs):
         """Transform row-col format's cursor position to numerical type.
 
         Args:
-            lines: List of line text.
             rcs: List of tuple of row-col format cursor postions
 
         Return:
             A list of numerical cursor positions.
         """
-        ret = []
-        for rc in rcs:
-            base = self._sum_len[min(rc[0], len(self._sum_len) - 1)]
-            ret.append(min(base + rc[1], self._sum_len[-1]))
-        return ret
+        end = self._line_view.offset(len(self._line_view.lines))
+        return [min(self._line_view.offset(row) + col, end)
+                for row, col in rcs]
 
+    def cursors_to_rcs(self, cursors_list):
+        """Transform the numerical cursor positions of many users together.
 
-    def nums_to_rcs(self, nums):
-        """Transform numerical format's cursor position to row-col format.
+        The positions of all the users are sorted once and located in one
+        sweep on the text.
 
         Args:
-            lines: List of line text.
-            nums: A list of numerical cursor positions.
+            cursors_list: List of dict from the cursor mark to the numerical
+                    position.
 
         Return:
-            List of tuple of row-col format cursor postions
+            List of dict from the cursor mark to the row-col position.
         """
-        ans, rmin = {}, 0
-        for num in sorted(nums):
-            row = bisect.bisect(self._sum_len, num, lo=rmin) - 1
-            col = (num - self._sum_len[row]) if row < len(self._sum_len) else 0
-            rmin = row + 1
-            ans[num] = (row, col)
-        return [ans[num] for num in nums]
+        nums = sorted(set(num for cursors in cursors_list
+                          for num in cursors.values()))
+        rcs = dict(zip(nums, self._line_view.rows_cols(nums)))
+        return [{mark : rcs[num] for mark, num in cursors.items()}
+                for cursors in cursors_list]
+
+
+class _PresenceTracker(object):
+    """Tracks the presence of the other users which a client knows.
+
+    The presence is the nick names, the modes and the cursors of the other
+    online users.  Each response carries an id of the presence, the client
+    sends back the id of the last one it applied, so the next response only
+    carries the users changed or gone since then.  A pipelined client may
+    apply the changes on a newer presence than the acknowledged one, so the
+    users gone from any presence sent after it are reported.
+
+    Attributes:
+        _last_id: Id of the last presence sent.
+        _sent: List of 2-tuple (id, dict from the user key to the presence
+                version) of the presences sent, beginning from the
+                acknowledged one.
+    """
+    def __init__(self):
+        """Constructor."""
+        self._last_id = 0
+        self._sent = []
+
+    def update(self, acked_id, others):
+        """Finds the changes of the presence since the acknowledged one.
+
+        Args:
+            acked_id: Id of the presence the client acknowledged.
+            others: List of UserInfo of the other online users.
+
+        Return:
+            A 3-tuple for the id of the new presence, the list of UserInfo of
+            the users changed and the list of the keys of the users gone.  The
+            last one is None if the client should replace its presence with
+            the changed users.
+        """
+        for index, (sent_id, unused_versions) in enumerate(self._sent):
+            if sent_id == acked_id:
+                del self._sent[ : index]
+                break
+        else:
+            self._sent = []
+        versions = dict((other.key, other.presence_version)
+                        for other in others)
+        changed, gone = others, None
+        if self._sent:
+            acked_versions = self._sent[0][1]
+            changed = [other for other in others
+                       if acked_versions.get(other.key) !=
+                       other.presence_version]
+            gone = sorted(set(key for unused_id, sent in self._sent
+                              for key in sent if key not in versions))
+        self._last_id += 1
+        self._sent.append((self._last_id, versions))
+        del self._sent[ : -MAX_UNACKED_PRESENCES]
+        return (self._last_id, changed, gone)
 
 
 class RequestHandler(object):
     """Handles all kinds of request.
 
     Attributes:
-        _users_text_manager: An instance of UsersTextManager.
+        compress: Whether the client of this connection accepts the large
+                responses compressed by zlib.
+        _document_registry: An instance of DocumentRegistry.
         _cursor_transformer: An instance of _CursorTransformer.
+        _presence_trackers: A dict maps the document name and the identity to
+                the instance of _PresenceTracker of the client.
     """
-    def __init__(self, users_text_manager):
+    def __init__(self, document_registry):
         """Constructor.
 
         Args:
-            users_text_manager: An instance of UsersTextManager.
+            document_registry: An instance of DocumentRegistry.
         """
         super(RequestHandler, self).__init__()
-        self._users_text_manager = users_text_manager
+        self.compress = False
+        self._document_registry = document_registry
         self._cursor_transformer = _CursorTransformer()
+        self._presence_trackers = {}
+
+    def handle_batch(self, requests):
+        """Handles the requests received together from a connection.
+
+        A client can send requests without waiting for the responses.  A sync
+        carries the whole difference from its base commit, so when the next
+        request is a sync of the same user on the same base, this one is
+        superseded and skipped.
+
+        Args:
+            requests: List of the requests in the received order.
+
+        Return:
+            List of the responses in the same order.
+        """
+        responses = []
+        for request, next_request in zip(requests, requests[1 : ] + [None]):
+            if next_request is not None and \
+                    _is_superseded(request, next_request):
+                response = {JSON_TOKEN.SUPERSEDED: True}
+                if JSON_TOKEN.REQUEST_ID in request:
+                    response[JSON_TOKEN.REQUEST_ID] = \
+                        request[JSON_TOKEN.REQUEST_ID]
+                responses.append(response)
+            else:
+                responses.append(self.handle(request))
+        return responses
 
     def handle(self, request):
         """Handles the request and returns the response.
 
+        A request with the supported versions of binary codec gets the version
+        the client can switch to, or the client keeps using json.  A request
+        with the compress flag turns on the compression of the responses of
+        this connection, the flag is echoed so the client knows it can
+        compress its requests too.
+
+        Args:
+            request: The request.
+
+        Return
+            The respsonse.
+        """
+        response = self._handle(request)
+        if JSON_TOKEN.REQUEST_ID in request:
+            response[JSON_TOKEN.REQUEST_ID] = request[JSON_TOKEN.REQUEST_ID]
+        codecs = request.get(JSON_TOKEN.CODECS)
+        if isinstance(codecs, list) and binary_codec.VERSION in codecs:
+            response[JSON_TOKEN.CODEC] = binary_codec.VERSION
+        if request.get(JSON_TOKEN.COMPRESS) is True:
+            self.compress = True
+            response[JSON_TOKEN.COMPRESS] = True
+        return response
+
+    def _handle(self, request):
+        """Handles the request without the request id.
+
         Args:
             request: The request.
 
@@ -174,124 +315,218 @@ class RequestHandler(object):
         if JSON_TOKEN.IDENTITY not in request:
             return {JSON_TOKEN.ERROR : 'Bad request.'}
         identity = request[JSON_TOKEN.IDENTITY]
-        if identity not in self._users_text_manager.get_users_info():
+        if self._document_registry.get_user_info(identity) is None:
             return {JSON_TOKEN.ERROR: 'Invalid identity.'}
-        for handler in [self._try_handle_leave,
-                        self._try_handle_sync]:
-            response = handler(identity, request)
-            if response is not None:
-                break
-        else:
-            return {JSON_TOKEN.ERROR: 'Bad request.'}
+        try:
+            with self._document_registry.document(
+                    request.get(JSON_TOKEN.DOCUMENT)) as manager:
+                for handler in [self._try_handle_leave,
+                                self._try_handle_subscribe,
+                                self._try_handle_sync]:
+                    response = handler(manager, identity, request)
+                    if response is not None:
+                        break
+                else:
+                    return {JSON_TOKEN.ERROR: 'Bad request.'}
+        except DocumentRegistryError as e:
+            return {JSON_TOKEN.ERROR: str(e)}
         return response
 
-    def _try_handle_leave(self, identity, request):
+    def _try_handle_leave(self, manager, identity, request):
         """Trying to handle the leaving operation if it is.
 
         Args:
+            manager: The UsersTextManager of the requested document.
             identity: The identity of that user.
             request: The request from that user.
         """
         if JSON_TOKEN.BYE in request:
-            self._users_text_manager.reset_user(identity)
+            manager.reset_user(identity)
+            self._presence_trackers.pop(
+                (request.get(JSON_TOKEN.DOCUMENT), identity), None)
             return {}
 
-    def _try_handle_sync(self, identity, request):
+    def _try_handle_subscribe(self, manager, identity, request):
+        """Trying to handle the subscribing request if it is.
+
+        The request is only accepted here, the connection serves the
+        subscription after sending the response.
+
+        Args:
+            manager: The UsersTextManager of the requested document.
+            identity: The identity of that user.
+            request: The request from that user.
+        """
+        if JSON_TOKEN.SUBSCRIBE in request:
+            log.info('%r subscribes the updates\n' % identity)
+            return {}
+
+    def _try_handle_sync(self, manager, identity, request):
         """Trying to handle the sync request if it is, otherwise return None.
 
         Args:
+            manager: The UsersTextManager of the requested document.
             identity: The identity of that user.
             request: The request from that user.
         """
         if all(key in request for key in [JSON_TOKEN.INIT, JSON_TOKEN.DIFF,
                                           JSON_TOKEN.MODE, JSON_TOKEN.CURSORS]):
             log.info('handle sync-request from %r\n' % identity)
-            self._check_init(identity, request)
-            self._check_authority(identity, request)
-            lines = apply_patch(
-                self._users_text_manager.get_user_text(identity).split('\n'),
-                request[JSON_TOKEN.DIFF])
-            self._cursor_transformer.update_lines(lines)
+            # The user might be deleted by another thread at any time, then
+            # the manager gives None.
+            user_info = manager.get_user_info(identity)
+            if user_info is None:
+                return {JSON_TOKEN.ERROR: 'Invalid identity.'}
+            if not request[JSON_TOKEN.INIT] and user_info.mode == UNKNOWN:
+                # The document was unloaded, the user's text is gone.
+                return {JSON_TOKEN.ERROR: 'Stale session, please reconnect.'}
+            base = request.get(JSON_TOKEN.BASE)
+            if not request[JSON_TOKEN.INIT] and base is not None and \
+                    base != user_info.last_commit_id:
+                # The diff is not based on the user's last commit.
+                return {JSON_TOKEN.ERROR: 'Stale base.'}
+            self._check_init(manager, identity, request)
+            self._check_authority(manager, identity, request)
+            old_view = manager.get_user_line_view(identity)
+            if old_view is None:
+                return {JSON_TOKEN.ERROR: 'Invalid identity.'}
+            if not is_valid_patch(request[JSON_TOKEN.DIFF],
+                                  len(old_view.lines)):
+                return {JSON_TOKEN.ERROR: 'Bad patch.'}
+            view = old_view.apply_patch(request[JSON_TOKEN.DIFF]) \
+                if request[JSON_TOKEN.DIFF] else old_view
+            self._cursor_transformer.update_line_view(view)
             cursors = dict(zip(request[JSON_TOKEN.CURSORS].keys(),
                                self._cursor_transformer.rcs_to_nums(
                                    request[JSON_TOKEN.CURSORS].values())))
-            new_user_info, new_text = self._users_text_manager.update_user_text(
-                identity,
-                UserInfo(mode=request[JSON_TOKEN.MODE], cursors=cursors),
-                '\n'.join(lines))
+            new_user_info = UserInfo(mode=request[JSON_TOKEN.MODE],
+                                     cursors=cursors)
+            if request[JSON_TOKEN.DIFF]:
+                result = manager.patch_user_text(
+                    identity, new_user_info, request[JSON_TOKEN.DIFF], view)
+            else:
+                # Most syncs only move the cursors.
+                result = manager.update_user_presence(identity, new_user_info)
+            if result is None:
+                return {JSON_TOKEN.ERROR: 'Invalid identity.'}
+            new_user_info, new_text, online = result
             return self._pack_sync_response(
-                identity, new_user_info, new_text.split('\n'), lines)
+                identity, request, new_user_info, new_text.line_view(),
+                view.lines, online)
 
-    def _pack_sync_response(self, identity, user_info, lines, old_lines):
+    def _pack_sync_response(self, identity, request, user_info, line_view,
+                            old_lines, online):
         """Packs the response for the sync request by the result from manager.
 
+        If the request carries the id of the presence the client applied,
+        only the other users changed since then are packed.
+
         Args:
             identity: Identity of that user.
+            request: The request from that user.
             user_info: Informations of that user.
-            lines: New lines of text.
+            line_view: New text, an instance of rope.LineView.
             old_lines: Old lines of text.
+            online: A dict maps the identity to the UserInfo of the online
+                    users whose cursors are on the new text.
 
         Return:
             The response json object.
         """
-        self._cursor_transformer.update_lines(lines)
-        return {
-            JSON_TOKEN.DIFF : gen_patch(old_lines, lines),
-            JSON_TOKEN.CURSORS : dict(zip(
-                user_info.cursors.keys(),
-                self._cursor_transformer.nums_to_rcs(
-                    user_info.cursors.values()))),
+        self._cursor_transformer.update_line_view(line_view)
+        others = [other for iden, other in online.items() if iden != identity]
+        response = {
+            JSON_TOKEN.DIFF : gen_patch(old_lines, line_view.lines),
             JSON_TOKEN.MODE : user_info.mode,
-            JSON_TOKEN.OTHERS : self._pack_sync_others_response(identity)
+            JSON_TOKEN.BASE : user_info.last_commit_id,
         }
+        with_keys = JSON_TOKEN.PRESENCE in request
+        if with_keys:
+            tracker = self._presence_trackers.setdefault(
+                (request.get(JSON_TOKEN.DOCUMENT), identity),
+                _PresenceTracker())
+            response[JSON_TOKEN.PRESENCE], others, gone = tracker.update(
+                request[JSON_TOKEN.PRESENCE], others)
+            if gone is not None:
+                response[JSON_TOKEN.GONE] = gone
+        rcs = self._cursor_transformer.cursors_to_rcs(
+            [user_info.cursors] + [other.cursors for other in others])
+        response[JSON_TOKEN.CURSORS] = rcs[0]
+        response[JSON_TOKEN.OTHERS] = self._pack_sync_others_response(
+            others, rcs[1 : ], with_keys)
+        return response
 
-    def _pack_sync_others_response(self, identity):
+    def _pack_sync_others_response(self, others, others_rcs, with_keys):
         """Packs the response information for other users.
 
         Args:
-            identity: Identity of that user.
+            others: List of UserInfo of the other online users.
+            others_rcs: List of the row-col cursors of each of them.
+            with_keys: Whether to pack the keys of the users.
 
         Return:
             The response json object.
         """
-        return [
-            {
+        ret = []
+        for other, other_rcs in zip(others, others_rcs):
+            info = {
                 JSON_TOKEN.NICKNAME : other.nick_name,
                 JSON_TOKEN.MODE : other.mode,
-                JSON_TOKEN.CURSORS: dict(zip(
-                    other.cursors.keys(),
-                    self._cursor_transformer.nums_to_rcs(
-                        other.cursors.values())))
-            } for iden, other in self._users_text_manager.get_users_info(
-                without=[identity], must_online=True).items()
-        ]
-
-    def _check_init(self, identity, request):
+                JSON_TOKEN.CURSORS: other_rcs
+            }
+            if with_keys:
+                info[JSON_TOKEN.KEY] = other.key
+            ret.append(info)
+        return ret
+
+    def _check_init(self, manager, identity, request):
         """Checks whether that user should be initialize or not.
 
         If yes, it will reset that user and update the request.
 
         Args:
+            manager: The UsersTextManager of the requested document.
             identity: The identity of that user.
             request: The request from that user.
         """
         if request[JSON_TOKEN.INIT]:
             log.info('Init the user %r\n' % identity)
-            self._users_text_manager.reset_user(identity)
+            manager.reset_user(identity)
             request[JSON_TOKEN.DIFF] = []
             for mark in request.get(JSON_TOKEN.CURSORS, []):
                 request[JSON_TOKEN.CURSORS][mark] = (0, 0)
 
-    def _check_authority(self, identity, request):
+    def _check_authority(self, manager, identity, request):
         """Checks the authroity and updates the request.
 
         If the user is not writeable, it will modify the request to let it looks
         like that the user did nothing.
 
         Args:
+            manager: The UsersTextManager of the requested document.
             identity: The identity of that user.
             request: The request from that user.
         """
-        auth = self._users_text_manager.get_users_info()[identity].authority
-        if auth < AUTHORITY.READWRITE:
+        user_info = manager.get_user_info(identity)
+        if user_info is None or user_info.authority < AUTHORITY.READWRITE:
             request[JSON_TOKEN.DIFF] = []
+
+
+def _is_superseded(request, next_request):
+    """Checks whether a sync request is superseded by the next request.
+
+    Args:
+        request: The request.
+        next_request: The next request from the same connection.
+
+    Return:
+        True if both are syncs of the same user and document on the same
+        base commit, and the next one does not initialize the user.
+    """
+    for req in (request, next_request):
+        if JSON_TOKEN.BASE not in req or JSON_TOKEN.DIFF not in req or \
+                req.get(JSON_TOKEN.INIT):
+            return False
+    return all(request.get(key) == next_request.get(key)
+               for key in [JSON_TOKEN.IDENTITY, JSON_TOKEN.DOCUMENT,
+                           JSON_TOKEN.BASE])
@@ -0,0 +1,494 @@
+"""Rope, an immutable text sharing the unchanged pieces between versions."""
+
+import bisect
+import itertools
+import operator
+
+
+# Maximum length of the string in a leaf.
+LEAF_SIZE = 1024
+
+# Maximum number of rows in a block of LineView.
+LINE_BLOCK_SIZE = 256
+
+
+class Rope(object):
+    """An immutable text stored as a height-balanced tree of string pieces.
+
+    Editing a rope creates a new rope which shares all the untouched pieces
+    with the old one, so keeping many similar versions of a text is cheap, and
+    locating a position or a row only costs O(log n).
+
+    Attributes:
+        _root: The root node, an instance of _Node or None for empty text.
+        _line_view: The cached instance of LineView, None before built.
+    """
+    def __init__(self, text=''):
+        """Constructor.
+
+        Args:
+            text: The initial string.
+        """
+        self._root = _build(_leaves(text))
+        self._line_view = None
+
+    def __len__(self):
+        """Gets the length of the text."""
+        return self._root.length if self._root else 0
+
+    def __str__(self):
+        """Materializes the whole text."""
+        return ''.join(self.chunks())
+
+    @property
+    def num_lines(self):
+        """Gets the number of lines, which is the number of newlines + 1."""
+        return (self._root.newlines if self._root else 0) + 1
+
+    def line_view(self):
+        """Gets the whole text split into lines.
+
+        It is built at the first call and cached, the rope never changes so
+        all the users on the same commit share it.  Two threads may build it
+        at the same time, they get equal views.
+
+        Return:
+            An instance of LineView, it should not be modified.
+        """
+        view = self._line_view
+        if view is None:
+            view = self._line_view = LineView(str(self).split('\n'))
+        return view
+
+    def cache_line_view(self, line_view):
+        """Caches a line view built by the caller from the same text.
+
+        Args:
+            line_view: An instance of LineView, it is ignored if the number of
+                    lines or the length does not match this text.
+        """
+        if self._line_view is None and \
+                len(line_view.lines) == self.num_lines and \
+                line_view.length == len(self):
+            self._line_view = line_view
+
+    def chunks(self):
+        """Iterates the pieces of the text in order.
+
+        Return:
+            A generator of strings.
+        """
+        stack, node = [], self._root
+        while stack or node:
+            if node:
+                if node.text is not None:
+                    yield node.text
+                    node = None
+                else:
+                    stack.append(node.right)
+                    node = node.left
+            else:
+                node = stack.pop()
+
+    def substring(self, begin, end):
+        """Gets a part of the text.
+
+        Args:
+            begin: Begin of the range.
+            end: End of the range (exclusive).
+
+        Return:
+            The string in the range [begin, end).
+        """
+        pieces = []
+        _collect(self._root, max(begin, 0), end, pieces)
+        return ''.join(pieces)
+
+    def replace(self, begin, end, text):
+        """Replaces a range of the text.
+
+        Args:
+            begin: Begin of the range.
+            end: End of the range (exclusive).
+            text: The new string for that range.
+
+        Return:
+            A new instance of Rope.
+        """
+        # Extends the range to the boundaries of the leaves so the pieces never
+        # get fragmented, and merges a small result with the next leaf.
+        begin, left_text = _leaf_at(self._root, begin, False)
+        end, right_text = _leaf_at(self._root, end, True)
+        middle = left_text + text + right_text
+        if len(middle) < LEAF_SIZE // 2 and end < len(self):
+            end, next_text = _leaf_at(self._root, end, True)
+            middle += next_text
+        left, rest = _split(self._root, begin)
+        unused_mid, right = _split(rest, end - begin)
+        ret = Rope()
+        ret._root = _join(_join(left, _build(_leaves(middle))), right)
+        return ret
+
+    def line_offset(self, row):
+        """Gets the position of the begin of a row.
+
+        Args:
+            row: The row number, rows after the last one are treated as the
+                    last one.
+
+        Return:
+            The position.
+        """
+        node, offset = self._root, 0
+        if row <= 0 or not node:
+            return 0
+        if row >= node.newlines + 1:
+            row = node.newlines
+        while node.text is None:
+            if node.left.newlines >= row:
+                node = node.left
+            else:
+                row -= node.left.newlines
+                offset += node.left.length
+                node = node.right
+        index = -1
+        for _ in range(row):
+            index = node.text.index('\n', index + 1)
+        return offset + index + 1
+
+
+class LineView(object):
+    """Lines of a text and an index of the offsets of them.
+
+    The rows are indexed by blocks of about LINE_BLOCK_SIZE rows, each block
+    stores the offsets of its rows relative to the block.  A patched view
+    shares the untouched blocks with the original one, so updating the index
+    only costs the changed rows and the number of blocks.
+
+    Attributes:
+        lines: List of the lines without the newline characters.
+        _blocks: List of the blocks, a block is a list of the offsets of its
+                rows relative to the first row, and the length of the rows
+                with their newline characters at the end.
+        _block_rows: List of the first row of each block, and the number of
+                rows at the end.
+        _block_offsets: List of the position of each block, and the length of
+                the text + 1 at the end.
+    """
+    __slots__ = ('lines', '_blocks', '_block_rows', '_block_offsets')
+
+    def __init__(self, lines, blocks=None):
+        """Constructor.
+
+        Args:
+            lines: List of the lines.
+            blocks: The blocks of the lines, None to build them.
+        """
+        self.lines = lines
+        self._blocks = _line_blocks(lines, 0, len(lines)) if blocks is None \
+            else blocks
+        self._block_rows = [0]
+        self._block_rows.extend(itertools.accumulate(
+            len(block) - 1 for block in self._blocks))
+        self._block_offsets = [0]
+        self._block_offsets.extend(itertools.accumulate(
+            block[-1] for block in self._blocks))
+
+    @property
+    def length(self):
+        """Gets the length of the text."""
+        return self._block_offsets[-1] - 1
+
+    def offset(self, row):
+        """Gets the position of the begin of a row.
+
+        Args:
+            row: The row number.
+
+        Return:
+            The position, it is the length of the text + 1 for the rows after
+            the last one.
+        """
+        if row <= 0:
+            return 0
+        if row >= len(self.lines):
+            return self._block_offsets[-1]
+        index = bisect.bisect(self._block_rows, row) - 1
+        return self._block_offsets[index] + \
+            self._blocks[index][row - self._block_rows[index]]
+
+    def rows_cols(self, positions):
+        """Gets the rows and the columns of positions in one sweep.
+
+        Args:
+            positions: Ascending list of positions.
+
+        Return:
+            List of 2-tuple (row, col) for each position, the positions before
+            the text are at (0, 0) and the ones after the text are on the row
+            len(lines).
+        """
+        ret, index, end = [], 0, len(self._blocks)
+        for pos in positions:
+            pos = max(pos, 0)
+            index = bisect.bisect(self._block_offsets, pos, index) - 1
+            if index >= end:
+                ret.append((self._block_rows[-1],
+                            pos - self._block_offsets[-1]))
+                continue
+            block, col = self._blocks[index], pos - self._block_offsets[index]
+            row = bisect.bisect(block, col) - 1
+            ret.append((self._block_rows[index] + row, col - block[row]))
+        return ret
+
+    def apply_patch(self, patch):
+        """Creates the view of the text after applying a patch.
+
+        The blocks out of the patched rows are shared with this view.
+
+        Args:
+            patch: A sorted list of (begin_row, end_row, lines) which replaces
+                    the rows in [begin_row, end_row) with the lines.
+
+        Return:
+            A new instance of LineView.
+        """
+        lines, done = [], 0
+        for beg, end, new_lines in patch:
+            lines += self.lines[done : beg]
+            lines += new_lines
+            done = end
+        lines += self.lines[done : ]
+        if not self._blocks:
+            return LineView(lines)
+        # Each range is [first block, end block, row shift before the range,
+        # row shift after the range].
+        ranges, shift, last = [], 0, len(self._blocks) - 1
+        for beg, end, new_lines in patch:
+            first = min(bisect.bisect(self._block_rows, beg) - 1, last)
+            stop = min(bisect.bisect(self._block_rows, max(end - 1, beg)) - 1,
+                       last) + 1
+            if ranges and first < ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], stop)
+            else:
+                ranges.append([first, stop, shift, shift])
+            shift += len(new_lines) - (end - beg)
+            ranges[-1][3] = shift
+        blocks, done = [], 0
+        for first, stop, shift_before, shift_after in ranges:
+            blocks += self._blocks[done : first]
+            blocks += _line_blocks(lines,
+                                   self._block_rows[first] + shift_before,
+                                   self._block_rows[stop] + shift_after)
+            done = stop
+        blocks += self._blocks[done : ]
+        if len(blocks) > 2 * (len(lines) // LINE_BLOCK_SIZE + 1):
+            # Too many small blocks after lots of patches.
+            return LineView(lines)
+        return LineView(lines, blocks)
+
+
+class _Node(object):
+    """A node of the rope tree, it is either a leaf or has two children.
+
+    Attributes:
+        left: Left child, None for leaf.
+        right: Right child, None for leaf.
+        text: The string of a leaf, None for an internal node.
+        length: Length of the text under this node.
+        newlines: Number of newline characters under this node.
+        height: Height of this node, 0 for leaf.
+    """
+    __slots__ = ('left', 'right', 'text', 'length', 'newlines', 'height')
+
+    def __init__(self, left=None, right=None, text=None):
+        """Constructor.
+
+        Args:
+            left: Left child.
+            right: Right child.
+            text: The string, only for leaf.
+        """
+        self.left, self.right, self.text = left, right, text
+        if text is not None:
+            self.length, self.newlines, self.height = \
+                len(text), text.count('\n'), 0
+        else:
+            self.length = left.length + right.length
+            self.newlines = left.newlines + right.newlines
+            self.height = max(left.height, right.height) + 1
+
+
+def _leaves(text):
+    """Cuts a string into leaves with nearly the same length.
+
+    Args:
+        text: The string.
+
+    Return:
+        List of leaf nodes.
+    """
+    num = (len(text) + LEAF_SIZE - 1) // LEAF_SIZE
+    size = (len(text) + num - 1) // num if num else 0
+    return [_Node(text=text[i : i + size]) for i in range(0, len(text), size)] \
+        if text else []
+
+
+def _line_blocks(lines, begin, end):
+    """Cuts a range of rows into blocks with nearly the same number of rows.
+
+    Args:
+        lines: List of the lines.
+        begin: The first row.
+        end: The end of the rows (exclusive).
+
+    Return:
+        List of blocks of LineView.
+    """
+    num = (end - begin + LINE_BLOCK_SIZE - 1) // LINE_BLOCK_SIZE
+    size = (end - begin + num - 1) // num if num else 0
+    blocks = []
+    for first in range(begin, end, size or 1):
+        rows, block = lines[first : min(first + size, end)], [0]
+        # Row i begins after i newline characters and the lines before it.
+        block.extend(map(operator.add, itertools.accumulate(map(len, rows)),
+                         itertools.count(1)))
+        blocks.append(block)
+    return blocks
+
+
+def _build(leaves, begin=0, end=None):
+    """Builds a balanced tree from a list of leaves.
+
+    Args:
+        leaves: List of leaf nodes.
+        begin: Begin of the range of the leaves to use.
+        end: End of the range of the leaves to use, None for the last.
+
+    Return:
+        The root node, None if there is no leaf.
+    """
+    end = len(leaves) if end is None else end
+    if end - begin <= 1:
+        return leaves[begin] if begin < end else None
+    mid = (begin + end) // 2
+    return _Node(_build(leaves, begin, mid), _build(leaves, mid, end))
+
+
+def _height(node):
+    """Gets the height of a node, -1 for None."""
+    return node.height if node else -1
+
+
+def _balance(left, right):
+    """Creates a node from two children whose heights differ at most 2.
+
+    Args:
+        left: Left child.
+        right: Right child.
+
+    Return:
+        The root of the balanced tree.
+    """
+    if left.height > right.height + 1:
+        if _height(left.left) >= _height(left.right):
+            return _Node(left.left, _Node(left.right, right))
+        return _Node(_Node(left.left, left.right.left),
+                     _Node(left.right.right, right))
+    if right.height > left.height + 1:
+        if _height(right.right) >= _height(right.left):
+            return _Node(_Node(left, right.left), right.right)
+        return _Node(_Node(left, right.left.left),
+                     _Node(right.left.right, right.right))
+    return _Node(left, right)
+
+
+def _join(left, right):
+    """Concatenates two trees.
+
+    Args:
+        left: Root of the left tree or None.
+        right: Root of the right tree or None.
+
+    Return:
+        The root of the concatenated tree.
+    """
+    if left is None or right is None:
+        return left if right is None else right
+    if left.height > right.height + 1:
+        return _balance(left.left, _join(left.right, right))
+    if right.height > left.height + 1:
+        return _balance(_join(left, right.left), right.right)
+    return _Node(left, right)
+
+
+def _split(node, pos):
+    """Splits a tree into two at a position.
+
+    Args:
+        node: Root of the tree.
+        pos: The position.
+
+    Return:
+        A 2-tuple for the roots of the left part and the right part.
+    """
+    if node is None:
+        return None, None
+    if pos <= 0:
+        return None, node
+    if pos >= node.length:
+        return node, None
+    if node.text is not None:
+        return _Node(text=node.text[ : pos]), _Node(text=node.text[pos : ])
+    if pos < node.left.length:
+        left, right = _split(node.left, pos)
+        return left, _join(right, node.right)
+    left, right = _split(node.right, pos - node.left.length)
+    return _join(node.left, left), right
+
+
+def _leaf_at(node, pos, after):
+    """Finds the boundary of the leaf which contains a position.
+
+    Args:
+        node: Root of the tree.
+        pos: The position.
+        after: True to find the end of that leaf, otherwise the begin.
+
+    Return:
+        A 2-tuple for the boundary and the part of the leaf's string between
+        the boundary and the position.
+    """
+    offset = 0
+    while node and node.text is None:
+        if pos - offset < node.left.length or \
+           (not after and pos - offset == node.left.length):
+            node = node.left
+        else:
+            offset += node.left.length
+            node = node.right
+    if node is None or pos - offset >= node.length and after:
+        return pos, ''
+    if after:
+        return offset + node.length, node.text[pos - offset : ]
+    return offset, node.text[ : pos - offset]
+
+
+def _collect(node, begin, end, pieces):
+    """Collects the strings of a range under a node.
+
+    Args:
+        node: The node.
+        begin: Begin of the range relative to the node.
+        end: End of the range relative to the node.
+        pieces: List to append the strings.
+    """
+    while node and begin < end and begin < node.length and end > 0:
+        if node.text is not None:
+            pieces.append(node.text[max(begin, 0) : end])
+            return
+        if begin < node.left.length:
+            _collect(node.left, begin, end, pieces)
+        begin -= node.left.length
+        end -= node.left.length
+        node = node.right
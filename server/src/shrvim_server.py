@@ -7,9 +7,10 @@ import sys
 import threading
 import log
 
+from async_tcp_server import AsyncTCPServer
 from cmd_ui import CmdUI
+from document_registry import DocumentRegistry
 from tcp_server import TCPServer
-from users_text_manager import UsersTextManager
 
 
 class _ArgsError(Exception):
@@ -23,17 +24,25 @@ class _Args(object):
         port: Port number.
         user_list_filename: Default user list.
         save_filename: Name of the file to save the text.
+        documents_dir: Directory of the other documents, None for hosting only
+                the save file.
+        use_async: Whether to serve the connections by an event loop instead
+                of a thread for each connection.
     """
-    DOCUMENT = '[usage] <port_number> <user_list_filename> <save_filename>\n'
+    DOCUMENT = ('[usage] [--async] <port_number> <user_list_filename> '
+                '<save_filename> [<documents_dir>]\n')
     def __init__(self):
-        if len(sys.argv) != 4:
+        argv = [arg for arg in sys.argv[1 : ] if arg != '--async']
+        self.use_async = len(argv) < len(sys.argv) - 1
+        if len(argv) not in (3, 4):
             raise _ArgsError('Wrong length of arguments.')
         try:
-            self.port = int(sys.argv[1])
+            self.port = int(argv[0])
         except ValueError as e:
             raise _ArgsError(e)
-        self.user_list_filename = sys.argv[2]
-        self.saved_filename = sys.argv[3]
+        self.user_list_filename = argv[1]
+        self.saved_filename = argv[2]
+        self.documents_dir = argv[3] if len(argv) == 4 else None
 
 
 class _ShrVimServerError(Exception):
@@ -44,8 +53,8 @@ class ShrVimServer(threading.Thread):
     """Main class.
 
     Attributes:
-        _users_text_manager: Instance of UsersTextManager.
-        _tcp_server: Instance of TCPServer.
+        _document_registry: Instance of DocumentRegistry.
+        _tcp_server: Instance of TCPServer or AsyncTCPServer.
         _cmd_ui: Instance of CmdUI.
     """
     def __init__(self):
@@ -55,24 +64,31 @@ class ShrVimServer(threading.Thread):
             self._args = _Args()
         except _ArgsError as e:
             raise _ShrVimServerError(str(e) + '\n' + _Args.DOCUMENT)
-        self._users_text_manager = UsersTextManager(self._args.saved_filename)
-        self._tcp_server = TCPServer(self._args.port, self._users_text_manager)
+        self._document_registry = DocumentRegistry(self._args.saved_filename,
+                                                   self._args.documents_dir)
+        server_class = AsyncTCPServer if self._args.use_async else TCPServer
+        self._tcp_server = server_class(self._args.port,
+                                        self._document_registry)
         self._cmd_ui = CmdUI(['load %s' % self._args.user_list_filename],
-                             self._users_text_manager, self._tcp_server, self)
+                             self._document_registry, self._tcp_server, self)
         log.info.interface = self._cmd_ui
         log.error.interface = self._cmd_ui
 
     def run(self):
         """Starts the program."""
+        self._document_registry.start()
         self._tcp_server.start()
         self._cmd_ui.start()
         self._cmd_ui.join()
         self._tcp_server.join()
+        self._document_registry.join()
 
     def stop(self):
         """Exits the program."""
         self._cmd_ui.stop()
         self._tcp_server.stop()
+        # Flushes the pending texts after no one can commit anymore.
+        self._document_registry.stop()
 
 
 class _SignalHandler(object):
@@ -6,14 +6,27 @@ import socket
 import threading
 import time
 
+from document_registry import DocumentRegistryError
 from json_package import JSONPackage
 from json_package import JSONPackageError
+from request_handler import JSON_TOKEN
 from request_handler import RequestHandler
+from request_handler import get_subscription
 
 
 FREQUENCY = 8
 TIMEOUT = 1
 
+# Minimum seconds between two updates pushed to a connection.
+PUSH_INTERVAL = 0.2
+
+# Maximum number of the requests already arrived to be handled as a batch, so
+# a client sending without waiting cannot hold a worker forever.
+MAX_BATCH_SIZE = 64
+
+# Whether the socket can send multiple buffers by one system call.
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
 
 class TCPServer(threading.Thread):
     """A thread to be the tcp server.
@@ -21,21 +34,21 @@ class TCPServer(threading.Thread):
     Attributes:
         _port: Port number.
         _sock: Socket fd.
-        _users_text_manager: An instance of UsersTextManager.
+        _document_registry: An instance of DocumentRegistry.
         _stop_flag: Flag for stopping.
         _connection_handler_threads: List of connction handler threads.
     """
-    def __init__(self, port, users_text_manager):
+    def __init__(self, port, document_registry):
         """Constructor.
 
         Args:
             port: Port number.
-            users_text_manager: An instance of UsersTextManager.
+            document_registry: An instance of DocumentRegistry.
         """
         super(TCPServer, self).__init__()
         self._port = port
         self._sock = None
-        self._users_text_manager = users_text_manager
+        self._document_registry = document_registry
         self._stop_flag = False
         self._connection_handler_threads = []
 
@@ -84,7 +97,7 @@ class TCPServer(threading.Thread):
             if readable:
                 sock, addr = self._sock.accept()
                 log.info('Client %r connect to server.\n' % str(addr))
-                thr = _TCPConnectionHandler(sock, self._users_text_manager)
+                thr = _TCPConnectionHandler(sock, self._document_registry)
                 thr.start()
                 self._connection_handler_threads += [thr]
 
@@ -94,36 +107,93 @@ class _TCPConnectionHandler(threading.Thread):
 
     Attributes:
         _sock:  The connection socket.
-        _users_text_manager: An instance of UsersTextManager.
+        _document_registry: An instance of DocumentRegistry.
         _stop_flag: Stopping flag.
     """
-    def __init__(self, conn, users_text_manager):
+    def __init__(self, conn, document_registry):
         """Constructor.
 
         Args:
             conn: The connection.
-            users_text_manager: An instance of UsersTextManager.
+            document_registry: An instance of DocumentRegistry.
         """
         super(_TCPConnectionHandler, self).__init__()
         self._conn = TCPConnection(conn)
-        self._users_text_manager = users_text_manager
+        self._document_registry = document_registry
         self._stop_flag = False
-        self._request_handler = RequestHandler(self._users_text_manager)
+        self._request_handler = RequestHandler(self._document_registry)
 
     def run(self):
         """Runs the thread."""
         try:
             while not self._stop_flag:
-                try:
-                    request = JSONPackage(recv_func=self._conn.recv_all).content
-                    response = self._request_handler.handle(request)
-                    JSONPackage(response).send(self._conn.send_all)
-                except JSONPackageError as e:
-                    log.error(str(e))
+                packages = self._recv_requests()
+                requests = [package.content for package in packages]
+                responses = self._request_handler.handle_batch(requests)
+                for package, response in zip(packages, responses):
+                    try:
+                        # Responses in the same encoding as the request.
+                        JSONPackage(
+                            response, binary=package.binary,
+                            compress=self._request_handler.compress).send(
+                                self._conn.send_all)
+                    except JSONPackageError as e:
+                        log.error(str(e))
+                subscription = get_subscription(requests, responses)
+                if subscription:
+                    self._push_updates(*subscription)
+                    break
         except socket.error as e:
             log.error(str(e))
         self._conn.close()
 
+    def _recv_requests(self):
+        """Receives a request and at most MAX_BATCH_SIZE - 1 arrived after it.
+
+        Return:
+            List of the instances of JSONPackage of the requests.
+        """
+        packages = []
+        while not self._stop_flag and len(packages) < MAX_BATCH_SIZE and (
+                not packages or (self._conn.is_readable() and
+                                 not self._conn.is_closed())):
+            try:
+                packages.append(JSONPackage(recv_func=self._conn.recv_all))
+            except JSONPackageError as e:
+                log.error(str(e))
+        return packages
+
+    def _push_updates(self, identity, name):
+        """Pushes the update notifications until the connection closed.
+
+        The changes are coalesced, at most one notification is sent in each
+        PUSH_INTERVAL, and the changes made by the user itself are skipped.
+
+        Args:
+            identity: Identity of the subscribing user.
+            name: Name of the document.
+        """
+        changed = threading.Event()
+        def listener(iden):
+            if iden != identity:
+                changed.set()
+        try:
+            self._document_registry.subscribe(name, listener)
+        except DocumentRegistryError as e:
+            log.error(str(e) + '\n')
+            return
+        try:
+            version = 0
+            while not self._stop_flag and not self._conn.is_closed():
+                if changed.wait(float(1) / FREQUENCY):
+                    changed.clear()
+                    version += 1
+                    JSONPackage({JSON_TOKEN.UPDATE: version}).send(
+                        self._conn.send_all)
+                    time.sleep(PUSH_INTERVAL)
+        finally:
+            self._document_registry.unsubscribe(name, listener)
+
     def stop(self):
         """Stops the thread."""
         self._stop_flag = True
@@ -147,40 +217,83 @@ class TCPConnection(object):
         self._conn.settimeout(TIMEOUT)
         self._stop_flag = False
 
-    def send_all(self, data):
-        """Sends the data until timeout or the socket closed.
+    def send_all(self, *buffers):
+        """Sends the buffers in order until timeout or the socket closed.
+
+        The buffers are sent by one sendmsg() without joining them if the
+        platform supports it, the remaining parts after a partial sending are
+        sent by views instead of copies.
 
         Args:
-            data: Data to be sent.
+            buffers: Bytes-like objects to be sent.
         """
-        recvd_byte, total_byte = 0, len(data)
-        while recvd_byte < total_byte and not self._stop_flag:
+        buffers = [buf for buf in buffers if len(buf)]
+        while buffers and not self._stop_flag:
             try:
-                recvd_byte += self._conn.send(data[recvd_byte : ])
+                sent_byte = self._conn.sendmsg(buffers) if _HAS_SENDMSG \
+                        else self._conn.send(buffers[0])
             except socket.timeout:
                 continue
+            while buffers and sent_byte >= len(buffers[0]):
+                sent_byte -= len(buffers.pop(0))
+            if sent_byte:
+                buffers[0] = memoryview(buffers[0])[sent_byte : ]
 
     def recv_all(self, nbyte):
         """Receives the data until timeout or the socket closed.
 
+        If the data do not arrive at once, the left parts are received into
+        one buffer allocated in advance instead of concatenating the parts.
+
         Args:
             nbyte: Bytes of data to receive.
 
         Return:
-            Bytes of data.
+            Bytes or bytearray of the data.
         """
-        ret = b''
-        while nbyte > 0 and not self._stop_flag:
+        ret, view, recvd_byte = b'', None, 0
+        while recvd_byte < nbyte and not self._stop_flag:
             try:
-                recv = self._conn.recv(nbyte)
+                if view is None:
+                    ret = self._conn.recv(nbyte)
+                    recv_byte = len(ret)
+                else:
+                    recv_byte = self._conn.recv_into(view[recvd_byte : ])
             except socket.timeout:
                 continue
-            if not recv:
+            if not recv_byte:
                 raise socket.error('Connection die.')
-            ret += recv
-            nbyte -= len(recv)
+            if view is None and recv_byte < nbyte:
+                ret, first_part = bytearray(nbyte), ret
+                view = memoryview(ret)
+                view[ : recv_byte] = first_part
+            recvd_byte += recv_byte
+        if recvd_byte < nbyte:  # Stopped before receiving all.
+            return bytes(ret[ : recvd_byte])
         return ret
 
+    def is_readable(self):
+        """Checks whether there are data or EOF to receive without waiting.
+
+        Return:
+            True if receiving will not block.
+        """
+        readable, _, _ = select.select([self._conn], [], [], 0)
+        return bool(readable)
+
+    def is_closed(self):
+        """Checks whether the other side closed the connection without waiting.
+
+        Return:
+            True if the connection is closed.
+        """
+        if not self.is_readable():
+            return False
+        try:
+            return not self._conn.recv(1, socket.MSG_PEEK)
+        except socket.error:
+            return True
+
     def close(self):
         """Closes the connection."""
         self._conn.close()
@@ -0,0 +1,211 @@
+"""Differential tests of the operation sweeps in text_chain.
+
+The sweeps in _opers_apply_opers() and _compose_opers() replaced a simple loop
+which let every original operation apply every operation one by one, so they
+are checked against that loop and the texts on seeded random edit streams.
+"""
+
+import random
+import unittest
+
+import text_chain
+import text_diff
+
+
+# Number of random cases for each test.
+NUM_CASES = 3000
+
+ALPHABET = 'ab\n'
+
+
+def _apply_opers_by_loop(orig_opers, opers_tobe_applied):
+    """The original _opers_apply_opers(), which applies them one by one.
+
+    The operations to be applied are all based on the same text, so they are
+    applied from the right to the left to keep the positions of the remaining
+    ones valid; the original loop went from the left and let the earlier
+    operations shift the later ones twice.
+
+    Args:
+        orig_opers: List of instance of _ChgTextOper.
+        opers_tobe_applied: List of instance of _ChgTextOper.
+
+    Return:
+        A list of instance of _ChgTextOper.
+    """
+    ret = orig_opers
+    for oper_tobe_applied in reversed(opers_tobe_applied):
+        updated_opers = []
+        for orig_oper in ret:
+            updated_opers += orig_oper.apply_oper(oper_tobe_applied)
+        ret = updated_opers
+    return ret
+
+
+def _do_opers(text, opers):
+    """Does a sorted list of operations on a text.
+
+    Args:
+        text: The original text.
+        opers: A sorted list of instance of _ChgTextOper.
+
+    Return:
+        The text after done the operations.
+    """
+    pieces, pos = [], 0
+    for oper in opers:
+        pieces += [text[pos : oper.begin], oper.new_text]
+        pos = oper.end
+    return ''.join(pieces) + text[pos:]
+
+
+def _dump(opers):
+    """Dumps a list of operations to compare them.
+
+    Args:
+        opers: List of instance of _ChgTextOper.
+
+    Return:
+        List of 3-tuple (begin, end, new_text).
+    """
+    return [(oper.begin, oper.end, oper.new_text) for oper in opers]
+
+
+def _random_text(rand, max_len):
+    """Creates a random text.
+
+    Args:
+        rand: An instance of random.Random.
+        max_len: Maximum length of the text.
+
+    Return:
+        A string.
+    """
+    return ''.join(rand.choice(ALPHABET)
+                   for _ in range(rand.randint(0, max_len)))
+
+
+def _random_opers(rand, text_len):
+    """Creates a sorted list of random operations on a text.
+
+    The operations never touch each other, just like the ones in a commit.
+
+    Args:
+        rand: An instance of random.Random.
+        text_len: Length of the original text.
+
+    Return:
+        A sorted list of instance of _ChgTextOper.
+    """
+    ret, pos = [], 0
+    while pos <= text_len and rand.random() < 0.7:
+        begin = rand.randint(pos, min(pos + 3, text_len))
+        end = rand.randint(begin, min(begin + 3, text_len))
+        new_text = _random_text(rand, 3)
+        if begin < end or new_text:
+            ret.append(text_chain._ChgTextOper(begin, end, new_text))
+        pos = end + 1
+    return ret
+
+
+def _diff_opers(old_text, new_text):
+    """Creates the operations of a commit by the diff engine.
+
+    Args:
+        old_text: The original text.
+        new_text: The new text.
+
+    Return:
+        A sorted list of instance of _ChgTextOper.
+    """
+    return [text_chain._ChgTextOper(begin, end, text)
+            for begin, end, text in text_diff.diff_texts(old_text, new_text)]
+
+
+def _random_edit(rand, text):
+    """Edits a text randomly, like a user typing on it.
+
+    Args:
+        rand: An instance of random.Random.
+        text: The original text.
+
+    Return:
+        The new text.
+    """
+    for _ in range(rand.randint(1, 4)):
+        begin = rand.randint(0, len(text))
+        end = rand.randint(begin, min(begin + 4, len(text)))
+        text = text[:begin] + _random_text(rand, 4) + text[end:]
+    return text
+
+
+class OpersApplyOpersTest(unittest.TestCase):
+    """Compares _opers_apply_opers() with the loop."""
+
+    def test_random_opers(self):
+        rand = random.Random(1)
+        for _ in range(NUM_CASES):
+            text_len = rand.randint(0, 16)
+            orig_opers = _random_opers(rand, text_len)
+            opers = _random_opers(rand, text_len)
+            self.assertEqual(
+                _dump(text_chain._opers_apply_opers(orig_opers, opers)),
+                _dump(_apply_opers_by_loop(orig_opers, opers)),
+                (_dump(orig_opers), _dump(opers)))
+
+    def test_concurrent_edits(self):
+        rand = random.Random(2)
+        for _ in range(NUM_CASES):
+            base = _random_text(rand, 24)
+            mine = _diff_opers(base, _random_edit(rand, base))
+            for _ in range(rand.randint(1, 3)):
+                other = _random_edit(rand, base)
+                theirs = _diff_opers(base, other)
+                self.assertEqual(
+                    _dump(text_chain._opers_apply_opers(mine, theirs)),
+                    _dump(_apply_opers_by_loop(mine, theirs)),
+                    (base, _dump(mine), _dump(theirs)))
+                mine = text_chain._opers_apply_opers(mine, theirs)
+                base = other
+
+    def test_offset_once(self):
+        orig_opers = [text_chain._ChgTextOper(3, 4, 'x')]
+        opers = [text_chain._ChgTextOper(0, 0, 'ab'),
+                 text_chain._ChgTextOper(5, 5, 'cd')]
+        self.assertEqual(
+            _dump(text_chain._opers_apply_opers(orig_opers, opers)),
+            [(5, 6, 'x')])
+
+
+class ComposeOpersTest(unittest.TestCase):
+    """Checks _compose_opers() by the texts."""
+
+    def test_random_opers(self):
+        rand = random.Random(3)
+        for _ in range(NUM_CASES):
+            text = _random_text(rand, 16)
+            firsts = _random_opers(rand, len(text))
+            middle = _do_opers(text, firsts)
+            seconds = _random_opers(rand, len(middle))
+            composed = text_chain._compose_opers(firsts, seconds)
+            self.assertEqual(_do_opers(text, composed),
+                             _do_opers(middle, seconds),
+                             (text, _dump(firsts), _dump(seconds)))
+            for prev, oper in zip(composed, composed[1:]):
+                self.assertLess(prev.end, oper.begin)
+
+    def test_edit_stream(self):
+        rand = random.Random(4)
+        for _ in range(NUM_CASES // 10):
+            text = orig = _random_text(rand, 24)
+            composed = []
+            for _ in range(rand.randint(1, 8)):
+                new_text = _random_edit(rand, text)
+                composed = text_chain._compose_opers(
+                    composed, _diff_opers(text, new_text))
+                text = new_text
+                self.assertEqual(_do_opers(orig, composed), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
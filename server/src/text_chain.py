@@ -1,7 +1,8 @@
 """TextChain."""
 
-import difflib
 import log
+import rope
+import text_diff
 
 
 class TextChain(object):
@@ -9,70 +10,154 @@ class TextChain(object):
 
     Attributes:
         _save_filename: Name of the file to stores the content of the buffer.
-        _commits: A list of 2-tuple which likes:
-            first element: The commit id.
-            second element: The instance of _TextCommit.
+        _nodes: A dict maps the commit id to the instance of _CommitNode.
+        _head: The first instance of _CommitNode in the chain.
+        _tail: The last instance of _CommitNode in the chain.
         _last_commit: An instance of _TextCommit, cache the last commit for
                 updating the cursor position after commiting.
+        _diff_func: The diff engine for creating the commits.
+        _text_saver: An instance of TextSaver to write the file in background,
+                None for writing it at each commit.
+        _text_journal: An instance of TextJournal to record the changes of
+                each commit, None for no journal.
     """
-    def __init__(self, save_filename):
+    def __init__(self, save_filename, diff_func=text_diff.diff_texts,
+                 text_saver=None, text_journal=None):
         """Constructor.
 
         Args:
             save_filename: Name of the file to save the lastest commit text.
+            diff_func: The diff engine, see text_diff.diff_texts() for the
+                    format.
+            text_saver: An instance of TextSaver for saving the text, None for
+                    saving it synchronously.
+            text_journal: An instance of TextJournal for recording and
+                    recovering the changes, None for no journal.
         """
         self._save_filename = save_filename
+        self._diff_func = diff_func
+        self._text_saver = text_saver
+        self._text_journal = text_journal
         content = ''
         try:
             with open(save_filename, 'r') as f:
                 content = f.read()
         except IOError:
             log.info('Cannot load the default text.')
-        self._commits = [
-            (0, _TextCommit('', '')),
-            (1, _TextCommit('', content))]
+        if text_journal:
+            content = text_journal.recover(content)
+        self._nodes = {}
+        self._head = self._tail = None
+        self._append(0, _TextCommit('', ''))
+        self._append(1, _TextCommit('', content))
         self._last_commit = None
 
-    def commit(self, orig_id, new_text, cursors):
-        """Commits a update.
+    def prepare_commit_patch(self, orig_text, patch):
+        """Creates a commit from a line-based patch of its original text.
+
+        The operations are built from the line offsets of the changed rows, so
+        the cost grows with the size of the patch instead of the whole text.
+        It only reads the gived text, so it can be called without holding the
+        lock of the chain.
+
+        Args:
+            orig_text: Text of the original commit, an instance of rope.Rope.
+            patch: A sorted list of 3-tuple (begin_row, end_row, lines) which
+                    means replacing the rows [begin_row, end_row) of the
+                    original text with the list of lines.
+
+        Return:
+            A prepared commit for append_commit().
+        """
+        return _patch_to_commit(orig_text, patch, self._diff_func)
+
+    def append_commit(self, orig_id, commit, cursors, line_view=None):
+        """Rebases a prepared commit to the latest one and appends it.
 
         Args:
-            orig_id: Original commit id.
-            new_text: Updated text.
+            orig_id: Original commit id, whose text the commit was prepared
+                    on.
+            commit: The commit from prepare_commit_patch().
             cursors: Cursors to rebase at the same time.
+            line_view: An instance of rope.LineView of the text of the commit
+                    before rebasing, it is cached with the new text if no
+                    later commit changes the text.
+
+        The last text is not saved again if the rebased commit changes
+        nothing.
 
         Return:
-            A 3-tuple for new commit id, new text and the rebased cursors.
+            A 3-tuple for new commit id, new text (an instance of rope.Rope)
+            and the rebased cursors.
         """
-        old_index = self._get_commit_index(orig_id)
-        commit = _TextCommit(self._commits[old_index][1].text, new_text)
+        later_commits, node = [], self._nodes[orig_id].next
+        while node:
+            later_commits.append(node.commit)
+            node = node.next
         cursors_info = [commit.get_cursor_info(cur) for cur in cursors]
-        commit.apply_commits([cm[1] for cm in self._commits[old_index + 1 :]])
+        commit.apply_commits(later_commits)
+        if line_view is not None and \
+                not any(later.opers for later in later_commits):
+            commit.text.cache_line_view(line_view)
+        changed = bool(commit.opers)
         self._last_commit = commit.copy()
-        new_id = self._commits[-1][0] + 1
+        new_id = self._tail.commit_id + 1
         for info in cursors_info:
-            info.apply_commits([cm[1] for cm in self._commits[old_index + 1 :]])
+            info.apply_commits(later_commits)
         new_cursors = [cursor_info.position for cursor_info in cursors_info]
-        self._commits += [(new_id, commit),
-                          (new_id + 1, _TextCommit(commit.text, commit.text))]
+        seq = None
+        if self._text_journal and changed:
+            # Records the operations before they are merged with the neighbours.
+            seq = self._text_journal.append([(oper.begin, oper.end,
+                                              oper.new_text)
+                                             for oper in commit.opers])
+        new_node = self._append(new_id, commit)
+        self._append(new_id + 1, _TextCommit(commit.text, commit.text))
         self.delete(orig_id)
-        self.delete(self._commits[-3][0])
-        self._save()
+        self.delete(new_node.prev.commit_id)
+        if changed:
+            self._save(seq)
         return new_id, commit.text, new_cursors
 
     def update_cursors(self, cursors):
         """Updates the cursors by the last commit.
 
+        The cursors of many users can be passed together, they are sorted
+        once and the operations of the last commit are swept only once.
+
         Args:
             cursors: List of cursor position.
 
         Return:
             List of updated cursor position.
         """
-        cursors_info = [_CursorInfo_OnOrigText(cursor) for cursor in cursors]
-        for cursor_info in cursors_info:
-            cursor_info.apply_commits([self._last_commit])
-        return [cursor_info.position for cursor_info in cursors_info]
+        return _rebase_positions(cursors, self._last_commit.opers)
+
+    def is_latest(self, commit_id):
+        """Checks whether the text of a commit is the last text.
+
+        Args:
+            commit_id: Id of the commit.
+
+        Return:
+            True if no commit after it changes the text.
+        """
+        node = self._nodes[commit_id].next
+        while node:
+            if node.commit.opers:
+                return False
+            node = node.next
+        return True
+
+    def get_last_changed_position(self):
+        """Gets the first position changed by the last commit.
+
+        Return:
+            The position on the text before the last commit, None if the last
+            commit changes nothing.
+        """
+        opers = self._last_commit.opers
+        return opers[0].begin if opers else None
 
     def new(self):
         """Creates an empty commit.
@@ -80,8 +165,13 @@ class TextChain(object):
         Return:
             The commit id of the new commit.
         """
-        commit_id = self._commits[0][0]
-        self._commits.insert(0, (commit_id - 1, _TextCommit('', '')))
+        commit_id = self._head.commit_id
+        node = _CommitNode(commit_id - 1, _TextCommit('', ''))
+        # Keeps the operations of the old first commit based on the new empty
+        # one, so it can be merged with its neighbours later.
+        self._head.commit = _insertion_commit(self._head.commit.text)
+        node.next, self._head.prev = self._head, node
+        self._head = self._nodes[node.commit_id] = node
         return commit_id
 
     def delete(self, commit_id):
@@ -90,50 +180,182 @@ class TextChain(object):
         Args:
             commit_id: The id of the commit to be delete.
         """
-        index = self._get_commit_index(commit_id)
-        if index + 1 < len(self._commits):
-            pre_text = self._commits[index - 1][1].text
-            nxt_text = self._commits[index + 1][1].text
-            self._commits[index + 1] = (self._commits[index + 1][0],
-                                        _TextCommit(pre_text, nxt_text))
-        del self._commits[index]
+        node = self._nodes.pop(commit_id)
+        if node.next:
+            # The operations of the first commit are never used, so only the
+            # commits after another one needs to be merged.
+            if node.prev:
+                node.next.commit.squash(node.commit)
+            node.next.prev = node.prev
+        else:
+            self._tail = node.prev
+        if node.prev:
+            node.prev.next = node.next
+        else:
+            self._head = node.next
 
-    def get_text(self, commit_id):
-        """Gets the text of a specified commit.
+    def get_rope(self, commit_id):
+        """Gets the text of a specified commit without materializing it.
 
         Args:
             commit_id: Id of that commit.
 
         Return:
-            The text.
+            The text, an instance of rope.Rope.
         """
-        return self._commits[self._get_commit_index(commit_id)][1].text
+        return self._nodes[commit_id].commit.text
 
-    def _get_commit_index(self, commit_id):
-        """Gets the index of the commits from gived commit id.
+    def _append(self, commit_id, commit):
+        """Appends a commit to the end of the chain.
 
         Args:
-            commit_id: Commit id.
+            commit_id: Id of the commit.
+            commit: An instance of _TextCommit.
 
-        Returns:
-            Index of the corrosponding commit.
+        Return:
+            The instance of _CommitNode.
         """
-        for index in range(len(self._commits)):
-            if self._commits[index][0] == commit_id:
-                return index
+        node = _CommitNode(commit_id, commit)
+        if self._tail:
+            node.prev, self._tail.next = self._tail, node
+        else:
+            self._head = node
+        self._tail = self._nodes[commit_id] = node
+        return node
+
+    def _save(self, seq=None):
+        """Saves the last text to the file.
 
-    def _save(self):
-        """Saves the last text to the file."""
+        Args:
+            seq: Sequence number of the journal batch of the last commit.
+        """
+        text = self._tail.commit.text
+        if self._text_saver:
+            self._text_saver.save(text, seq)
+            return
+        if seq is not None:
+            self._text_journal.checkpoint(seq, text)
         try:
             with open(self._save_filename, 'w') as f:
-                f.write(self._commits[-1][1].text)
+                for chunk in text.chunks():
+                    f.write(chunk)
         except IOError:
             log.info('Cannot save the text to the file.')
+            return
+        if seq is not None:
+            self._text_journal.compact(seq)
+
+
+class _CommitNode(object):
+    """A node of the doubly linked chain of commits.
+
+    Attributes:
+        commit_id: Id of the commit.
+        commit: The instance of _TextCommit.
+        prev: The previous instance of _CommitNode, None for the first one.
+        next: The next instance of _CommitNode, None for the last one.
+    """
+    __slots__ = ('commit_id', 'commit', 'prev', 'next')
+
+    def __init__(self, commit_id, commit):
+        """Constructor.
+
+        Args:
+            commit_id: Id of the commit.
+            commit: The instance of _TextCommit.
+        """
+        self.commit_id = commit_id
+        self.commit = commit
+        self.prev = None
+        self.next = None
+
+
+def _patch_to_commit(old_text, patch, diff_func):
+    """Creates a commit from a line-based patch.
+
+    Args:
+        old_text: The original text, an instance of rope.Rope.
+        patch: List of (begin_row, end_row, lines), see
+                TextChain.prepare_commit_patch().
+        diff_func: The diff engine for refining the changed rows.
+
+    Return:
+        An instance of _TextCommit.
+    """
+    num_rows, opers = old_text.num_lines, []
+    for beg, end, lines in _squash_line_patch(patch):
+        row_begin = old_text.line_offset(beg)
+        row_end = (old_text.line_offset(end) - 1 if end < num_rows
+                   else len(old_text))
+        if beg < end and lines:
+            begin, end, text = row_begin, row_end, '\n'.join(lines)
+        elif beg < end and end < num_rows:
+            begin, end, text = row_begin, row_end + 1, ''
+        elif beg < end:
+            begin, end, text = max(row_begin - 1, 0), len(old_text), ''
+        elif lines and beg < num_rows:
+            begin = end = row_begin
+            text = '\n'.join(lines) + '\n'
+        elif lines:
+            begin = end = len(old_text)
+            text = '\n' + '\n'.join(lines)
+        else:
+            continue
+        opers += [_ChgTextOper(begin + sub_begin, begin + sub_end, sub_text)
+                  for sub_begin, sub_end, sub_text
+                  in diff_func(old_text.substring(begin, end), text)]
+    ret = _TextCommit('', '')
+    ret._opers = _merge_touching_opers(opers)
+    ret._rebase_text(old_text)
+    return ret
+
+
+def _squash_line_patch(patch):
+    """Merges the entries of a line-based patch which touch each other.
+
+    Args:
+        patch: List of (begin_row, end_row, lines).
+
+    Return:
+        List of (begin_row, end_row, lines) with a gap between the entries.
+    """
+    ret = []
+    for beg, end, lines in patch:
+        if ret and ret[-1][1] >= beg:
+            ret[-1] = (ret[-1][0], end, ret[-1][2] + list(lines))
+        else:
+            ret.append((beg, end, list(lines)))
+    return ret
+
+
+def _merge_touching_opers(opers):
+    """Merges the sorted operations which touch each other.
+
+    Args:
+        opers: A sorted list of instance of _ChgTextOper.
+
+    Return:
+        A list of instance of _ChgTextOper.
+    """
+    ret = []
+    for oper in opers:
+        if ret and ret[-1].end >= oper.begin:
+            ret[-1] = _ChgTextOper(ret[-1].begin, oper.end,
+                                   ret[-1].new_text + oper.new_text)
+        else:
+            ret.append(oper)
+    return ret
 
 
 def _opers_apply_opers(orig_opers, opers_tobe_applied):
     """Let a list of operations apply another list of operations.
 
+    Both lists are sorted, so it sweeps them together.  For each original
+    operation, the applied operations totally at its left side only offset it,
+    the ones totally at its right side change nothing, and only the few ones
+    between them are applied by _ChgTextOper.apply_oper(), from the right to
+    the left so that the positions of the remaining ones are still valid.
+
     Args:
         orig_opers: List of instance of _ChgTextOper.
         opers_tobe_applied: List of instance of _ChgTextOper.
@@ -142,14 +364,199 @@ def _opers_apply_opers(orig_opers, opers_tobe_applied):
         A list of instance of _ChgTextOper, which are the ones applied the
         opers_tobe_applied from the orig_opers.
     """
-    ret = orig_opers
-    for oper_tobe_applied in opers_tobe_applied:
+    if not opers_tobe_applied:
+        return orig_opers
+    ret, offset, left, right = [], 0, 0, 0
+    num = len(opers_tobe_applied)
+    for orig_oper in orig_opers:
+        begin, end = orig_oper.begin, orig_oper.end
+        while left < num and _is_left_seperate(opers_tobe_applied[left], begin):
+            offset += opers_tobe_applied[left].increased_length
+            left += 1
+        right = max(left, right)
+        while right < num and not (opers_tobe_applied[right].begin > begin and
+                                   opers_tobe_applied[right].begin >= end):
+            right += 1
         # The operation might split into multiple operations after rebasing,
         # So here we needs to use another list to stores the new operations.
-        updated_opers = []
-        for orig_oper in ret:
-            updated_opers += orig_oper.apply_oper(oper_tobe_applied)
-        ret = updated_opers
+        opers = [orig_oper]
+        for index in range(right - 1, left - 1, -1):
+            updated_opers = []
+            for oper in opers:
+                updated_opers += oper.apply_oper(opers_tobe_applied[index])
+            opers = updated_opers
+        ret += [_ChgTextOper(oper.begin + offset, oper.end + offset,
+                             oper.new_text) for oper in opers] \
+            if offset else opers
+    return ret
+
+
+def _rebase_positions(positions, opers):
+    """Rebases positions on the original text to the text after the operations.
+
+    All the positions are compared with the operations on the original text,
+    so the operations touching each other act just like a merged one.
+
+    Args:
+        positions: List of positions.
+        opers: A sorted list of instance of _ChgTextOper.
+
+    Return:
+        List of the rebased positions, in the same order as the given ones.
+    """
+    ret = [0] * len(positions)
+    index, offset, num = 0, 0, len(opers)
+    for order in sorted(range(len(positions)), key=positions.__getitem__):
+        position = positions[order]
+        while index < num and opers[index].begin < position and \
+                opers[index].end - 1 <= position:
+            # Just offset to the right place if the operation occures totally
+            # at the left side of the cursor.
+            offset += opers[index].increased_length
+            index += 1
+        if index < num and opers[index].begin < position:
+            # Moves the position to the begin of this operation when the cursor
+            # is inside the operation.
+            ret[order] = opers[index].begin + offset
+        else:
+            # Remain changeless by the operations after the cursor position.
+            ret[order] = max(position + offset, 0)
+    return ret
+
+
+def _is_left_seperate(oper, position):
+    """Checks whether an operation only offsets the text after a position.
+
+    Args:
+        oper: An instance of _ChgTextOper.
+        position: The position.
+
+    Return:
+        True if the operation is totally at the left side of the position or
+        inserts a string just at the position.
+    """
+    return oper.end <= position and (oper.begin < position or
+                                     oper.begin == oper.end)
+
+
+def _compose_opers(first_opers, second_opers):
+    """Composes two lists of operations which are done one after another.
+
+    The ranges of the first operations' results and the second operations are
+    grouped on the middle text while they overlap or touch each other, so every
+    character in a group comes either from the first operations or is replaced
+    by the second operations, and the middle text itself is never needed.
+
+    Args:
+        first_opers: A sorted list of instance of _ChgTextOper.
+        second_opers: A sorted list of instance of _ChgTextOper based on the
+                text after done the first_opers.
+
+    Return:
+        A sorted list of instance of _ChgTextOper which does the same thing as
+        doing the first_opers and then the second_opers.
+    """
+    # The commits from _insertion_commit() are composed only after an emptied
+    # text, so their ropes are rarely turned into strings.
+    first_opers = _str_opers(first_opers)
+    second_opers = _str_opers(second_opers)
+    # Ranges on the middle text, 3-tuple (begin, end, oper, is_first).
+    ranges, offset = [], 0
+    for oper in first_opers:
+        begin = oper.begin + offset
+        ranges.append((begin, begin + len(oper.new_text), oper, True))
+        offset += oper.increased_length
+    ranges += [(oper.begin, oper.end, oper, False) for oper in second_opers]
+    ranges.sort(key=lambda r: (r[0], r[1]))
+    ret, group, offset, end = [], [], 0, 0
+    for index, item in enumerate(ranges):
+        end = max(end, item[1]) if group else item[1]
+        group.append(item)
+        if index + 1 < len(ranges) and ranges[index + 1][0] <= end:
+            continue
+        oper = _compose_group(group, offset)
+        offset += sum(r[2].increased_length for r in group if r[3])
+        if oper.begin < oper.end or oper.new_text:
+            ret.append(oper)
+        group = []
+    return ret
+
+
+def _str_opers(opers):
+    """Turns the new texts of the operations into strings.
+
+    Args:
+        opers: A list of instance of _ChgTextOper, the new texts are strings
+                or instances of rope.Rope.
+
+    Return:
+        A list of instance of _ChgTextOper whose new texts are strings.
+    """
+    return [_ChgTextOper(oper.begin, oper.end, str(oper.new_text))
+            if isinstance(oper.new_text, rope.Rope) else oper
+            for oper in opers]
+
+
+def _compose_group(group, offset):
+    """Composes a group of ranges in _compose_opers() into one operation.
+
+    Args:
+        group: List of 4-tuple (begin, end, oper, is_first) sorted by the
+                begin, and the union of the ranges has no gap.
+        offset: The increased length by the first operations before the group.
+
+    Return:
+        An instance of _ChgTextOper based on the original text.
+    """
+    begin, end = group[0][0], max(r[1] for r in group)
+    firsts = [r for r in group if r[3]]
+    orig_begin = (firsts[0][2].begin if firsts and firsts[0][0] == begin
+                  else begin - offset)
+    if firsts and firsts[-1][1] == end:
+        orig_end = firsts[-1][2].end
+    else:
+        orig_end = end - offset - sum(r[2].increased_length for r in firsts)
+    pieces, pos = [], begin
+    for item in group:
+        if not item[3]:
+            pieces += _middle_text(firsts, pos, item[0])
+            pieces.append(item[2].new_text)
+            pos = max(pos, item[1])
+    pieces += _middle_text(firsts, pos, end)
+    return _ChgTextOper(orig_begin, orig_end, ''.join(pieces))
+
+
+def _middle_text(firsts, begin, end):
+    """Gets a part of the middle text which is covered by the first operations.
+
+    Args:
+        firsts: List of 4-tuple (begin, end, oper, is_first) for the first
+                operations' results.
+        begin: Begin of the range on the middle text.
+        end: End of the range on the middle text.
+
+    Return:
+        List of strings.
+    """
+    return [oper.new_text[max(begin, beg) - beg : min(end, fin) - beg]
+            for beg, fin, oper, unused_first in firsts
+            if beg < end and begin < fin]
+
+
+def _insertion_commit(text):
+    """Creates a commit which inserts a whole text into an empty text.
+
+    Args:
+        text: The text, an instance of rope.Rope.
+
+    Return:
+        An instance of _TextCommit.
+    """
+    ret = _TextCommit('', '')
+    ret._text = text
+    # The new text of the operation is the rope itself instead of a string, so
+    # the text is not copied until _compose_opers() needs it.
+    ret._opers = [_ChgTextOper(0, 0, text)] if len(text) else []
     return ret
 
 
@@ -160,28 +567,32 @@ class _TextCommit(object):
     changing the original string to the new one.
 
     Attributes:
-        _text: The final text.
+        _text: The final text, an instance of rope.Rope which shares the
+                unchanged pieces with the other commits.
         _opers: List of operations for changing the original string to the new
                 one.
     """
-    def __init__(self, old_text, new_text):
+    __slots__ = ('_text', '_opers')
+
+    def __init__(self, old_text, new_text, diff_func=text_diff.diff_texts):
         """Constructor.
 
         Args:
-            old_text: The original text.
-            new_text: The final text after commited.
+            old_text: The original text, a string or an instance of rope.Rope.
+            new_text: The final text after commited, a string or an instance
+                    of rope.Rope.
+            diff_func: The diff engine, see text_diff.diff_texts() for the
+                    format.
         """
-        self._text = new_text
-        self._opers = []
-        diff = difflib.SequenceMatcher(a=old_text, b=new_text)
-        for tag, begin, end, begin2, end2 in diff.get_opcodes():
-            if tag in ('replace', 'delete', 'insert'):
-                self._opers.append(
-                    _ChgTextOper(begin, end, new_text[begin2 : end2]))
+        self._text = (new_text if isinstance(new_text, rope.Rope)
+                      else rope.Rope(new_text))
+        self._opers = [] if old_text is new_text else [
+            _ChgTextOper(begin, end, text)
+            for begin, end, text in diff_func(str(old_text), str(new_text))]
 
     @property
     def text(self):
-        """Gets the final text after this commit."""
+        """Gets the final text after this commit, an instance of rope.Rope."""
         return self._text
 
     @property
@@ -202,8 +613,8 @@ class _TextCommit(object):
         """
         ret = _TextCommit('', '')
         ret._text = self.text
-        ret._opers = [_ChgTextOper(oper.begin, oper.end, oper.new_text)
-                      for oper in self._opers]
+        # The operations are immutable, so they can be shared.
+        ret._opers = list(self._opers)
         return ret
 
     def apply_commits(self, commits):
@@ -217,6 +628,22 @@ class _TextCommit(object):
                 self._opers = _opers_apply_opers(self._opers, commit._opers)
             self._rebase_text(commits[-1].text)
 
+    def squash(self, prev_commit):
+        """Merges the previous commit into this one.
+
+        After merging, the operations of this commit change the original text
+        of the previous commit to the final text directly.
+
+        Args:
+            prev_commit: The instance of _TextCommit just before this one.
+        """
+        if len(prev_commit.text) == prev_commit.increased_length:
+            # The previous commit is based on an empty text, ex: the ones from
+            # TextChain.new(), so the merged one just inserts my whole text.
+            self._opers = _insertion_commit(self._text)._opers
+            return
+        self._opers = _compose_opers(prev_commit._opers, self._opers)
+
     def get_cursor_info(self, cursor_pos):
         """Gets the cursor information by gived cursor position.
 
@@ -242,25 +669,23 @@ class _TextCommit(object):
         """Rebase the original text to another text.
 
         Args:
-            new_orig_text: The new text.
+            new_orig_text: The new text, an instance of rope.Rope.
         """
-        end_index = 0
-        self._text = ''
-        for oper in self._opers:
-            self._text += new_orig_text[end_index : oper.begin]
-            self._text += oper.new_text
-            end_index = oper.end
-        self._text += new_orig_text[end_index : ]
+        self._text = new_orig_text
+        for oper in reversed(self._opers):
+            self._text = self._text.replace(oper.begin, oper.end, oper.new_text)
 
 
 class _CursorInfo_OnNewCommit(object):
     """About the cursor position who is at the place changed in the new commit.
 
     Attributes:
-        _opers: The duplicated operation of the original operation.
+        _opers: The operations rebased from the original operation.
         _delta: The offset between the cursor position and the begin of the
                 operation's range.
     """
+    __slots__ = ('_opers', '_delta')
+
     def __init__(self, oper, delta):
         """Constructor.
 
@@ -271,7 +696,7 @@ class _CursorInfo_OnNewCommit(object):
         """
         # We need to store it in a list because after applying other commits, it
         # might split into multiple operations.
-        self._opers = [_ChgTextOper(oper.begin, oper.end, oper.new_text)]
+        self._opers = [oper]
         self._delta = delta
 
     def apply_commits(self, commits):
@@ -304,6 +729,8 @@ class _CursorInfo_OnOrigText(object):
     Attributes:
         _position: The position of the cursor.
     """
+    __slots__ = ('_position',)
+
     def __init__(self, position):
         """Constructor.
 
@@ -319,19 +746,8 @@ class _CursorInfo_OnOrigText(object):
             commits: List of commits to be applied.
         """
         for commit in commits:
-            for oper in commit.opers:
-                if self._position <= oper.begin:
-                    # Remain changeless when the operation is after the cursor
-                    # position.
-                    pass
-                elif oper.end - 1 <= self._position:
-                    # Just offset to the right place if the operation occures
-                    # totally at the left side of the cursor.
-                    self._position += oper.increased_length
-                else:
-                    # Moves the position to the begin of this operation when the
-                    # cursor is inside the operation.
-                    self._position = oper.begin
+            self._position = _rebase_positions([self._position],
+                                               commit.opers)[0]
 
     @property
     def position(self):
@@ -357,7 +773,10 @@ class _ChgTextOper(object):
 
     Notes:
         1. The range is an open range [_begin, _end)
+        2. It is immutable, so the commits and the cursors share the instances
+           instead of copying them.
     """
+    __slots__ = ('_begin', '_end', '_new_text')
 
     def __init__(self, beg, end, new_text):
         self._begin = beg
@@ -436,6 +855,8 @@ class _ChgTextOper(object):
             A list of instance of _ChgTextOper.
         """
         offset = oper.increased_length
+        if not offset:
+            return [self]
         return [_ChgTextOper(self._begin + offset, self._end + offset,
                              self._new_text)]
 
@@ -611,4 +1032,4 @@ class _ChgTextOper(object):
         Return:
             A list of instance of _ChgTextOper.
         """
-        return [_ChgTextOper(self._begin, self._end, self._new_text)]
+        return [self]
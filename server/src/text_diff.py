@@ -0,0 +1,325 @@
+"""Diff engines for finding the changes between two texts."""
+
+import difflib
+
+
+# Maximum number of edits the line-level diff will search for before giving up
+# and treating the whole changed region as one replacement.
+MAX_LINE_EDITS = 1024
+
+# Same as MAX_LINE_EDITS, but for the character-level diff inside the changed
+# lines.
+MAX_CHAR_EDITS = 256
+
+# Changed blocks larger than this (in characters) will not be diffed by
+# characters.
+MAX_CHAR_BLOCK = 65536
+
+# Size of the first block to compare when searching the common prefix/suffix.
+_CHUNK_SIZE = 1024
+
+
+def diff_texts(old_text, new_text):
+    """Finds the replacements which change a text to another one.
+
+    It anchors on the common prefix and suffix first, then diffs the remain
+    part line by line and only goes down to characters inside the changed lines,
+    so the cost grows with the size of the change instead of the size of the
+    whole text.
+
+    Args:
+        old_text: The original text.
+        new_text: The new text.
+
+    Return:
+        A sorted list of 3-tuple (begin, end, text) which means replacing the
+        range [begin, end) of the original text with the string "text".
+    """
+    prefix_len = _common_prefix_length(old_text, new_text)
+    suffix_len = _common_suffix_length(old_text, new_text,
+                                       min(len(old_text), len(new_text)) -
+                                       prefix_len)
+    old_mid = old_text[prefix_len : len(old_text) - suffix_len]
+    new_mid = new_text[prefix_len : len(new_text) - suffix_len]
+    if not old_mid or not new_mid:
+        return [(prefix_len, prefix_len + len(old_mid), new_mid)] \
+            if old_mid or new_mid else []
+    old_lines, new_lines = _split_lines(old_mid), _split_lines(new_mid)
+    line_ids = {}
+    old_ids = [line_ids.setdefault(line, len(line_ids)) for line in old_lines]
+    new_ids = [line_ids.setdefault(line, len(line_ids)) for line in new_lines]
+    old_offsets, new_offsets = _offsets(old_lines), _offsets(new_lines)
+    ret = []
+    for beg, end, beg2, end2 in diff_sequences(old_ids, new_ids,
+                                               MAX_LINE_EDITS):
+        old_base, new_base = old_offsets[beg], new_offsets[beg2]
+        old_block = old_mid[old_base : old_offsets[end]]
+        new_block = new_mid[new_base : new_offsets[end2]]
+        if len(old_block) + len(new_block) > MAX_CHAR_BLOCK:
+            ret.append((prefix_len + old_base, prefix_len + old_offsets[end],
+                        new_block))
+            continue
+        for cbeg, cend, cbeg2, cend2 in diff_sequences(old_block, new_block,
+                                                       MAX_CHAR_EDITS):
+            ret.append((prefix_len + old_base + cbeg,
+                        prefix_len + old_base + cend,
+                        new_block[cbeg2 : cend2]))
+    return ret
+
+
+def diff_texts_by_sequence_matcher(old_text, new_text):
+    """Same as diff_texts(), but runs difflib.SequenceMatcher on characters.
+
+    It is much slower on large texts, but is kept as a reference engine.
+
+    Args:
+        old_text: The original text.
+        new_text: The new text.
+
+    Return:
+        Same as diff_texts().
+    """
+    diff = difflib.SequenceMatcher(a=old_text, b=new_text)
+    return [(begin, end, new_text[begin2 : end2])
+            for tag, begin, end, begin2, end2 in diff.get_opcodes()
+            if tag in ('replace', 'delete', 'insert')]
+
+
+def diff_lines(lines_a, lines_b, max_edits=MAX_LINE_EDITS):
+    """Finds the changed blocks between two lists of lines.
+
+    The common prefix and suffix are found by comparing slices, then only the
+    lines between them are interned to integers for the Myers' algorithm.
+
+    Args:
+        lines_a: The original list of lines.
+        lines_b: The new list of lines.
+        max_edits: Same as diff_sequences().
+
+    Return:
+        Same as diff_sequences().
+    """
+    beg = _common_prefix_length(lines_a, lines_b)
+    suffix_len = _common_suffix_length(lines_a, lines_b,
+                                       min(len(lines_a), len(lines_b)) - beg)
+    end_a, end_b = len(lines_a) - suffix_len, len(lines_b) - suffix_len
+    if beg == end_a or beg == end_b or \
+            _exceeds_max_edits(end_a - beg, end_b - beg, max_edits):
+        return [(beg, end_a, beg, end_b)] \
+            if beg < end_a or beg < end_b else []
+    line_ids = {}
+    ids_a = [line_ids.setdefault(line, len(line_ids))
+             for line in lines_a[beg : end_a]]
+    ids_b = [line_ids.setdefault(line, len(line_ids))
+             for line in lines_b[beg : end_b]]
+    return [(beg + beg_a, beg + block_end_a, beg + beg_b, beg + block_end_b)
+            for beg_a, block_end_a, beg_b, block_end_b in
+            diff_sequences(ids_a, ids_b, max_edits)]
+
+
+def diff_sequences(seq_a, seq_b, max_edits=None):
+    """Finds the changed blocks between two sequences by the Myers' algorithm.
+
+    Args:
+        seq_a: The original sequence, elements must be comparable by "==".
+        seq_b: The new sequence.
+        max_edits: Maximum number of inserted/deleted elements to search for,
+                if there are more than this, the whole range between the common
+                prefix and suffix will be reported as one block.  None for no
+                limit.
+
+    Return:
+        A sorted list of 4-tuple (begin_a, end_a, begin_b, end_b) which means
+        the range [begin_a, end_a) in seq_a should be replaced by the range
+        [begin_b, end_b) in seq_b.  Blocks are separated by at least one equal
+        element.
+    """
+    len_a, len_b = len(seq_a), len(seq_b)
+    beg = 0
+    while beg < len_a and beg < len_b and seq_a[beg] == seq_b[beg]:
+        beg += 1
+    end_a, end_b = len_a, len_b
+    while end_a > beg and end_b > beg and seq_a[end_a - 1] == seq_b[end_b - 1]:
+        end_a, end_b = end_a - 1, end_b - 1
+    if beg == end_a and beg == end_b:
+        return []
+    if beg == end_a or beg == end_b or \
+            _exceeds_max_edits(end_a - beg, end_b - beg, max_edits):
+        return [(beg, end_a, beg, end_b)]
+    snakes = _myers_snakes(seq_a[beg : end_a], seq_b[beg : end_b], max_edits)
+    if snakes is None:
+        return [(beg, end_a, beg, end_b)]
+    ret, done_a, done_b = [], 0, 0
+    for x, y, length in snakes + [(end_a - beg, end_b - beg, 0)]:
+        if done_a < x or done_b < y:
+            ret.append((beg + done_a, beg + x, beg + done_b, beg + y))
+        done_a, done_b = x + length, y + length
+    return ret
+
+
+def _exceeds_max_edits(len_a, len_b, max_edits):
+    """Checks whether two sequences surely need more edits than the limit.
+
+    At least the difference of the lengths of elements are inserted/deleted.
+
+    Args:
+        len_a: Length of the original sequence.
+        len_b: Length of the new sequence.
+        max_edits: Limit of the number of edits, None for no limit.
+
+    Return:
+        True if it needs more than max_edits edits.
+    """
+    return max_edits is not None and abs(len_a - len_b) > max_edits
+
+
+def _myers_snakes(seq_a, seq_b, max_edits):
+    """Finds the common runs of the shortest edit script by Myers' algorithm.
+
+    Args:
+        seq_a: The original sequence.
+        seq_b: The new sequence.
+        max_edits: Limit of the number of edits, None for no limit.
+
+    Return:
+        A sorted list of 3-tuple (index_a, index_b, length) for each non-empty
+        common run, or None if it needs more than max_edits edits.
+    """
+    len_a, len_b = len(seq_a), len(seq_b)
+    limit = len_a + len_b if max_edits is None else min(max_edits,
+                                                        len_a + len_b)
+    # trace[d][i] is the furthest x on the diagonal k = 2 * i - d after d edits.
+    trace, prev = [], None
+    for d in range(limit + 1):
+        curr = [0] * (d + 1)
+        for i in range(d + 1):
+            if d == 0:
+                x = 0
+            elif i == 0 or (i != d and prev[i - 1] < prev[i]):
+                x = prev[i]
+            else:
+                x = prev[i - 1] + 1
+            y = x - (2 * i - d)
+            while x < len_a and y < len_b and seq_a[x] == seq_b[y]:
+                x, y = x + 1, y + 1
+            curr[i] = x
+            if x >= len_a and y >= len_b:
+                trace.append(curr)
+                return _backtrack_snakes(trace, len_a, len_b)
+        trace.append(curr)
+        prev = curr
+    return None
+
+
+def _backtrack_snakes(trace, x, y):
+    """Walks back the trace of the Myers' algorithm to get the common runs.
+
+    Args:
+        trace: List of the furthest x on each diagonal after each step.
+        x: The end position on the original sequence.
+        y: The end position on the new sequence.
+
+    Return:
+        Same as _myers_snakes().
+    """
+    snakes = []
+    for d in range(len(trace) - 1, 0, -1):
+        prev, k = trace[d - 1], x - y
+        i = (k + d) // 2
+        if i == 0 or (i != d and prev[i - 1] < prev[i]):
+            prev_k, prev_x = k + 1, prev[i]
+            mid_x = prev_x
+        else:
+            prev_k, prev_x = k - 1, prev[i - 1]
+            mid_x = prev_x + 1
+        if mid_x < x:
+            snakes.append((mid_x, mid_x - k, x - mid_x))
+        x, y = prev_x, prev_x - prev_k
+    if x > 0:
+        snakes.append((0, 0, x))
+    snakes.reverse()
+    return snakes
+
+
+def _common_prefix_length(text_a, text_b):
+    """Gets the length of the common prefix of two strings or lists.
+
+    Args:
+        text_a: A string or a list.
+        text_b: Another string or list.
+
+    Return:
+        The length.
+    """
+    lo, size, limit = 0, _CHUNK_SIZE, min(len(text_a), len(text_b))
+    while lo < limit:
+        hi = min(lo + size, limit)
+        if text_a[lo : hi] != text_b[lo : hi]:
+            # Bisects the mismatched chunk, text_a[lo : hi] != text_b[lo : hi]
+            # always holds here.
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if text_a[lo : mid] == text_b[lo : mid]:
+                    lo = mid
+                else:
+                    hi = mid
+            return lo
+        lo, size = hi, size * 2
+    return limit
+
+
+def _common_suffix_length(text_a, text_b, limit):
+    """Gets the length of the common suffix of two strings or lists.
+
+    Args:
+        text_a: A string or a list.
+        text_b: Another string or list.
+        limit: Maximum length to check.
+
+    Return:
+        The length.
+    """
+    len_a, len_b = len(text_a), len(text_b)
+    lo, size = 0, _CHUNK_SIZE
+    while lo < limit:
+        hi = min(lo + size, limit)
+        if text_a[len_a - hi : len_a - lo] != text_b[len_b - hi : len_b - lo]:
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if text_a[len_a - mid : len_a - lo] == \
+                        text_b[len_b - mid : len_b - lo]:
+                    lo = mid
+                else:
+                    hi = mid
+            return lo
+        lo, size = hi, size * 2
+    return limit
+
+
+def _split_lines(text):
+    """Splits a text into lines with the newline characters kept.
+
+    Args:
+        text: The text.
+
+    Return:
+        List of lines, joining them gives the original text.
+    """
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][ : -1]
+    return lines if lines[-1] else lines[ : -1]
+
+
+def _offsets(lines):
+    """Gets the offsets of the begin of each line.
+
+    Args:
+        lines: List of lines.
+
+    Return:
+        A list with length len(lines) + 1, the last element is the total length.
+    """
+    ret = [0]
+    for line in lines:
+        ret.append(ret[-1] + len(line))
+    return ret
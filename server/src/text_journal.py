@@ -0,0 +1,223 @@
+"""TextJournal."""
+
+import json
+import os
+import threading
+import zlib
+
+import log
+import rope
+
+
+# Seconds between the snapshots when the changes are journaled.
+SNAPSHOT_INTERVAL = 30
+
+
+class TextJournal(object):
+    """An append-only journal of the changes of the saved text.
+
+    Each line of the journal is a JSON object, either a batch of operations
+    which changes the previous text to the next one, or a checkpoint which
+    tells the checksum of the text after a batch.  The saved file is a snapshot
+    of the text, so recovering is replaying the batches after the checkpoint
+    matching the snapshot, and the older batches are dropped after a new
+    snapshot is written.
+
+    Attributes:
+        _filename: Name of the journal file.
+        _fsync: Whether to sync the journal to the disk after each append.
+        _lock: A threading.Lock to protect the file and the items.
+        _file: The file object for appending.
+        _seq: Sequence number of the last batch.
+        _items: List of the items (batches and checkpoints) in the journal.
+    """
+    def __init__(self, filename, fsync=False):
+        """Constructor.
+
+        Args:
+            filename: Name of the journal file.
+            fsync: Whether to sync the journal to the disk after each append.
+        """
+        self._filename = filename
+        self._fsync = fsync
+        self._lock = threading.Lock()
+        self._file = None
+        self._seq = 0
+        self._items = []
+
+    def recover(self, snapshot):
+        """Recovers the text from the snapshot and the journal.
+
+        It replays the batches after the last checkpoint matching the snapshot,
+        if there is no such checkpoint, the journal is restarted from the
+        snapshot.
+
+        Args:
+            snapshot: The text in the saved file.
+
+        Return:
+            The recovered text.
+        """
+        items = []
+        try:
+            with open(self._filename, 'r') as f:
+                for line in f:
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError:
+                        # The last line might be broken by a crash.
+                        break
+        except IOError:
+            pass
+        checksum = _checksum([snapshot])
+        checkpoints = [item for item in items
+                       if item.get('checksum') == checksum]
+        with self._lock:
+            if not checkpoints:
+                if items:
+                    log.info('The journal does not match the saved text.\n')
+                self._seq = 0
+                self._reset([_checkpoint(0, checksum)])
+                return snapshot
+            # The checkpoints are written after their batches, so the batches
+            # are found by the sequence numbers instead of the order.
+            self._seq = checkpoints[-1]['seq']
+            batches = dict((item['seq'], item) for item in items
+                           if 'opers' in item)
+            text, kept = rope.Rope(snapshot), [checkpoints[-1]]
+            while self._seq + 1 in batches:
+                self._seq += 1
+                for begin, end, new_text in \
+                        reversed(batches[self._seq]['opers']):
+                    text = text.replace(begin, end, new_text)
+                kept.append(batches[self._seq])
+            self._reset(kept)
+            return str(text)
+
+    def append(self, opers):
+        """Appends a batch of operations.
+
+        Args:
+            opers: List of 3-tuple (begin, end, new_text).
+
+        Return:
+            The sequence number of this batch.
+        """
+        with self._lock:
+            self._seq += 1
+            self._write({'seq': self._seq, 'opers': opers})
+            return self._seq
+
+    def checkpoint(self, seq, text):
+        """Records the checksum of the text after a batch.
+
+        It should be called before writing the text as the snapshot.
+
+        Args:
+            seq: Sequence number of the batch.
+            text: The text after that batch, an instance of rope.Rope.
+        """
+        item = _checkpoint(seq, _checksum(text.chunks()))
+        with self._lock:
+            self._write(item)
+
+    def compact(self, seq):
+        """Drops the items before the checkpoint of a batch.
+
+        It should be called after the text of that batch is written as the
+        snapshot.
+
+        Args:
+            seq: Sequence number of the batch.
+        """
+        with self._lock:
+            self._reset([item for item in self._items if item['seq'] > seq or
+                         (item['seq'] == seq and 'checksum' in item)])
+
+    def close(self):
+        """Closes the journal file."""
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _write(self, item):
+        """Appends an item to the journal.
+
+        Args:
+            item: The item, a dict.
+        """
+        self._items.append(item)
+        if not self._file:
+            return
+        try:
+            self._file.write(_dumps(item) + '\n')
+            self._file.flush()
+            if self._fsync:
+                os.fsync(self._file.fileno())
+        except (IOError, OSError):
+            log.info('Cannot write the journal.\n')
+
+    def _reset(self, items):
+        """Replaces the journal file with the items atomically.
+
+        Args:
+            items: List of the items.
+        """
+        self._items = items
+        if self._file:
+            self._file.close()
+            self._file = None
+        tmp_filename = self._filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w') as f:
+                for item in items:
+                    f.write(_dumps(item) + '\n')
+                f.flush()
+                if self._fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp_filename, self._filename)
+            self._file = open(self._filename, 'a')
+        except (IOError, OSError):
+            log.info('Cannot write the journal.\n')
+
+
+def _checkpoint(seq, checksum):
+    """Creates a checkpoint item.
+
+    Args:
+        seq: Sequence number of the batch.
+        checksum: Checksum of the text after that batch.
+
+    Return:
+        A dict.
+    """
+    return {'seq': seq, 'checksum': checksum}
+
+
+def _checksum(chunks):
+    """Gets the checksum of a text.
+
+    Args:
+        chunks: Pieces of the text.
+
+    Return:
+        A list of the length and the CRC32 of the text.
+    """
+    length, crc = 0, 0
+    for chunk in chunks:
+        length += len(chunk)
+        crc = zlib.crc32(chunk.encode('utf-8'), crc)
+    return [length, crc]
+
+
+def _dumps(item):
+    """Dumps an item to a line.
+
+    Args:
+        item: The item.
+
+    Return:
+        A string without the newline character.
+    """
+    return json.dumps(item, separators=(',', ':'))
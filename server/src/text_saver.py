@@ -0,0 +1,206 @@
+"""TextSaver."""
+
+import os
+import stat
+import tempfile
+import threading
+import time
+
+import log
+
+
+# Seconds to wait after the last change before writing the file.
+DEBOUNCE = 0.5
+
+# Maximum seconds a change can wait before being written.
+MAX_DELAY = 5
+
+
+class TextSaver(threading.Thread):
+    """A thread to write the latest text to the file behind the commits.
+
+    Changes in a burst are merged and only the latest text is written, so the
+    committer never waits on the disk.  With a journal, each written text is
+    also a snapshot to compact the journal.
+
+    Attributes:
+        _filename: Name of the file to save the text.
+        _debounce: Seconds to wait after the last change.
+        _max_delay: Maximum seconds to delay a change.
+        _fsync: Whether to sync the file to the disk after writing it.
+        _journal: An instance of TextJournal, None for no journal.
+        _cond: A threading.Condition to protect and notify the pending text.
+        _text: The text to be written, None if there is nothing new.
+        _seq: Sequence number of the journal batch of the pending text.
+        _first_time: Time of the first change not written yet.
+        _last_time: Time of the last change.
+        _stop_flag: Flag for stopping.
+    """
+    def __init__(self, filename, debounce=DEBOUNCE, max_delay=MAX_DELAY,
+                 fsync=False, journal=None):
+        """Constructor.
+
+        Args:
+            filename: Name of the file to save the text.
+            debounce: Seconds to wait after the last change.
+            max_delay: Maximum seconds to delay a change.
+            fsync: Whether to sync the file to the disk after writing it.
+            journal: An instance of TextJournal to compact after writing the
+                    file, None for no journal.
+        """
+        super(TextSaver, self).__init__()
+        self._filename = filename
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._fsync = fsync
+        self._journal = journal
+        self._cond = threading.Condition()
+        self._text = None
+        self._seq = None
+        self._first_time = None
+        self._last_time = None
+        self._stop_flag = False
+
+    def save(self, text, seq=None):
+        """Schedules to write a text.
+
+        Args:
+            text: The text, an instance of rope.Rope.
+            seq: Sequence number of the journal batch which results the text.
+        """
+        with self._cond:
+            self._last_time = time.time()
+            if self._text is None:
+                self._first_time = self._last_time
+            self._text, self._seq = text, seq
+            self._cond.notify()
+
+    def run(self):
+        """Runs the thread."""
+        while True:
+            with self._cond:
+                while not self._stop_flag and not self._is_due():
+                    self._cond.wait(self._wait_time())
+                text, self._text = self._text, None
+                seq, stop = self._seq, self._stop_flag
+            if text is not None:
+                self.write(text, seq)
+            if stop:
+                break
+
+    def stop(self):
+        """Stops the thread after writing the pending text."""
+        with self._cond:
+            self._stop_flag = True
+            self._cond.notify()
+
+    def _is_due(self):
+        """Checks whether the pending text should be written now.
+
+        Return:
+            True if there is a pending text and it has waited long enough.
+        """
+        return self._text is not None and self._wait_time() <= 0
+
+    def _wait_time(self):
+        """Gets the seconds to wait before writing the pending text.
+
+        Return:
+            Number of seconds, None for waiting until a new change.
+        """
+        if self._text is None:
+            return None
+        now = time.time()
+        return min(self._last_time + self._debounce,
+                   self._first_time + self._max_delay) - now
+
+    def write(self, text, seq=None):
+        """Writes a text to the file right now.
+
+        A regular file is replaced atomically by a temporary file in the same
+        directory, other kinds of file (ex: /dev/null) are just written.
+
+        Args:
+            text: The text, an instance of rope.Rope.
+            seq: Sequence number of the journal batch which results the text.
+        """
+        if self._journal and seq is not None:
+            self._journal.checkpoint(seq, text)
+        if self._write_file(text.chunks()) and self._journal and \
+                seq is not None:
+            self._journal.compact(seq)
+
+    def _write_file(self, chunks):
+        """Writes the pieces of a text to the file.
+
+        Args:
+            chunks: The pieces of the text.
+
+        Return:
+            True if success.
+        """
+        try:
+            if os.path.exists(self._filename) and \
+                    not os.path.isfile(self._filename):
+                with open(self._filename, 'w') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                return True
+            dirname = os.path.dirname(os.path.abspath(self._filename))
+            fd, tmp_filename = tempfile.mkstemp(dir=dirname, prefix='.shrvim')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                    f.flush()
+                    if self._fsync:
+                        os.fsync(f.fileno())
+                # mkstemp() creates the file only for the owner, so it gets
+                # the mode of the replaced file, or of a newly created one.
+                mode = stat.S_IMODE(os.stat(self._filename).st_mode) \
+                        if os.path.exists(self._filename) else 0o666 & ~_UMASK
+                os.chmod(tmp_filename, mode)
+                os.replace(tmp_filename, self._filename)
+            except (IOError, OSError):
+                os.unlink(tmp_filename)
+                raise
+            if self._fsync:
+                _fsync_dir(dirname)
+            return True
+        except (IOError, OSError):
+            log.info('Cannot save the text to the file.\n')
+            return False
+
+
+def _get_umask():
+    """Gets the file mode creation mask of the process.
+
+    Return:
+        The mask.
+    """
+    ret = os.umask(0)
+    os.umask(ret)
+    return ret
+
+
+# The mask is read once when no thread creates the files yet, since reading it
+# changes it for a moment.
+_UMASK = _get_umask()
+
+
+def _fsync_dir(dirname):
+    """Syncs a directory to make a rename in it durable.
+
+    Args:
+        dirname: Name of the directory.
+    """
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -1,5 +1,6 @@
 """UsersTextManager."""
 
+import itertools
 import threading
 
 from text_chain import TextChain
@@ -7,6 +8,10 @@ from text_chain import TextChain
 
 UNKNOWN = -1
 
+# Source of the keys and the presence versions of the users, they never repeat
+# even among the documents.
+_presence_counter = itertools.count(1)
+
 class AUTHORITY:  # pylint:disable=W0232
     """Enumeration the types of authority."""
     READONLY = 1  # can only read.
@@ -22,6 +27,10 @@ class UserInfo(object):
         mode: Vim mode.
         cursors: A dict stores cursor positions of each mark.
         last_commit_id: Last commit's id.
+        key: A number identifying the user to the other users.
+        presence_version: Version of the nick name, the mode and the row-col
+                cursor positions shown to the other users, it increases when
+                they change.
     """
     def __init__(self, authority=UNKNOWN, nick_name='', mode=UNKNOWN,
                  cursors=None):
@@ -36,35 +45,119 @@ class UserInfo(object):
         self.mode = mode
         self.cursors = {} if cursors is None else cursors
         self.last_commit_id = UNKNOWN
+        self.key = UNKNOWN
+        self.presence_version = UNKNOWN
 
     def __str__(self):
         return 'authorith = %r, nickname = %r, mode = %r, last_commit = %r' % (
             self.authority, self.nick_name, self.mode, self.last_commit_id)
 
+    def copy(self):
+        """Returns a copy of myself.
+
+        Return:
+            An instance of UserInfo.
+        """
+        ret = UserInfo(self.authority, self.nick_name, self.mode, self.cursors)
+        ret.last_commit_id = self.last_commit_id
+        ret.key = self.key
+        ret.presence_version = self.presence_version
+        return ret
+
+
+class _UsersView(object):
+    """An immutable snapshot of the users and their texts.
+
+    Attributes:
+        users: A dict maps the user identity to the instance of UserInfo.
+        texts: A dict maps the user identity to the last commit text, an
+                instance of rope.Rope.
+        online: A dict maps the identity of the online users (whose mode is
+                known) to the instance of UserInfo.
+    """
+    def __init__(self, users, texts, online):
+        """Constructor.
+
+        Args:
+            users: A dict maps the user identity to the instance of UserInfo.
+            texts: A dict maps the user identity to the last commit text.
+            online: A dict maps the online user identity to the instance of
+                    UserInfo.
+        """
+        self.users = users
+        self.texts = texts
+        self.online = online
+
+    def copy(self):
+        """Returns a copy of the tables to be modified.
+
+        Return:
+            A 3-tuple for the copies of users, texts and online.
+        """
+        return dict(self.users), dict(self.texts), dict(self.online)
+
 
 class UsersTextManager(object):
     """Handles query/operations about users and texts.
 
     It main interface between CmdUI/TCPServer and TextChain.
 
+    The writers are serialized by a lock, each of them publishes a new
+    snapshot of the users and their texts after done, so the readers just
+    take the current snapshot without waiting for the writers.  A published
+    snapshot and the instances of UserInfo in it are never modified.
+
+    After a change which the other users should know (the text, a cursor, or
+    a user going online/offline), the listeners are called with the identity
+    of the user who made it.
+
     Attributes:
-        _users: A dict to stores users.
-            key: User identity.
-            value: An instance of UserInfo.
+        _view: The current instance of _UsersView.
         _text_chain: An instance of TextChain.
-        _rlock: A threading.RLock to prevent multi-threads access this class at
+        _rlock: A threading.RLock to prevent multi-threads modify this class at
                 the same time.
+        _listeners: A tuple of the functions to call after a change, it is
+                replaced instead of modified so it can be iterated without the
+                lock.
     """
-    def __init__(self, saved_filename):
+    def __init__(self, saved_filename, text_saver=None, text_journal=None):
         """Constructor.
 
         Args:
             saved_filename: Name of the file for TextChain to save the last
                     commit.
+            text_saver: An instance of TextSaver for TextChain to save the
+                    last commit in background, None for saving synchronously.
+            text_journal: An instance of TextJournal for TextChain to record
+                    the changes, None for no journal.
         """
-        self._users = {}
-        self._text_chain = TextChain(saved_filename)
+        self._view = _UsersView({}, {}, {})
+        self._text_chain = TextChain(saved_filename, text_saver=text_saver,
+                                     text_journal=text_journal)
         self._rlock = threading.RLock()
+        self._listeners = ()
+
+    def add_listener(self, listener):
+        """Adds a function to be called after each change.
+
+        It is called without the lock, and should return quickly.
+
+        Args:
+            listener: A function with the identity of the user who made the
+                    change as the argument.
+        """
+        with self._rlock:
+            self._listeners += (listener,)
+
+    def remove_listener(self, listener):
+        """Removes a function added by add_listener().
+
+        Args:
+            listener: The function.
+        """
+        with self._rlock:
+            self._listeners = tuple(func for func in self._listeners
+                                    if func is not listener)
 
     def add_user(self, identity, nick_name, authority):
         """Adds a user.
@@ -75,8 +168,9 @@ class UsersTextManager(object):
             authority: Authority of this user.
         """
         with self._rlock:
-            self._users[identity] = UserInfo(authority, nick_name)
-            self._users[identity].last_commit_id = self._text_chain.new()
+            tables = self._view.copy()
+            self._add_user(tables, identity, UserInfo(authority, nick_name))
+            self._view = _UsersView(*tables)
 
     def delete_user(self, identity):
         """Deletes a user.
@@ -85,20 +179,41 @@ class UsersTextManager(object):
             identity: Identity of this user.
         """
         with self._rlock:
-            self._text_chain.delete(self._users[identity].last_commit_id)
-            del self._users[identity]
+            tables = self._view.copy()
+            was_online = self._delete_user(tables, identity).mode != UNKNOWN
+            self._view = _UsersView(*tables)
+        if was_online:
+            self._notify(identity)
 
     def reset_user(self, identity):
         """Resets a user to the initial value.
 
+        Nothing happens if there is no such user.
+
         Args:
             identity: Identity of this user.
         """
         with self._rlock:
-            authority = self._users[identity].authority
-            nick_name = self._users[identity].nick_name
-            self.delete_user(identity)
-            self.add_user(identity, nick_name, authority)
+            tables = self._view.copy()
+            if identity not in tables[0]:
+                return
+            user = self._delete_user(tables, identity)
+            self._add_user(tables, identity, UserInfo(user.authority,
+                                                      user.nick_name))
+            self._view = _UsersView(*tables)
+        if user.mode != UNKNOWN:
+            self._notify(identity)
+
+    def get_user_info(self, identity):
+        """Gets a user's information.
+
+        Args:
+            identity: Identity of the user.
+
+        Return:
+            An instance of UserInfo, None if there is no such user.
+        """
+        return self._view.users.get(identity)
 
     def get_users_info(self, without=None, must_online=False):
         """Gets the users informations.
@@ -108,51 +223,211 @@ class UsersTextManager(object):
             must_online: A flag for whether just returns the one online or not.
 
         Return:
-            A dict with key=authority, value=instance of UserInfo.
+            A dict with key=authority, value=instance of UserInfo.  It should
+            not be modified.
+        """
+        view = self._view
+        users = view.online if must_online else view.users
+        if not without:
+            return users
+        return dict(pair for pair in users.items() if pair[0] not in without)
+
+    def patch_user_text(self, identity, new_user_info, patch, line_view=None):
+        """Updates a user's information with new information and a text patch.
+
+        Args:
+            identity: Identity of the user.
+            new_user_info: An instance of UserInfo.
+            patch: A list of (begin_row, end_row, lines) which changes the
+                    user's last commit text to the new one.
+            line_view: An instance of rope.LineView of the patched text, it is
+                    reused as the view of the new text if the same.
+
+        Return:
+            A 3-tuple for a instance of UserInfo, the new text (an instance of
+            rope.Rope) and the dict of the online users whose cursors are on
+            that text, which maps the identity to the instance of UserInfo and
+            should not be modified.  None if there is no such user, it might
+            be deleted by another thread.
+        """
+        return self._update_user(identity, new_user_info, patch, line_view)
+
+    def update_user_presence(self, identity, new_user_info):
+        """Updates a user's mode and cursors without changing the text.
+
+        If no commit after the user's last commit changes the text, only the
+        mode and the cursors are updated, the commits and the saved file are
+        left alone.  Otherwise the user is moved to the last text by an empty
+        commit, which rebases the cursors.
+
+        Args:
+            identity: Identity of the user.
+            new_user_info: An instance of UserInfo, the cursors are on the
+                    user's last commit text.
+
+        Return:
+            Same as patch_user_text().
         """
         with self._rlock:
-            without = without if without is not None else []
-            online_check = lambda x: (x != UNKNOWN if must_online else True)
-            return dict(pair for pair in self._users.items()
-                        if pair[0] not in without and \
-                           online_check(pair[1].mode))
+            users, texts, online = self._view.copy()
+            if identity not in users:
+                return None
+            stale = not self._text_chain.is_latest(
+                users[identity].last_commit_id)
+            if not stale:
+                old_user = users[identity]
+                user = users[identity] = old_user.copy()
+                user.mode = new_user_info.mode
+                user.cursors = dict(new_user_info.cursors)
+                changed = (user.mode != old_user.mode or
+                           user.cursors != old_user.cursors)
+                if changed:
+                    user.presence_version = next(_presence_counter)
+                if user.mode != UNKNOWN:
+                    online[identity] = user
+                else:
+                    online.pop(identity, None)
+                self._view = _UsersView(users, texts, online)
+        if stale:
+            return self._update_user(identity, new_user_info, [])
+        if changed:
+            self._notify(identity)
+        return (user, texts[identity], online)
+
+    def _update_user(self, identity, new_user_info, patch, line_view=None):
+        """Commits the change of a user and updates the other users.
 
-    def update_user_text(self, identity, new_user_info, new_text):
-        """Updates a user's information with new information and text.
+        The commit is prepared on the user's last commit text from the
+        snapshot before taking the lock, so the lock is only held for rebasing
+        it onto the newer commits.  If the user was reset meanwhile, it is
+        prepared again under the lock.
+
+        The presence version of a user increases if the row-col positions of
+        the cursors might change, that is the mode or a cursor changes, or
+        the text before a cursor changes.
 
         Args:
+            identity: Identity of the user.
             new_user_info: An instance of UserInfo.
-            new_text: New text.
+            patch: The patch for TextChain.prepare_commit_patch().
+            line_view: An instance of rope.LineView of the changed text before
+                    rebasing, None for unknown.
 
         Return:
-            A 2-tuple for a instance of UserInfo and a string.
+            Same as patch_user_text().
         """
+        view = self._view
+        if identity not in view.users:
+            return None
+        orig_id = view.users[identity].last_commit_id
+        commit = self._text_chain.prepare_commit_patch(view.texts[identity],
+                                                       patch)
         with self._rlock:
+            users, texts, online = self._view.copy()
+            if identity not in users:
+                return None
+            if users[identity].last_commit_id != orig_id:
+                orig_id = users[identity].last_commit_id
+                commit = self._text_chain.prepare_commit_patch(texts[identity],
+                                                               patch)
             curmarks = new_user_info.cursors.keys()
             curs = [new_user_info.cursors[mark] for mark in curmarks]
-            new_commit_id, new_text, new_curs = self._text_chain.commit(
-                self._users[identity].last_commit_id, new_text, curs)
-            self._users[identity].last_commit_id = new_commit_id
-            self._users[identity].mode = new_user_info.mode
-            self._users[identity].cursors = dict(zip(curmarks, new_curs))
-            for iden, user in self._users.items():
-                if iden == identity:
-                    continue
-                curmarks = user.cursors.keys()
-                curs = [user.cursors[mark] for mark in curmarks]
-                new_curs = self._text_chain.update_cursors(curs)
-                user.cursors = dict(zip(curmarks, new_curs))
-            return (self._users[identity], new_text)
-
-    def get_user_text(self, identity):
-        """Gets the last commit text of a specified user.
+            changed = bool(commit.opers)
+            new_commit_id, new_text, new_curs = self._text_chain.append_commit(
+                orig_id, commit, curs, line_view)
+            old_user = users[identity]
+            user = users[identity] = old_user.copy()
+            user.last_commit_id = new_commit_id
+            user.mode = new_user_info.mode
+            user.cursors = dict(zip(curmarks, new_curs))
+            changed = (changed or user.mode != old_user.mode or
+                       user.cursors != old_user.cursors)
+            if changed:
+                user.presence_version = next(_presence_counter)
+            texts[identity] = new_text
+            if user.mode != UNKNOWN:
+                online[identity] = user
+            else:
+                online.pop(identity, None)
+            first_changed = self._text_chain.get_last_changed_position()
+            # Updates the cursors of all the other online users in one batch.
+            others = [iden for iden, other in online.items()
+                      if iden != identity and other.cursors]
+            curmarks = [list(users[iden].cursors.keys()) for iden in others]
+            new_curs = self._text_chain.update_cursors(
+                [users[iden].cursors[mark]
+                 for iden, marks in zip(others, curmarks) for mark in marks])
+            begin = 0
+            for iden, marks in zip(others, curmarks):
+                end = begin + len(marks)
+                old_curs = users[iden].cursors
+                users[iden] = online[iden] = users[iden].copy()
+                users[iden].cursors = dict(zip(marks, new_curs[begin : end]))
+                if users[iden].cursors != old_curs or \
+                        first_changed is not None and \
+                        any(pos > first_changed for pos in old_curs.values()):
+                    users[iden].presence_version = next(_presence_counter)
+                begin = end
+            self._view = _UsersView(users, texts, online)
+        if changed:
+            self._notify(identity)
+        return (user, new_text, online)
+
+    def get_user_line_view(self, identity):
+        """Gets the last commit text of a specified user split into lines.
+
+        The view is cached with the text of the commit, so the later requests
+        on the same commit do not split the text again.
 
         Args:
             identity: The identity of that user.
 
         Return:
-            The text.
+            An instance of rope.LineView, it should not be modified.  None if
+            there is no such user.
         """
-        with self._rlock:
-            return self._text_chain.get_text(
-                self._users[identity].last_commit_id)
+        text = self._view.texts.get(identity)
+        return text.line_view() if text is not None else None
+
+    def _notify(self, identity):
+        """Calls the listeners after a change.
+
+        Args:
+            identity: Identity of the user who made the change.
+        """
+        for listener in self._listeners:
+            listener(identity)
+
+    def _add_user(self, tables, identity, user):
+        """Adds a user into the unpublished tables.
+
+        Args:
+            tables: The 3-tuple from _UsersView.copy() to be modified.
+            identity: Identity of this user.
+            user: An instance of UserInfo for this user.
+        """
+        users, texts, online = tables
+        user.last_commit_id = self._text_chain.new()
+        user.key = next(_presence_counter)
+        user.presence_version = next(_presence_counter)
+        users[identity] = user
+        texts[identity] = self._text_chain.get_rope(user.last_commit_id)
+        if user.mode != UNKNOWN:
+            online[identity] = user
+
+    def _delete_user(self, tables, identity):
+        """Deletes a user from the unpublished tables.
+
+        Args:
+            tables: The 3-tuple from _UsersView.copy() to be modified.
+            identity: Identity of this user.
+
+        Return:
+            The instance of UserInfo of the deleted user.
+        """
+        users, texts, online = tables
+        user = users.pop(identity)
+        del texts[identity]
+        online.pop(identity, None)
+        self._text_chain.delete(user.last_commit_id)
+        return user
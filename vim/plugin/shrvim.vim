@@ -28,6 +28,11 @@ autocmd! CursorHold * call _ShrVimAutoSync(1)
 autocmd! CursorMovedI * call _ShrVimAutoSync(3)
 autocmd! CursorHoldI * call _ShrVimAutoSync(3)
 
+" Checks the updates pushed by the server while vim is idle.
+if has('timers')
+    call timer_start(200, '_ShrVimApplyPushes', {'repeat': -1})
+endif
+
 
 """"""""""""""""""""""""""""""""""" Functions """"""""""""""""""""""""""""""""""
 function! _ShrVimTryUsePython3(show_err)
@@ -81,16 +86,25 @@ function! _ShrVimAutoSync(level)
 endfunction
 
 
+function! _ShrVimApplyPushes(timer)
+    call _ShrVimCallPythonFunc('apply_pushes', [])
+endfunction
+
+
 function! _ShrVimSetup()
 ShrVimPython << EOF
 # python << EOF
 # ^^ Force vim highlighting the python code below.
+import difflib
 import json
 import socket
 import sys
+import threading
 import vim
+import zlib
 
 if sys.version_info[0] == 3:
+    long = int
     unicode = str
 
 class CURSOR_MARK:  # pylint:disable=W0232
@@ -115,13 +129,18 @@ class MODE:  # pylint:disable=W0232
 
 class VARNAMES:  # pylint: disable=W0232
     """Enumeration types of variable name in vim."""
+    BASE = 'base'  # Id of the commit which the lines are.
+    DOCUMENT = 'document'  # Name of the document in the server.
     GROUP_NAME_PREFIX = 'gnp_'  # Group name's prefix.
     IDENTITY = 'identity'  # Identity of the user.
     INIT = 'init'  # Initial or not.
     LINES = 'lines'  # Lines.
     NUM_GROUPS = 'num_groups'  # Number of groups.
+    OTHERS = 'others'  # Informations of the other users by their keys.
+    PRESENCE = 'presence'  # Id of the informations of the other users.
     SERVER_NAME = 'server_name'  # Server name.
     SERVER_PORT = 'port'  # Server port.
+    SUBSCRIBER = 'subscriber'  # Receiver of the updates pushed by server.
     TIMEOUT = 'timeout'  # Timeout for TCPConnection.
     USERS = 'users'  # List of users.
 
@@ -138,18 +157,32 @@ VISUAL_GROUP = lambda x: 'ShrVimVbk%d' % x
 DEFAULT_TIMEOUT = 1
 DEFAULT_NUM_GROUPS = 5
 
+# Error from the server if the diff is not based on the last synced text.
+STALE_BASE_ERROR = 'Stale base.'
+
 
 class JSON_TOKEN:  # pylint:disable=W0232
     """Enumeration the Ttken strings for json object."""
+    BASE = 'base'  # id of the commit which the diff is based on.
     BYE = 'bye'  # Resets the user and do nothong.
+    CODEC = 'codec'  # version of the binary codec the server accepted.
+    CODECS = 'codecs'  # versions of the binary codec the client supports.
+    COMPRESS = 'compress'  # the client/server can decompress by zlib.
     CURSORS = 'cursors'  # other users' cursor position
     DIFF = 'diff'  # Difference between this time and last time.
+    DOCUMENT = 'document'  # name of the document, default if not given.
     ERROR = 'error'  # error string
+    GONE = 'gone'  # keys of the other users gone since the acknowledged one.
     IDENTITY = 'identity'  # identity of myself
     INIT = 'init'  # initialize connect flag
+    KEY = 'key'  # key of another user in the presence.
     MODE = 'mode'  # vim mode.
     NICKNAME = 'nickname'  # nick name of the user.
     OTHERS = 'others'  # other users info.
+    PRESENCE = 'presence'  # id of the other users info the client applied.
+    REQUEST_ID = 'request_id'  # id of the request, echoed by the response.
+    SUBSCRIBE = 'subscribe'  # Turns the connection to receive the updates.
+    UPDATE = 'update'  # version of the pushed update notification.
 
 
 ############### Handler for Variable stores only in python #####################
@@ -644,6 +677,234 @@ class VimInfo(with_metaclass(VimInfoMeta, object)):  # pylint: disable=W0232
 
 
 ########################### About connection to server #########################
+class BinaryCodecError(Exception):
+    """Error raised by BinaryCodec."""
+    pass
+
+class BinaryCodec(object):  # pylint: disable=W0232
+    """A compact binary encoding for the json objects, same as the server's.
+
+    The layout is a subset of MessagePack with varint lengths:
+        0x00 - 0x7f: The integer itself.
+        0xc0: None.
+        0xc2, 0xc3: False, True.
+        0xd0 <varint>: An integer, zigzag encoded.
+        0xd8 <varint n> <varint size> <bytes>: A list of n strings without
+                newline characters, the UTF-8 encoded lines joined by "\\n".
+        0xd9 <varint size> <bytes>: A UTF-8 encoded string.
+        0xdc <varint n> <items>: A list.
+        0xde <varint n> <keys and values>: A dict.
+
+    Static attributes:
+        VERSION: Version of the encoding.
+        _ENCODING: Encoding of the strings.
+    """
+    VERSION = 1
+    _ENCODING = 'utf-8'
+    _MAX_FIXINT = 0x7f
+    _NONE = 0xc0
+    _FALSE = 0xc2
+    _TRUE = 0xc3
+    _INT = 0xd0
+    _LINES = 0xd8
+    _STR = 0xd9
+    _LIST = 0xdc
+    _DICT = 0xde
+
+    @staticmethod
+    def dumps(obj):
+        """Encodes an object.
+
+        Args:
+            obj: The object.
+
+        Return:
+            The bytes.
+        """
+        out = bytearray()
+        BinaryCodec._dump(obj, out)
+        return bytes(out)
+
+    @staticmethod
+    def loads(data):
+        """Decodes an object.
+
+        Args:
+            data: The bytes from dumps().
+
+        Return:
+            The object.
+        """
+        data = bytearray(data)
+        try:
+            obj, pos = BinaryCodec._load(data, 0)
+        except (IndexError, UnicodeError) as e:
+            raise BinaryCodecError('Cannot decode the bytes: %r' % e)
+        if pos != len(data):
+            raise BinaryCodecError('Extra bytes after the object.')
+        return obj
+
+    @staticmethod
+    def _encode(string):
+        """Encodes a string to UTF-8 bytes, bytes are kept.
+
+        Args:
+            string: The string.
+
+        Return:
+            The bytes.
+        """
+        if isinstance(string, unicode):
+            return string.encode(BinaryCodec._ENCODING)
+        return string
+
+    @staticmethod
+    def _dump(obj, out):
+        """Encodes an object to the end of a bytearray.
+
+        Args:
+            obj: The object.
+            out: The bytearray.
+        """
+        cls = BinaryCodec
+        if obj is None:
+            out.append(cls._NONE)
+        elif obj is True or obj is False:
+            out.append(cls._TRUE if obj else cls._FALSE)
+        elif isinstance(obj, (int, long)):
+            if 0 <= obj <= cls._MAX_FIXINT:
+                out.append(obj)
+            else:
+                out.append(cls._INT)
+                cls._dump_varint(obj * 2 if obj >= 0 else -obj * 2 - 1, out)
+        elif isinstance(obj, (bytes, unicode)):
+            data = cls._encode(obj)
+            out.append(cls._STR)
+            cls._dump_varint(len(data), out)
+            out += data
+        elif isinstance(obj, (list, tuple)):
+            if obj and all(isinstance(item, (bytes, unicode)) for item in obj):
+                data = b'\n'.join(cls._encode(item) for item in obj)
+                if data.count(b'\n') == len(obj) - 1:
+                    out.append(cls._LINES)
+                    cls._dump_varint(len(obj), out)
+                    cls._dump_varint(len(data), out)
+                    out += data
+                    return
+            out.append(cls._LIST)
+            cls._dump_varint(len(obj), out)
+            for item in obj:
+                cls._dump(item, out)
+        elif isinstance(obj, dict):
+            out.append(cls._DICT)
+            cls._dump_varint(len(obj), out)
+            for key, value in obj.items():
+                cls._dump(key, out)
+                cls._dump(value, out)
+        else:
+            raise BinaryCodecError('Cannot encode the type %r.' % type(obj))
+
+    @staticmethod
+    def _dump_varint(num, out):
+        """Encodes a non-negative integer by 7 bits per byte.
+
+        Args:
+            num: The integer.
+            out: The bytearray.
+        """
+        while num > 0x7f:
+            out.append(num & 0x7f | 0x80)
+            num >>= 7
+        out.append(num)
+
+    @staticmethod
+    def _load(data, pos):
+        """Decodes an object from a position.
+
+        Args:
+            data: The bytearray.
+            pos: The position.
+
+        Return:
+            A 2-tuple for the object and the position after it.
+        """
+        cls = BinaryCodec
+        tag, pos = data[pos], pos + 1
+        if tag <= cls._MAX_FIXINT:
+            return tag, pos
+        if tag == cls._NONE:
+            return None, pos
+        if tag in (cls._FALSE, cls._TRUE):
+            return tag == cls._TRUE, pos
+        if tag == cls._INT:
+            num, pos = cls._load_varint(data, pos)
+            return (num >> 1 if num & 1 == 0 else -(num >> 1) - 1), pos
+        if tag == cls._STR:
+            size, pos = cls._load_varint(data, pos)
+            return cls._load_str(data, pos, size), pos + size
+        if tag == cls._LINES:
+            num, pos = cls._load_varint(data, pos)
+            size, pos = cls._load_varint(data, pos)
+            lines = cls._load_str(data, pos, size).split(u'\n')
+            if len(lines) != num:
+                raise BinaryCodecError('Wrong number of lines.')
+            return lines, pos + size
+        if tag == cls._LIST:
+            num, pos = cls._load_varint(data, pos)
+            ret = []
+            for _ in range(num):
+                item, pos = cls._load(data, pos)
+                ret.append(item)
+            return ret, pos
+        if tag == cls._DICT:
+            num, pos = cls._load_varint(data, pos)
+            ret = {}
+            for _ in range(num):
+                key, pos = cls._load(data, pos)
+                if isinstance(key, (list, dict)):
+                    raise BinaryCodecError('Unhashable key.')
+                ret[key], pos = cls._load(data, pos)
+            return ret, pos
+        raise BinaryCodecError('Unknown tag %r.' % tag)
+
+    @staticmethod
+    def _load_varint(data, pos):
+        """Decodes a non-negative integer encoded by _dump_varint().
+
+        Args:
+            data: The bytearray.
+            pos: The position.
+
+        Return:
+            A 2-tuple for the integer and the position after it.
+        """
+        num = data[pos]
+        if num <= 0x7f:
+            return num, pos + 1
+        num, shift = 0, 0
+        while data[pos] & 0x80:
+            num |= (data[pos] & 0x7f) << shift
+            shift += 7
+            pos += 1
+        return num | data[pos] << shift, pos + 1
+
+    @staticmethod
+    def _load_str(data, pos, size):
+        """Decodes a UTF-8 string.
+
+        Args:
+            data: The bytearray.
+            pos: Begin of the string.
+            size: Number of bytes of the string.
+
+        Return:
+            The string.
+        """
+        if pos + size > len(data):
+            raise BinaryCodecError('The string is truncated.')
+        return bytes(data[pos : pos + size]).decode(BinaryCodec._ENCODING)
+
+
 class JSONPackageError(Exception):
     """Error raised by JSONPackage."""
     pass
@@ -651,16 +912,36 @@ class JSONPackageError(Exception):
 class JSONPackage(object):
     """Send/receive json object by gived function.
 
+    The header of a package with flags is _FLAGS_MARK, one digit of the
+    _FLAG_* bits and the length of the body, see the server's JSONPackage.
+
     Attributes:
         content: Content of the package body.
+        binary: Whether the body is encoded by BinaryCodec instead of json.
+        compress: Whether to compress the body by zlib if it is not shorter
+                than _COMPRESS_THRESHOLD.
 
     Static attributes:
+        _COMPRESS_LEVEL: Level of zlib to compress the bodies.
+        _COMPRESS_THRESHOLD: Bodies shorter than this are never compressed.
         _ENCODING: Encoding of the package.
+        _FLAG_BINARY: Flag for the body encoded by BinaryCodec.
+        _FLAG_ZLIB: Flag for the body compressed by zlib.
+        _FLAGS_MARK: First character of the header with flags.
         _HEADER_LENGTH: Length of the header.
+        _MAX_FLAGGED_LENGTH: Maximum length of the body of a package with
+                flags, both before and after zlib.
     """
+    _COMPRESS_LEVEL = 6
+    _COMPRESS_THRESHOLD = 1024
     _ENCODING = 'utf-8'
+    _FLAG_BINARY = 1
+    _FLAG_ZLIB = 2
+    _FLAGS_MARK = u'#'
     _HEADER_LENGTH = 10
-    def __init__(self, content=None, recv_func=None):
+    _MAX_FLAGGED_LENGTH = 10 ** (_HEADER_LENGTH - 2) - 1
+    def __init__(self, content=None, recv_func=None, binary=False,
+                 compress=False):
         """Constructor.
 
         If the receive_func is not None, it will grap the default content by
@@ -671,8 +952,12 @@ class JSONPackage(object):
         Args:
             content: The default content of this package.
             recv_func: A function for receive the default content.
+            binary: Whether to encode by BinaryCodec instead of json.
+            compress: Whether to compress a large body by zlib.
         """
         self.content = content
+        self.binary = binary
+        self.compress = compress
         if recv_func is not None:
             self.recv(recv_func)
 
@@ -682,14 +967,37 @@ class JSONPackage(object):
         Args:
             send_func: A function which will send the whole data gived.
                 Function format:
-                    send_func(bytes_data): None
+                    send_func(header_bytes, body_bytes): None
         """
         try:
-            body = json.dumps(self.content)
-            header_str = ('%%0%dd' % JSONPackage._HEADER_LENGTH) % len(body)
-            send_func(header_str + body)
+            flags = 0
+            if self.binary:
+                body = BinaryCodec.dumps(self.content)
+                flags |= JSONPackage._FLAG_BINARY
+            else:
+                body = json.dumps(self.content).encode(JSONPackage._ENCODING)
+            if self.compress and JSONPackage._COMPRESS_THRESHOLD <= \
+                    len(body) <= JSONPackage._MAX_FLAGGED_LENGTH:
+                compressed = zlib.compress(body, JSONPackage._COMPRESS_LEVEL)
+                if len(compressed) < len(body):
+                    body = compressed
+                    flags |= JSONPackage._FLAG_ZLIB
+            if len(body) > (JSONPackage._MAX_FLAGGED_LENGTH if flags else
+                            10 ** JSONPackage._HEADER_LENGTH - 1):
+                # The length would not fit in the header.
+                raise JSONPackageError('The body is too long.')
+            if flags:
+                header_str = JSONPackage._FLAGS_MARK + \
+                        ('%%d%%0%dd' % (JSONPackage._HEADER_LENGTH - 2)) % \
+                        (flags, len(body))
+            else:
+                header_str = \
+                        ('%%0%dd' % JSONPackage._HEADER_LENGTH) % len(body)
+            send_func(header_str.encode(JSONPackage._ENCODING), body)
         except TypeError as e:
             raise JSONPackageError('json: %s' % str(e))
+        except BinaryCodecError as e:
+            raise JSONPackageError('binary codec: %s' % str(e))
         except UnicodeError as e:
             raise JSONPackageError('Cannot encode the string: %s.' % str(e))
 
@@ -703,24 +1011,50 @@ class JSONPackage(object):
             recv_func: A function to be called to get the serialize data.
         """
         try:
-            header_str = unicode(recv_func(JSONPackage._HEADER_LENGTH),
-                                 JSONPackage._ENCODING)
-            body_str = unicode(recv_func(int(header_str)),
-                               JSONPackage._ENCODING)
+            header_str = recv_func(JSONPackage._HEADER_LENGTH).decode(
+                JSONPackage._ENCODING)
+            flags = 0
+            if header_str.startswith(JSONPackage._FLAGS_MARK):
+                flags, header_str = int(header_str[1]), header_str[2 : ]
+                if flags & ~(JSONPackage._FLAG_BINARY | JSONPackage._FLAG_ZLIB):
+                    raise JSONPackageError('Unsupported flags %r.' % flags)
+            body = recv_func(int(header_str))
         except UnicodeError as e:
             raise JSONPackageError('Cannot decode the bytes: %r.' % e)
         except ValueError as e:
             raise JSONPackageError('Cannot get the body length %r' % e)
+        if flags & JSONPackage._FLAG_ZLIB:
+            # Limits the output, a small body might expand to gigabytes.
+            decompressor = zlib.decompressobj()
+            try:
+                # Python 2's zlib does not take a bytearray.
+                body = decompressor.decompress(
+                    bytes(body), JSONPackage._MAX_FLAGGED_LENGTH)
+            except zlib.error as e:
+                raise JSONPackageError('Cannot decompress the body: %r' % e)
+            if decompressor.unconsumed_tail:
+                raise JSONPackageError('The decompressed body is too long.')
+        self.binary = bool(flags & JSONPackage._FLAG_BINARY)
+        if self.binary:
+            try:
+                self.content = BinaryCodec.loads(body)
+            except BinaryCodecError as e:
+                raise JSONPackageError('Cannot decode the body: %r' % e)
+            return
         try:
-            self.content = json.loads(body_str)
+            self.content = json.loads(body.decode(JSONPackage._ENCODING))
+        except UnicodeError as e:
+            raise JSONPackageError('Cannot decode the bytes: %r.' % e)
         except ValueError as e:
             raise JSONPackageError('Cannot loads to the json object: %r' % e)
 
-
 class TCPConnection(object):
     """My custom tcp connection.
 
     Args:
+        binary: Whether the packages are encoded by BinaryCodec, None before
+                negotiating with the server.
+        compress: Whether the large packages are compressed by zlib.
         _conn: The TCP-connection.
     """
     def __init__(self, conn):
@@ -729,33 +1063,57 @@ class TCPConnection(object):
         Args:
             conn: TCP-connection.
         """
+        self.binary = None
+        self.compress = False
         self._conn = conn
         self._conn.settimeout(py_bvars.get(VARNAMES.TIMEOUT, DEFAULT_TIMEOUT))
 
-    def send_all(self, data):
-        """Sends the data until timeout or the socket closed.
+    def send_all(self, *buffers):
+        """Sends the buffers in order until timeout or the socket closed.
+
+        The buffers are sent by one sendmsg() without joining them if the
+        platform supports it.
 
         Args:
-            data: Data to be sent.
+            buffers: Bytes to be sent.
         """
-        self._conn.sendall(data)
+        if not hasattr(self._conn, 'sendmsg'):
+            for buf in buffers:
+                self._conn.sendall(buf)
+            return
+        views = [memoryview(buf) for buf in buffers if len(buf)]
+        while views:
+            sent_byte = self._conn.sendmsg(views)
+            while views and sent_byte >= len(views[0]):
+                sent_byte -= len(views.pop(0))
+            if views:
+                views[0] = views[0][sent_byte : ]
 
     def recv_all(self, nbyte):
         """Receives the data until timeout or the socket closed.
 
+        If the data do not arrive at once, the left parts are received into
+        one buffer allocated in advance instead of concatenating the parts.
+
         Args:
             nbyte: Bytes of data to receive.
 
         Return:
-            Bytes of data.
+            Bytes or bytearray of the data.
         """
-        ret = b''
-        while nbyte > 0:
-            recv = self._conn.recv(nbyte)
-            if not recv:
+        ret = self._conn.recv(nbyte)
+        if not ret and nbyte > 0:
+            raise socket.error('Connection die.')
+        if len(ret) == nbyte:
+            return ret
+        first_part, ret = ret, bytearray(nbyte)
+        ret[ : len(first_part)] = first_part
+        view, recvd_byte = memoryview(ret), len(first_part)
+        while recvd_byte < nbyte:
+            recv_byte = self._conn.recv_into(view[recvd_byte : ])
+            if not recv_byte:
                 raise socket.error('Connection die.')
-            ret += recv
-            nbyte -= len(recv)
+            recvd_byte += recv_byte
         return ret
 
     def close(self):
@@ -775,8 +1133,10 @@ class TCPClient(object):
 
     Static attributes:
         _conns: A dict stores connections.
+        _last_request_id: Id of the last request.
     """
     _conns = {}
+    _last_request_id = 0
     def __init__(self, server_name, port_name):
         """Constructor, automatically connects to the server.
 
@@ -799,15 +1159,39 @@ class TCPClient(object):
     def request(self, req):
         """Sends a request to server and get the response.
 
+        The first request of a connection is in json and asks for the binary
+        codec and the compression, the later ones are in binary and compressed
+        if large when the server accepted them, or in plain json for an old
+        server.
+
         Args:
             req: An request.
 
         Return:
             The response.
         """
+        TCPClient._last_request_id += 1
+        req[JSON_TOKEN.REQUEST_ID] = TCPClient._last_request_id
+        negotiating = self._conn.binary is None
+        if negotiating:
+            req[JSON_TOKEN.CODECS] = [BinaryCodec.VERSION]
+            req[JSON_TOKEN.COMPRESS] = True
         try:
-            JSONPackage(req).send(self._conn.send_all)
-            return JSONPackage(recv_func=self._conn.recv_all).content
+            JSONPackage(req, binary=bool(self._conn.binary),
+                        compress=self._conn.compress).send(self._conn.send_all)
+            while True:
+                response = JSONPackage(recv_func=self._conn.recv_all).content
+                # Skips the responses to the other requests, an old server
+                # does not echo the request id.
+                if response.get(JSON_TOKEN.REQUEST_ID,
+                                req[JSON_TOKEN.REQUEST_ID]) == \
+                        req[JSON_TOKEN.REQUEST_ID]:
+                    if negotiating:
+                        self._conn.binary = response.get(
+                            JSON_TOKEN.CODEC) == BinaryCodec.VERSION
+                        self._conn.compress = \
+                                response.get(JSON_TOKEN.COMPRESS) is True
+                    return response
         except socket.error as e:
             self.close()
             raise TCPClientError(e)
@@ -823,6 +1207,71 @@ class TCPClient(object):
                 break
 
 
+class Subscriber(threading.Thread):
+    """A thread receives the update notifications pushed by the server.
+
+    The notifications are only recorded here, the buffer is synced by the vim
+    timer in the main thread.
+
+    Attributes:
+        _sock: The socket of the subscription.
+        _conn: An instance of TCPConnection of the socket.
+        _pushed: A threading.Event set when there are new updates.
+    """
+    def __init__(self, server_name, port_name, request):
+        """Constructor, automatically connects and subscribes.
+
+        Args:
+            server_name: Server name.
+            port_name: Port name.
+            request: The subscribing request.
+        """
+        super(Subscriber, self).__init__()
+        self.daemon = True
+        self._pushed = threading.Event()
+        try:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.connect((server_name, port_name))
+            self._conn = TCPConnection(self._sock)
+            JSONPackage(request).send(self._conn.send_all)
+            response = JSONPackage(recv_func=self._conn.recv_all).content
+        except (TypeError, socket.error, JSONPackageError) as e:
+            raise TCPClientError('Cannot subscribe the updates: %s' % str(e))
+        if JSON_TOKEN.ERROR in response:
+            self._sock.close()
+            raise TCPClientError(response[JSON_TOKEN.ERROR])
+        # Waits for the updates as long as the connection lives.
+        self._sock.settimeout(None)
+
+    def run(self):
+        """Runs the thread."""
+        try:
+            while True:
+                content = JSONPackage(recv_func=self._conn.recv_all).content
+                if JSON_TOKEN.UPDATE in content:
+                    self._pushed.set()
+        except (socket.error, JSONPackageError):
+            pass
+
+    def take_pushed(self):
+        """Takes the updates notified after the last call.
+
+        Return:
+            True if there are new updates.
+        """
+        pushed = self._pushed.is_set()
+        self._pushed.clear()
+        return pushed
+
+    def stop(self):
+        """Closes the subscription."""
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
+
+
 ################################ Some operations ###############################
 def init_for_this_time():
     py_bvars.curr_scope = vim.current.buffer
@@ -835,15 +1284,22 @@ def get_my_info(init):
     Return:
         The information for server.
     """
-    return {JSON_TOKEN.IDENTITY : py_bvars[VARNAMES.IDENTITY],
-            JSON_TOKEN.INIT : init,
-            JSON_TOKEN.MODE : VimInfo.mode,
-            JSON_TOKEN.CURSORS : {
-                CURSOR_MARK.CURRENT : VimInfo.cursors[CURSOR_MARK.CURRENT],
-                CURSOR_MARK.V : VimInfo.cursors[CURSOR_MARK.V],
-            },
-            JSON_TOKEN.DIFF : VimInfo.lines.gen_patch(
-                py_bvars.get(VARNAMES.LINES, ['']))}
+    ret = {JSON_TOKEN.IDENTITY : py_bvars[VARNAMES.IDENTITY],
+           JSON_TOKEN.INIT : init,
+           JSON_TOKEN.MODE : VimInfo.mode,
+           JSON_TOKEN.CURSORS : {
+               CURSOR_MARK.CURRENT : VimInfo.cursors[CURSOR_MARK.CURRENT],
+               CURSOR_MARK.V : VimInfo.cursors[CURSOR_MARK.V],
+           },
+           JSON_TOKEN.DIFF : VimInfo.lines.gen_patch(
+               py_bvars.get(VARNAMES.LINES, [''])),
+           JSON_TOKEN.PRESENCE : 0 if init else py_bvars.get(
+               VARNAMES.PRESENCE, 0)}
+    if VARNAMES.DOCUMENT in py_bvars:
+        ret[JSON_TOKEN.DOCUMENT] = py_bvars[VARNAMES.DOCUMENT]
+    if not init and VARNAMES.BASE in py_bvars:
+        ret[JSON_TOKEN.BASE] = py_bvars[VARNAMES.BASE]
+    return ret
 
 
 def set_my_info(json_info):
@@ -854,6 +1310,8 @@ def set_my_info(json_info):
     """
     VimInfo.lines.apply_patch(json_info[JSON_TOKEN.DIFF])
     py_bvars[VARNAMES.LINES] = VimInfo.lines[:]
+    if JSON_TOKEN.BASE in json_info:
+        py_bvars[VARNAMES.BASE] = json_info[JSON_TOKEN.BASE]
     mode = json_info[JSON_TOKEN.MODE]
     VimInfo.mode = mode
     if mode in (MODE.VISUAL, MODE.BLOCK_VISUAL, MODE.LINE_VISUAL):
@@ -865,13 +1323,38 @@ def set_my_info(json_info):
         json_info[JSON_TOKEN.CURSORS][CURSOR_MARK.CURRENT]
 
 
-def set_others_info(json_info):
-    """Sets the informations about other user.
+def merge_others_info(json_info):
+    """Merges the informations about other users gived by server.
+
+    A response with the keys of the gone users only carries the changed users,
+    otherwise it carries all the other users.
 
     Args:
         json_info: JSON information gived by server.
+
+    Return:
+        List of the informations of all the other users.
+    """
+    others = {}
+    if JSON_TOKEN.GONE in json_info:
+        others.update(py_bvars.get(VARNAMES.OTHERS, {}))
+        for key in json_info[JSON_TOKEN.GONE]:
+            others.pop(key, None)
+    for index, user in enumerate(json_info[JSON_TOKEN.OTHERS]):
+        # An old server does not give the keys.
+        others[user.get(JSON_TOKEN.KEY, index)] = user
+    py_bvars[VARNAMES.OTHERS] = others
+    if JSON_TOKEN.PRESENCE in json_info:
+        py_bvars[VARNAMES.PRESENCE] = json_info[JSON_TOKEN.PRESENCE]
+    return [others[key] for key in sorted(others)]
+
+
+def set_others_info(users):
+    """Sets the informations about other user.
+
+    Args:
+        users: List of the informations of the other users.
     """
-    users = json_info[JSON_TOKEN.OTHERS]
     VimInfo.highlight.reset([user[JSON_TOKEN.NICKNAME] for user in users])
     for user in users:
         name, mode = user[JSON_TOKEN.NICKNAME], user[JSON_TOKEN.MODE]
@@ -935,13 +1418,14 @@ def set_other_block_visual(name, beg, end):
 
 
 ############################## Supported operations ############################
-def connect(server_name, server_port, identity):
+def connect(server_name, server_port, identity, document=None):
     """Connects to the server.
 
     Args:
         server_name: Server name.
         server_port: Server port.
         identity: Identity string of this user.
+        document: Name of the document in the server, None for the default one.
     """
     init_for_this_time()
     if len(VimInfo.lines) > 1 or len(VimInfo.lines[0]) > 0:
@@ -954,7 +1438,41 @@ def connect(server_name, server_port, identity):
     py_bvars[VARNAMES.SERVER_NAME] = server_name
     py_bvars[VARNAMES.SERVER_PORT] = int(server_port)
     py_bvars[VARNAMES.IDENTITY] = identity
+    if document is not None:
+        py_bvars[VARNAMES.DOCUMENT] = document
+    elif VARNAMES.DOCUMENT in py_bvars:
+        del py_bvars[VARNAMES.DOCUMENT]
     sync(init=True)
+    subscribe()
+
+
+def subscribe():
+    """Subscribes the updates pushed by the server if vim has timers."""
+    if VARNAMES.SUBSCRIBER in py_bvars:
+        py_bvars[VARNAMES.SUBSCRIBER].stop()
+        del py_bvars[VARNAMES.SUBSCRIBER]
+    if not int(vim.eval("has('timers')")):
+        return
+    request = {JSON_TOKEN.IDENTITY : py_bvars[VARNAMES.IDENTITY],
+               JSON_TOKEN.SUBSCRIBE : True}
+    if VARNAMES.DOCUMENT in py_bvars:
+        request[JSON_TOKEN.DOCUMENT] = py_bvars[VARNAMES.DOCUMENT]
+    try:
+        subscriber = Subscriber(py_bvars[VARNAMES.SERVER_NAME],
+                                py_bvars[VARNAMES.SERVER_PORT], request)
+    except TCPClientError as e:
+        print(str(e))
+        return
+    subscriber.start()
+    py_bvars[VARNAMES.SUBSCRIBER] = subscriber
+
+
+def apply_pushes():
+    """Syncs the current buffer if the server pushed any update."""
+    init_for_this_time()
+    subscriber = py_bvars.get(VARNAMES.SUBSCRIBER)
+    if subscriber and subscriber.take_pushed():
+        vim.command('call _ShrVimAutoSync(1)')
 
 
 def sync(init=False):
@@ -963,23 +1481,108 @@ def sync(init=False):
     Args:
         init: Flag for whether it should tell the server to reset this user or
                 not.
+
+    Return:
+        True if the buffer is synced.
     """
     init_for_this_time()
     if VARNAMES.SERVER_NAME in py_bvars:
+        if VARNAMES.SUBSCRIBER in py_bvars:
+            # This sync gets the updates notified so far.
+            py_bvars[VARNAMES.SUBSCRIBER].take_pushed()
         try:
             conn = TCPClient(py_bvars[VARNAMES.SERVER_NAME],
                              py_bvars[VARNAMES.SERVER_PORT])
             response = conn.request(get_my_info(init))
         except TCPClientError as e:
             print(str(e))
-            return
+            return False
         if JSON_TOKEN.ERROR in response:
             print(response[JSON_TOKEN.ERROR])
-            return
+            if not init and response[JSON_TOKEN.ERROR] == STALE_BASE_ERROR:
+                # The server cannot tell what the buffer is based on, so
+                # gets the whole text again instead of failing every time.
+                return resync()
+            return False
         set_my_info(response)
-        set_others_info(response)
+        users = merge_others_info(response)
+        set_others_info(users)
         py_bvars[VARNAMES.USERS] = ', '.join(
-            [user[JSON_TOKEN.NICKNAME] for user in response[JSON_TOKEN.OTHERS]])
+            [user[JSON_TOKEN.NICKNAME] for user in users])
+        return True
+    return False
+
+
+def resync():
+    """Gets the whole text again and merges the unsynced changes into it.
+
+    The changes of the buffer from the last synced text are kept, they are
+    synced as usual in the next time.
+
+    Return:
+        True if the buffer is synced.
+    """
+    synced_lines = py_bvars.get(VARNAMES.LINES, [''])
+    local_lines = VimInfo.lines[:]
+    VimInfo.lines[:] = ['']
+    py_bvars[VARNAMES.LINES] = ['']
+    if not sync(init=True):
+        # Tries it again in the next time.
+        VimInfo.lines[:] = local_lines
+        py_bvars[VARNAMES.LINES] = synced_lines
+        return False
+    lines, conflicted = merge_lines(synced_lines, local_lines,
+                                    VimInfo.lines[:])
+    if lines != VimInfo.lines[:]:
+        VimInfo.lines[:] = lines
+    if conflicted:
+        print('Lines changed here and by others are kept as in this buffer.')
+    return True
+
+
+def merge_lines(base_lines, my_lines, their_lines):
+    """Merges the changes of two texts from the same text by lines.
+
+    Args:
+        base_lines: Lines of the original text.
+        my_lines: Lines of my text.
+        their_lines: Lines of their text.
+
+    Return:
+        2-tuple (lines, conflicted), the lines of the merged text and whether
+        any lines were changed differently, where my changes are kept.
+    """
+    def get_changes(lines, mine):
+        matcher = difflib.SequenceMatcher(None, base_lines, lines, False)
+        return [(beg, end, lines[new_beg : new_end], mine)
+                for tag, beg, end, new_beg, new_end in matcher.get_opcodes()
+                if tag != 'equal']
+    def do_changes(beg, end, changes):
+        ret, pos = [], beg
+        for chg_beg, chg_end, lines, _ in changes:
+            ret += base_lines[pos : chg_beg] + lines
+            pos = chg_end
+        return ret + base_lines[pos : end]
+    changes = sorted(get_changes(my_lines, True) +
+                     get_changes(their_lines, False),
+                     key=lambda change: change[ : 2])
+    ret, pos, conflicted = [], 0, False
+    while changes:
+        # Collects the changes overlapping each other.
+        beg, end = changes[0][ : 2]
+        group = [changes.pop(0)]
+        while changes and (changes[0][0] < end or changes[0][0] == beg):
+            end = max(end, changes[0][1])
+            group.append(changes.pop(0))
+        if all(change[3] == group[0][3] for change in group):
+            lines = do_changes(beg, end, group)
+        else:
+            lines = do_changes(beg, end, [c for c in group if c[3]])
+            conflicted = conflicted or lines != do_changes(
+                beg, end, [c for c in group if not c[3]])
+        ret += base_lines[pos : beg] + lines
+        pos = end
+    return ret + base_lines[pos : ], conflicted
 
 
 def disconnect():
@@ -991,15 +1594,28 @@ def disconnect():
         try:
             conn = TCPClient(py_bvars[VARNAMES.SERVER_NAME],
                              py_bvars[VARNAMES.SERVER_PORT])
-            conn.request({
-                JSON_TOKEN.BYE : True,
-                JSON_TOKEN.IDENTITY : py_bvars[VARNAMES.IDENTITY]})
+            request = {JSON_TOKEN.BYE : True,
+                       JSON_TOKEN.IDENTITY : py_bvars[VARNAMES.IDENTITY]}
+            if VARNAMES.DOCUMENT in py_bvars:
+                request[JSON_TOKEN.DOCUMENT] = py_bvars[VARNAMES.DOCUMENT]
+            conn.request(request)
         except TCPClientError as e:
             print(str(e))
         conn.close()
         del py_bvars[VARNAMES.SERVER_NAME]
         del py_bvars[VARNAMES.SERVER_PORT]
         del py_bvars[VARNAMES.IDENTITY]
+        if VARNAMES.DOCUMENT in py_bvars:
+            del py_bvars[VARNAMES.DOCUMENT]
+        if VARNAMES.BASE in py_bvars:
+            del py_bvars[VARNAMES.BASE]
+        if VARNAMES.OTHERS in py_bvars:
+            del py_bvars[VARNAMES.OTHERS]
+        if VARNAMES.PRESENCE in py_bvars:
+            del py_bvars[VARNAMES.PRESENCE]
+        if VARNAMES.SUBSCRIBER in py_bvars:
+            py_bvars[VARNAMES.SUBSCRIBER].stop()
+            del py_bvars[VARNAMES.SUBSCRIBER]
         print('bye')
 
 